@@ -0,0 +1,58 @@
+import csv
+import os
+import random
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from HashMap import HashMap
+from Package import Package
+from Scenario import DATA_DIR, PACKAGE_FILE
+from Truck import Truck
+
+
+# Times retrieve() on hash maps holding each of the given numbers of packages, and prints the average cost of a
+# single lookup. Lightweight stand-in objects are used instead of Package objects, since only the id is hashed,
+# so the benchmark measures the table itself and not the cost of parsing packages
+# Big-O: O(n) -> n being the largest size benchmarked
+def hashmap_benchmark(sizes=(40, 1000, 10000, 100000, 1000000), lookups=200000):
+    print("packages    capacity    ns per retrieve")
+    for size in sizes:
+        hashmap = HashMap()
+        for i in range(1, size + 1):
+            hashmap.insert(SimpleNamespace(id=i))
+        ids = [random.randint(1, size) for _ in range(lookups)]
+        retrieve = hashmap.retrieve
+        start = time.perf_counter()
+        for i in ids:
+            retrieve(i)
+        elapsed = time.perf_counter() - start
+        print(f"{size:>8}    {hashmap.capacity:>8}    {elapsed / lookups * 1e9:>15.0f}")
+
+
+# Measures the memory held per Package and per Truck object, by building count copies of the rows in the sample
+# package file and tracing how much memory stays allocated. Strings that are shared between rows, like the city or
+# the notes, are counted once, the same as they would be in a real manifest with repeated values. A relative file_name
+# is resolved against data_dir, the same as the data files of a Scenario
+# Big-O: O(n) -> n being count
+def memory_benchmark(count=100000, file_name=PACKAGE_FILE, data_dir=DATA_DIR):
+    with open(os.path.join(data_dir, file_name), "r") as file:
+        rows = [line[:8] for line in csv.reader(file)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    packages = []
+    for i in range(count):
+        id, address, city, state, zip, deadline, kilos, special_notes = rows[i % len(rows)]
+        packages.append(Package(i + 1, address, city, state, zip, deadline, kilos, special_notes))
+    package_bytes = (tracemalloc.get_traced_memory()[0] - before) / count
+    before = tracemalloc.get_traced_memory()[0]
+    trucks = [Truck(i) for i in range(count)]
+    truck_bytes = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+    print(f"bytes per package: {package_bytes:.0f}    bytes per truck: {truck_bytes:.0f}")
+    return packages, trucks
+
+
+if __name__ == "__main__":
+    hashmap_benchmark()
+    memory_benchmark()
@@ -0,0 +1,474 @@
+import argparse
+import contextlib
+import io
+import math
+import random
+import sys
+from itertools import permutations
+from types import SimpleNamespace
+
+from DeliveryRouting import NEARBY_DISTANCE, DeliveryCandidates, route_delivery
+from HashMap import HashMap
+from LivePlan import LivePlan
+from Package import AddressCorrection, Package, minutes, time_at
+from RouteImprovement import ExactRoute, RouteImprovement, improve_routes
+from Scenario import Scenario
+from Simulation import FleetSimulation
+from StatusIndex import AT_HUB, DELIVERED, EN_ROUTE, StatusIndex
+from Truck import Truck
+from TruckSort import load_trucks
+
+
+# Returns a sample scenario with its trucks loaded, and routed by FleetSimulation if routed is True. The printing of
+# loading and routing is discarded
+# Big-O: see load_trucks() and FleetSimulation.run()
+def planned_scenario(routed=True, shortest_paths=False, address_corrections=None):
+    scenario = Scenario(shortest_paths=shortest_paths, address_corrections=address_corrections)
+    with contextlib.redirect_stdout(io.StringIO()):
+        load_trucks(scenario)
+        if routed:
+            FleetSimulation(scenario).run()
+    return scenario
+
+
+# Returns a truck's route as a list of [distance_id, package ids, arrival] of each stop, for comparing routes
+# Big-O: O(n) -> n being the packages on the route
+def route_stops(truck):
+    return [[stop.distance_id, [p.id for p in stop.packages], stop.arrival] for stop in truck.route]
+
+
+# Returns the problems with a truck's route: every package on the truck must be delivered at exactly one stop at its
+# address, at the stop's arrival time, by the end of its time window (unless deadlines is False) and no earlier than
+# any correction of its address, stops must be in order of arrival, and the truck's mileage must be the length of the
+# route from and back to the hub
+# Big-O: O(n + c) -> n being the packages on the truck and c the address corrections
+def route_problems(scenario, truck, deadlines=True):
+    problems = []
+    corrected = {c.package_id: c.time for c in scenario.address_corrections}
+    on_route = [p for stop in truck.route for p in stop.packages]
+    if sorted(p.id for p in on_route) != sorted(p.id for p in truck.packages):
+        problems.append(f"truck {truck.truck} delivers packages {sorted(p.id for p in on_route)}, but has packages "
+                        f"{sorted(p.id for p in truck.packages)}")
+    previous = 0
+    mileage = 0
+    arrival = truck.departure_time
+    for stop in truck.route:
+        mileage += scenario.int_distance(previous, stop.distance_id)
+        previous = stop.distance_id
+        if stop.arrival < arrival:
+            problems.append(f"truck {truck.truck} arrives at distance_id {stop.distance_id} at {stop.arrival}, "
+                            f"before its previous stop or departure at {arrival}")
+        arrival = stop.arrival
+        for p in stop.packages:
+            if p.delivered != stop.arrival or p.truck != truck.truck or not p.on_truck:
+                problems.append(f"package {p.id} has delivery time {p.delivered} and truck {p.truck}, but is "
+                                f"delivered by truck {truck.truck} at {stop.arrival}")
+            if deadlines and minutes(stop.arrival) > p.latest:
+                problems.append(f"package {p.id} is delivered at {stop.arrival}, after the end of its time window")
+            if p.distance_id != stop.distance_id or p.id in corrected and stop.arrival < corrected[p.id]:
+                problems.append(f"package {p.id} for distance_id {p.distance_id} is delivered at distance_id "
+                                f"{stop.distance_id} at {stop.arrival}, its address being corrected at "
+                                f"{corrected.get(p.id)}")
+    if truck.route:
+        mileage += scenario.int_distance(previous, 0)
+    if abs(mileage - truck.mileage) > 1e-9:
+        problems.append(f"truck {truck.truck} has mileage {truck.mileage}, but its route is {mileage} miles")
+    return problems
+
+
+# Checks that FleetSimulation routes each truck the same as routing it on its own with route_delivery(), leaving at
+# the time the simulation sent it out, on the distances of the table as is and on the shortest paths. Returns a list
+# of the problems found
+# Big-O: O(t*n*a) -> t being the trucks, see FleetSimulation.run()
+def check_simulation():
+    problems = []
+    for shortest_paths in (False, True):
+        simulated = planned_scenario(shortest_paths=shortest_paths)
+        single = planned_scenario(routed=False, shortest_paths=shortest_paths)
+        for fleet_truck, truck in zip(simulated.truck_list, single.truck_list):
+            if not fleet_truck.packages:
+                continue
+            truck.departure_time = fleet_truck.departure_time
+            with contextlib.redirect_stdout(io.StringIO()):
+                mileage = route_delivery(single, truck, fleet_truck.departure_time)
+            if route_stops(fleet_truck) != route_stops(truck) or abs(fleet_truck.mileage - mileage) > 1e-9 or \
+                    fleet_truck.return_time != truck.return_time:
+                problems.append(f"truck {truck.truck} (shortest paths {shortest_paths}) is routed differently by "
+                                f"FleetSimulation: {fleet_truck.mileage} miles, and route_delivery: {mileage} miles")
+    return problems
+
+
+# Returns the shortest feasible route found by trying every 2-opt move and every Or-opt move of 1 to 3 stops, in
+# either direction, on the route of a RouteImprovement one at a time, measuring each route in full. Returns None if no
+# move shortens the route
+# Big-O: O(n^3) -> n^2 moves, each measured in O(n)
+def shorter_move(improvement):
+    order = improvement.order
+    n = len(order)
+    moves = [order[:i] + order[i:j + 1][::-1] + order[j + 1:] for i in range(n) for j in range(i + 1, n)]
+    for length in (1, 2, 3):
+        for i in range(n - length + 1):
+            rest = order[:i] + order[i + length:]
+            segment = order[i:i + length]
+            moves += [rest[:j] + placed + rest[j:] for j in range(len(rest) + 1) for placed in (segment, segment[::-1])]
+    best = None
+    best_length = improvement.length(order)
+    for move in moves:
+        length = improvement.length(move)
+        if length < best_length - 1e-6 and improvement.feasible(move):
+            best = move
+            best_length = length
+    return best
+
+
+# Checks improve_routes() on the sample, with the distances of the table as is and on the shortest paths: each
+# improved route must still be a valid route (see route_problems()), no longer and returning no later than before, and
+# no single 2-opt or Or-opt move may shorten it any further (see shorter_move()). The time budget is far more than the
+# search needs, so the routes found don't depend on the speed of the machine. Returns a list of the problems found
+# Big-O: O(t*n^3) -> t being the trucks and n the stops on each
+def check_improvement(time_budget=10):
+    problems = []
+    for shortest_paths in (False, True):
+        scenario = planned_scenario(shortest_paths=shortest_paths)
+        before = {t.truck: [t.mileage, t.return_time, sorted(p.id for p in t.packages)] for t in scenario.truck_list}
+        with contextlib.redirect_stdout(io.StringIO()):
+            improve_routes(scenario, time_budget=time_budget)
+        for truck in scenario.truck_list:
+            mileage, return_time, packages = before[truck.truck]
+            problems += route_problems(scenario, truck)
+            if truck.mileage > mileage + 1e-9 or (truck.route and truck.return_time > return_time) or \
+                    sorted(p.id for p in truck.packages) != packages:
+                problems.append(f"truck {truck.truck} (shortest paths {shortest_paths}) went from {mileage} miles "
+                                f"returning at {return_time} to {truck.mileage} miles returning at {truck.return_time}")
+            if truck.route and shorter_move(RouteImprovement(scenario, truck)) is not None:
+                problems.append(f"a single move shortens the improved route of truck {truck.truck} (shortest paths "
+                                f"{shortest_paths}) further")
+    return problems
+
+
+# Checks ExactRoute.solve() against trying every order of the stops, on routes of 6 to 8 stops drawn from the routes
+# of the sample, with the distances of the table as is (which break the triangle inequality in places) and on the
+# shortest paths. Each route leaves at a random time and must be back by a random time, and some of its packages get
+# an address correction (to the address they already have) known at a random time, so that deadlines, waiting for
+# corrections and the return time all limit the orders allowed. Solved with no bound, with the length of the longest
+# feasible order as the bound, and with a bound just above the shortest, the route found must be as short as the
+# shortest feasible order, and with that length as the bound nothing may be found. Returns a list of the problems found
+# Big-O: O(r*s!*s) -> r being the routes tried and s their stops
+def check_exact(routes=20, sizes=(6, 7, 8), seed=14):
+    problems = []
+    rng = random.Random(seed)
+    for shortest_paths in (False, True):
+        scenario = planned_scenario(shortest_paths=shortest_paths)
+        stops = [stop for t in scenario.truck_list for stop in t.route]
+        corrections = scenario.address_corrections
+        for size in sizes:
+            for route in range(routes):
+                truck = Truck(route)
+                truck.route = rng.sample(stops, size)
+                truck.departure_time = time_at(rng.randrange(480, 570))
+                truck.return_time = time_at(minutes(truck.departure_time) + rng.randrange(60, 240))
+                scenario.address_corrections = sorted(corrections + [
+                    AddressCorrection(time_at(rng.randrange(480, 630)), p.id, p.address, p.city, p.state, p.zip)
+                    for stop in truck.route for p in stop.packages if rng.random() < 0.3], key=lambda c: c.time)
+                exact = ExactRoute(scenario, truck, exact_limit=size)
+                feasible = [order for order in permutations(exact.order) if exact.feasible(list(order))]
+                lengths = list(map(exact.length, feasible))
+                shortest = min(lengths, default=None)
+                for bound in (math.inf, max(lengths, default=math.inf), (shortest or 0) + 1e-6):
+                    order = exact.solve(bound)
+                    if shortest is None or shortest >= bound - 1e-9:
+                        found = order is None
+                    else:
+                        found = order is not None and sorted(order) == exact.order and exact.feasible(order) and \
+                            abs(exact.length(order) - shortest) < 1e-9 and exact.solve(shortest) is None
+                    if not found:
+                        problems.append(f"{size} stops (shortest paths {shortest_paths}) at distance_ids "
+                                        f"{[stop.distance_id for stop in truck.route]}: solved {order} with bound "
+                                        f"{bound}, the shortest of {len(feasible)} feasible orders being {shortest}")
+        scenario.address_corrections = corrections
+    return problems
+
+
+# Returns the status of a package at a time of day by comparing the time with its departure and delivery times
+# Big-O: O(1)
+def scan_status(package, time_of_day):
+    if package.departure is None or time_of_day < package.departure:
+        return AT_HUB
+    if package.delivered is None or time_of_day < package.delivered:
+        return EN_ROUTE
+    return DELIVERED
+
+
+# Checks StatusIndex against scan_status() on the sample, before it is routed, once it is routed, and routed without
+# the address correction of package #9, which leaves it on its truck undelivered. Every minute of the day is queried,
+# along with each departure and delivery time and the seconds either side of it. Returns a list of the problems found
+# Big-O: O(q*n) -> q being the times queried and n the packages
+def check_status():
+    problems = []
+    for routed, address_corrections in ((False, None), (True, None), (True, ())):
+        scenario = planned_scenario(routed=routed, address_corrections=address_corrections)
+        index = StatusIndex(scenario)
+        packages = sorted(scenario.package_map, key=lambda p: p.id)
+        times = {time_at(m) for m in range(24 * 60)}
+        for p in packages:
+            for t in (p.departure, p.delivered):
+                if t is not None:
+                    times.update(time_at(minutes(t) + offset / 60) for offset in (-1, 0, 1))
+        for t in sorted(times):
+            expected = [scan_status(p, t) for p in packages]
+            counts = [expected.count(status) for status in (AT_HUB, EN_ROUTE, DELIVERED)]
+            wrong = [p.id for p, status, scanned in zip(packages, index.statuses(t), expected)
+                     if status != scanned or index.status(p.id, t) != scanned]
+            if wrong or index.counts(t) != counts:
+                problems.append(f"at {t} (routed {routed}, corrections {address_corrections}) packages {wrong} have "
+                                f"the wrong status, and {index.counts(t)} packages are at the hub, en route and "
+                                f"delivered, expected {counts}")
+                break
+        if index.status(0, time_at(600)) is not None:
+            problems.append("a package id that doesn't exist has a status")
+    return problems
+
+
+# Returns the state of every truck of a scenario as truck id -> [route_stops(), mileage, departure and return time],
+# for finding the trucks a change has touched
+# Big-O: O(n) -> n being the packages on the trucks
+def fleet_state(scenario):
+    return {t.truck: [route_stops(t), t.mileage, t.departure_time, t.return_time] for t in scenario.truck_list}
+
+
+# Returns the problems with a scenario after a change made by LivePlan at the given time, compared with its
+# fleet_state() from before the change: every route must be valid (see route_problems()), only the trucks given may
+# have changed, and those only after the stop they were driving to at the time, and every package must be either on
+# its truck or with the unloaded packages
+# Big-O: O(n + t*c) -> n being the packages, t the trucks and c the address corrections
+def live_problems(scenario, before, at, changed, deadlines):
+    problems = []
+    after = fleet_state(scenario)
+    for truck in scenario.truck_list:
+        problems += route_problems(scenario, truck, deadlines)
+        stops, mileage, departure, return_time = before[truck.truck]
+        if truck.truck not in changed:
+            if after[truck.truck] != before[truck.truck]:
+                problems.append(f"truck {truck.truck} changed at {at}, though only trucks {changed} were changed")
+            continue
+        fixed = 0
+        if departure is not None and departure <= at:
+            fixed = min(len([stop for stop in stops if stop[2] <= at]) + 1, len(stops))
+        if after[truck.truck][0][:fixed] != stops[:fixed]:
+            problems.append(f"truck {truck.truck} changed its first {fixed} stops, made by {at}")
+    for p in scenario.package_map:
+        if p.on_truck != (p in scenario.truck(p.truck).packages if p.on_truck else False) or \
+                (not p.on_truck) != (scenario.unloaded_packages.get(p.id) is p):
+            problems.append(f"package {p.id} is on truck {p.truck if p.on_truck else None}, but isn't loaded there, "
+                            f"or is both on a truck and with the unloaded packages")
+    loaded = [p for t in scenario.truck_list for p in t.packages] + list(scenario.unloaded_packages.values())
+    if len(loaded) != len(scenario.package_map) or any(scenario.package_map.retrieve(p.id) is not p for p in loaded):
+        problems.append(f"the trucks and unloaded packages hold {len(loaded)} packages, the package map "
+                        f"{len(scenario.package_map)}")
+    return problems
+
+
+# Checks LivePlan on the sample planned by FleetSimulation, and half the time improved by improve_routes(), applying
+# random changes at random times: cancelling packages, correcting their addresses, adding packages and changing when
+# packages arrive at the hub. After each change the scenario must pass live_problems(), with only the truck returned
+# and the truck the package was on before changed. Deadlines are only checked on a fixed set of changes that can all
+# be met, as random changes can leave a deadline that no route meets. A change to an address that isn't in the
+# address file must change nothing, and return False unless the package was rejected first (for being delivered,
+# missing, or already in the package map when added). Returns a list of the problems found
+# Big-O: O(r*c*n*a) -> r being the rounds and c the changes in each, see LivePlan.reroute()
+def check_live(rounds=60, changes=15, seed=24):
+    problems = []
+    rng = random.Random(seed)
+    for round in range(-1, rounds):
+        scenario = planned_scenario()
+        if round % 2:
+            with contextlib.redirect_stdout(io.StringIO()):
+                improve_routes(scenario, time_budget=10)
+        live = LivePlan(scenario)
+        addresses = [a.address for a in scenario.address_list[1:]]
+        if round < 0:
+            steps = [[time_at(570), 0, 38, None], [time_at(580), 1, 28, "300 State St"],
+                     [time_at(540), 2, 41, "1060 Dalton Ave S"], [time_at(600), 1, 3, "1 Nowhere Rd"],
+                     [time_at(600), 2, 42, "1 Nowhere Rd"]]
+        else:
+            steps = [[time_at(rng.randrange(420, 720)), rng.randrange(4), rng.randrange(1, 60),
+                      rng.choice(addresses) if rng.random() < 0.9 else "1 Nowhere Rd"] for _ in range(changes)]
+        for at, operation, package_id, address in steps:
+            before = fleet_state(scenario)
+            existing = scenario.package_map.retrieve_attr(package_id, "truck") \
+                if scenario.package_map.retrieve_attr(package_id, "on_truck") else None
+            count = len(scenario.package_map)
+            with contextlib.redirect_stdout(io.StringIO()):
+                if operation == 0:
+                    truck = live.cancel_package(at, package_id)
+                elif operation == 1:
+                    truck = live.correct_address(at, package_id, address, "Salt Lake City", "UT", "84111")
+                elif operation == 2:
+                    truck = live.add_package(at, Package(package_id, address, "Salt Lake City", "UT", "84111",
+                                                         rng.choice(["EOD", "10:30 AM"]) if round >= 0 else "EOD",
+                                                         "2", ""))
+                else:
+                    truck = live.change_pickup(at, package_id, time_at(rng.randrange(480, 660)))
+            change = f"change {operation} of package {package_id} at {at} (round {round})"
+            if address == "1 Nowhere Rd" and operation in (1, 2):
+                rejected = truck is False or truck is None and round >= 0
+                if not rejected or fleet_state(scenario) != before or len(scenario.package_map) != count:
+                    problems.append(f"{change} to an address not in the address file returned {truck}, or changed "
+                                    f"the plan")
+            if round < 0 and address != "1 Nowhere Rd" and not truck:
+                problems.append(f"{change} routed no truck")
+            changed = [t for t in (truck and truck.truck, existing) if t is not None]
+            problems += [f"{change}: {problem}" for problem in live_problems(scenario, before, at, changed, round < 0)]
+            if len(problems) > 10:
+                return problems
+    return problems
+
+
+# Returns True if a package is held back from delivery until its address is corrected
+# Big-O: O(1)
+def held_back(package):
+    return "wrong address" in package.special_notes.lower()
+
+
+# Chooses the next delivery by scanning the packages left in the order they were loaded, following the rules of
+# DeliveryCandidates.select() directly: the first package within NEARBY_DISTANCE after the first deliverable package,
+# otherwise the earliest end of time window, then the shortest distance, then the earliest in the list. Returns
+# [package, distance], or [None, None] if nothing can be delivered
+# Big-O: O(n) -> n being the packages left
+def scan_delivery(scenario, packages, current_id):
+    row = scenario.distance_map.row(current_id)
+    deliverable = [p for p in packages if not held_back(p)]
+    if not deliverable:
+        return [None, None]
+    for p in deliverable[1:]:
+        if row[p.distance_id] <= NEARBY_DISTANCE:
+            return [p, row[p.distance_id]]
+    package = min(deliverable, key=lambda p: [p.latest, row[p.distance_id]])
+    return [package, row[package.distance_id]]
+
+
+# Checks DeliveryCandidates against scan_delivery(), on trucks loaded with every package of the sample in a random
+# order. From a random address, or the address of the last package chosen, the package chosen by each is compared,
+# then every package at that address (or now and then a random one) is delivered. Returns a list of the problems found
+# Big-O: O(r*n^2) -> r being the rounds and n the packages
+def check_candidates(rounds=40, seed=10):
+    problems = []
+    rng = random.Random(seed)
+    for shortest_paths in (False, True):
+        scenario = Scenario(shortest_paths=shortest_paths)
+        with contextlib.redirect_stdout(io.StringIO()):
+            packages = list(scenario.package_map)
+            # the distances are read here, where the count of distances shortened by the shortest paths is discarded
+            scenario.distance_map
+        addresses = range(len(scenario.address_list))
+        for round in range(rounds):
+            truck = Truck(round)
+            truck.packages = list(packages)
+            rng.shuffle(truck.packages)
+            candidates = DeliveryCandidates(scenario, truck)
+            left = list(truck.packages)
+            current_id = 0
+            while left:
+                if rng.random() < 0.3:
+                    current_id = rng.choice(addresses)
+                chosen = candidates.select(current_id)
+                expected = scan_delivery(scenario, left, current_id)
+                if chosen[0] is not expected[0] or chosen[1] != expected[1] or len(candidates) != len(left):
+                    problems.append(f"round {round} (shortest paths {shortest_paths}) from address {current_id}: "
+                                    f"chose {chosen[0] and chosen[0].id}, expected {expected[0] and expected[0].id}")
+                    break
+                if expected[0] is None:
+                    break
+                delivered = rng.choice(left) if rng.random() < 0.2 else expected[0]
+                current_id = delivered.distance_id
+                if held_back(delivered):
+                    candidates.remove(delivered)
+                    left.remove(delivered)
+                    continue
+                removed = candidates.remove_address(current_id)
+                at_address = [p for p in left if p.distance_id == current_id and not held_back(p)]
+                if removed != at_address:
+                    problems.append(f"round {round}: remove_address({current_id}) returned {[p.id for p in removed]}, "
+                                    f"expected {[p.id for p in at_address]}")
+                    break
+                left = [p for p in left if p not in removed]
+    return problems
+
+
+# Checks HashMap against a dict, applying the same random inserts, replacements, deletes and lookups to both. Ids are
+# drawn from a small range so that the table is full of deleted slots being reused, and starts small so that it is
+# resized many times. Returns a list of the problems found
+# Big-O: O(s*n) -> s being the steps, as the whole map is compared every 100 steps
+def check_hashmap(steps=20000, seed=5):
+    problems = []
+    rng = random.Random(seed)
+    hashmap = HashMap(capacity=1)
+    expected = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(steps):
+            id = rng.randrange(300)
+            operation = rng.random()
+            if operation < 0.45:
+                item = SimpleNamespace(id=id, step=step)
+                hashmap.insert(item)
+                expected[id] = item
+            elif operation < 0.5:
+                items = [SimpleNamespace(id=rng.randrange(300), step=step) for _ in range(rng.randrange(20))]
+                hashmap.insert_many(items)
+                expected.update((item.id, item) for item in items)
+            elif operation < 0.8:
+                hashmap.delete(id)
+                expected.pop(id, None)
+            elif id in expected:
+                hashmap.update_attr(id, "step", -step)
+                expected[id].step = -step
+            if hashmap.retrieve(id) is not expected.get(id) or (id in hashmap) != (id in expected):
+                problems.append(f"step {step}: id {id} is {hashmap.retrieve(id)}, expected {expected.get(id)}")
+            if step % 100 == 0 or step == steps - 1:
+                items = list(hashmap)
+                if len(hashmap) != len(expected) or len(items) != len(expected) or \
+                        any(expected.get(item.id) is not item for item in items):
+                    problems.append(f"step {step}: the map holds {len(items)} items, expected {len(expected)}")
+                if hashmap.get_many(list(range(300))) != [expected.get(id) for id in range(300)]:
+                    problems.append(f"step {step}: get_many() differs from the expected items")
+            if len(problems) > 10:
+                break
+    return problems
+
+
+# Checks that can be run, by name. Each returns a list of the problems it found, empty when it passed
+CHECKS = {
+    "candidates": check_candidates,
+    "exact": check_exact,
+    "hashmap": check_hashmap,
+    "improvement": check_improvement,
+    "live": check_live,
+    "simulation": check_simulation,
+    "status": check_status,
+}
+
+
+# Runs the named checks (all of them by default), printing whether each passed and the problems found by any that
+# failed. Every check is deterministic, so a failure can be repeated. Returns True if every check passed
+# Big-O: see the checks run
+def run_checks(names=None):
+    passed = True
+    for name in names or CHECKS:
+        problems = CHECKS[name]()
+        print(f"{name:<16} {'ok' if not problems else 'FAILED'}")
+        for problem in problems:
+            print(f"    {problem}")
+        passed = passed and not problems
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs deterministic checks of the data structures and algorithms "
+                                                 "against simpler versions of the same.")
+    parser.add_argument("checks", nargs="*", metavar="CHECK",
+                        help=f"checks to run, all by default: {', '.join(CHECKS)}")
+    arguments = parser.parse_args()
+    unknown = [name for name in arguments.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+    sys.exit(0 if run_checks(arguments.checks) else 1)
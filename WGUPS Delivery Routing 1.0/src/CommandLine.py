@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+from datetime import datetime
+
+from Package import minutes
+from PlanSearch import PlanSearch
+from RouteImprovement import EXACT_STOP_LIMIT, improve_routes
+from Scenario import Scenario
+from Simulation import FleetSimulation
+from StatusIndex import StatusIndex
+from TruckSort import load_trucks
+
+# Names of the statuses of StatusIndex, in the order of their values, as written in the output
+STATUS_NAMES = ("at_hub", "en_route", "delivered")
+
+# Fields of the records written by each subcommand, in the order they are written as csv columns
+PACKAGE_FIELDS = ("package", "truck", "address", "city", "zip", "deadline", "departure", "delivered", "on_time")
+STATUS_FIELDS = ("package", "truck", "time", "status")
+STOP_FIELDS = ("truck", "stop", "distance_id", "arrival", "packages")
+TRUCK_FIELDS = ("truck", "departure", "return", "mileage", "packages", "stops", "late")
+
+
+# Plans the day of a scenario the same way main.py does: loads the trucks and routes them together through the day.
+# With improve, each route is then improved the same as main.py --improve, and with a number of plan search
+# iterations the loads and routes of all trucks are searched together the same as main.py --plan-search. By default
+# neither runs, giving the same greedy plan as main.py run without options. Returns the total mileage of all trucks
+# Big-O: O(i*n) -> i being the iterations of the plan search, see PlanSearch.run()
+def plan_day(scenario, improve=False, iterations=0, seed=0):
+    load_trucks(scenario)
+    FleetSimulation(scenario).run()
+    if improve:
+        improve_routes(scenario, time_budget=0.5, exact_limit=EXACT_STOP_LIMIT)
+    if iterations:
+        search = PlanSearch(scenario, seed=seed)
+        search.run(time_limit=None, max_iterations=iterations)
+        if search.apply():
+            print(f"Plan search found a plan of {round(search.best_cost, 2)} miles in {search.iterations} iterations.")
+    return sum(t.mileage for t in scenario.truck_list)
+
+
+# Parses a time of day given on the command line as HH:MM or HH:MM:SS
+# Big-O: O(1)
+def time_argument(text):
+    for time_format in ("%H:%M", "%H:%M:%S"):
+        try:
+            return datetime.strptime(text, time_format).time()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"{text} is not a time in 24 hour HH:MM or HH:MM:SS format")
+
+
+# Returns a time of day as written in the output, or None for a missing time
+# Big-O: O(1)
+def time_text(time_of_day):
+    return None if time_of_day is None else time_of_day.isoformat()
+
+
+# Returns the record of a package written by the plan and package subcommands, on_time being None while it has not
+# been delivered
+# Big-O: O(1)
+def package_record(package):
+    on_time = None if package.delivered is None else minutes(package.delivered) <= package.latest
+    return {"package": package.id, "truck": package.truck, "address": package.address, "city": package.city,
+            "zip": package.zip, "deadline": str(package.deadline), "departure": time_text(package.departure),
+            "delivered": time_text(package.delivered), "on_time": on_time}
+
+
+# Returns the record of a truck written by the summary subcommand, late being the packages delivered after their
+# deadline or not delivered at all
+# Big-O: O(n) -> n being the packages on the truck
+def truck_record(truck):
+    late = sum(1 for p in truck.packages if not package_record(p)["on_time"])
+    return {"truck": truck.truck, "departure": time_text(truck.departure_time), "return": time_text(truck.return_time),
+            "mileage": round(truck.mileage, 2), "packages": len(truck.packages), "stops": len(truck.route),
+            "late": late}
+
+
+# Writes records to a file as JSON lines (one object per line) or as csv with a header row of the given fields
+# Big-O: O(n) -> n being the records
+def write_records(records, fields, output_format, file):
+    if output_format == "csv":
+        writer = csv.DictWriter(file, fieldnames=fields, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+
+# Adds the options choosing the scenario files and how the day is planned to a parser, read back by scenario_from()
+# Big-O: O(1)
+def add_scenario_arguments(parser):
+    parser.add_argument("--packages", help="package file csv, defaults to the sample package file")
+    parser.add_argument("--addresses", help="address file csv, defaults to the sample address file")
+    parser.add_argument("--distances", help="distance table csv, defaults to the sample distance table")
+    parser.add_argument("--distance-cache", help="compiled distance cache, defaults to a .d.dmat file next to the table")
+    parser.add_argument("--shortest-paths", action="store_true",
+                        help="route on the shortest paths between addresses instead of the table as is")
+    parser.add_argument("--improve", action="store_true",
+                        help="shorten each truck's route with 2-opt, Or-opt and exact routing, as main.py --improve")
+    parser.add_argument("--plan-search", type=int, default=0, metavar="ITERATIONS",
+                        help="search the loads and routes of all trucks together for the given number of iterations, "
+                             "as main.py --plan-search (which runs 20000). Skipped by default")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the plan search")
+
+
+# Builds the parser of the command line, every subcommand plans the day first and then writes its records
+# Big-O: O(1)
+def build_parser():
+    parser = argparse.ArgumentParser(description="Plans a day of WGUPS deliveries and reports on the plan.")
+    add_scenario_arguments(parser)
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl", help="output format")
+    parser.add_argument("--output", default="-", help="file to write the output to, - for stdout")
+    parser.add_argument("--verbose", action="store_true",
+                        help="print the progress of planning and every truck's packages to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("plan", help="every package with its truck, departure and delivery times")
+    status_at = commands.add_parser("status-at", help="the status of every package at a time of day")
+    status_at.add_argument("time", type=time_argument, help="time of day, HH:MM or HH:MM:SS")
+    package = commands.add_parser("package", help="a single package")
+    package.add_argument("id", type=int)
+    truck = commands.add_parser("truck", help="the stops on a truck's route")
+    truck.add_argument("id", type=int)
+    commands.add_parser("summary", help="every truck's departure, return, mileage and late packages")
+    return parser
+
+
+# Creates the scenario from the parsed arguments, files that were not given keep the scenario's defaults (and with
+# them the address correction of the sample package file). Relative paths are resolved against the working directory
+# Big-O: O(1)
+def scenario_from(arguments):
+    files = {"package_file": arguments.packages, "address_file": arguments.addresses,
+             "distance_file": arguments.distances, "distance_cache": arguments.distance_cache}
+    files = {key: os.path.abspath(value) for key, value in files.items() if value is not None}
+    return Scenario(shortest_paths=arguments.shortest_paths, **files)
+
+
+# Returns [records, fields] answering the subcommand of the parsed arguments for a planned scenario, or None if the
+# package or truck asked for does not exist
+# Big-O: O(n) -> n being the packages
+def command_records(scenario, arguments):
+    if arguments.command == "plan":
+        packages = sorted(scenario.package_map, key=lambda p: p.id)
+        return [[package_record(p) for p in packages], PACKAGE_FIELDS]
+    if arguments.command == "status-at":
+        index = StatusIndex(scenario)
+        when = time_text(arguments.time)
+        records = [{"package": p.id, "truck": p.truck, "time": when, "status": STATUS_NAMES[status]}
+                   for p, status in zip(index.packages, index.statuses(arguments.time))]
+        return [records, STATUS_FIELDS]
+    if arguments.command == "package":
+        if arguments.id not in scenario.package_map:
+            return None
+        return [[package_record(scenario.package_map.retrieve(arguments.id))], PACKAGE_FIELDS]
+    if arguments.command == "truck":
+        truck = scenario.truck(arguments.id)
+        if truck is None:
+            return None
+        records = [{"truck": truck.truck, "stop": k + 1, "distance_id": stop.distance_id,
+                    "arrival": time_text(stop.arrival), "packages": " ".join(str(p.id) for p in stop.packages)}
+                   for k, stop in enumerate(truck.route)]
+        return [records, STOP_FIELDS]
+    return [[truck_record(t) for t in scenario.truck_list], TRUCK_FIELDS]
+
+
+# Runs the command line once: plans the day, and writes the records of the subcommand. The printing of the planning
+# steps goes to stderr with --verbose and is discarded otherwise, so stdout only holds the records. Returns the exit
+# status, 1 if the package or truck asked for does not exist
+# Big-O: see plan_day()
+def main(argv=None):
+    arguments = build_parser().parse_args(argv)
+    progress = sys.stderr if arguments.verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(progress):
+        scenario = scenario_from(arguments)
+        plan_day(scenario, arguments.improve, arguments.plan_search, arguments.seed)
+        if arguments.verbose:
+            for t in scenario.truck_list:
+                print(f"\n{t}     \nPackages delivered:")
+                for p in t.packages:
+                    print(p)
+    if progress is not sys.stderr:
+        progress.close()
+
+    answer = command_records(scenario, arguments)
+    if answer is None:
+        print(f"No {arguments.command} with id {arguments.id} in the scenario.", file=sys.stderr)
+        return 1
+    records, fields = answer
+    if arguments.output == "-":
+        write_records(records, fields, arguments.format, sys.stdout)
+    else:
+        with open(arguments.output, "w", newline="") as file:
+            write_records(records, fields, arguments.format, file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,131 +1,248 @@
-from datetime import time, timedelta, datetime, date
+import heapq
+from bisect import bisect_left, insort
+from datetime import time
 
-from Distances import address_distance
-from HashMap import package_map
-from Package import Package
-from Truck import truck_list
+from Package import Package, minutes
+from Truck import Stop
 
 
-# determines the next package to be delivered. Will return a float distance, and a package
-# Big-O: O(n) -> average complexity, worst case would be O(n^2)
-def next_delivery(truck, current_address):
+# Packages within this distance of the current location are considered extremely close or at the same address,
+# and are the best package to deliver next by default
+NEARBY_DISTANCE = 1.0
+
+
+# DeliveryCandidates class, keeps the undelivered packages on a truck indexed for next_delivery(), so each delivery is
+# chosen without rescanning and re-checking every package on the truck. Packages are indexed by their position in the
+# truck's package list, grouped by distance_id into stops, and bucketed by the end of their time window, and delivered
+# packages are removed in O(log n). Packages with the wrong address listed are held back until their address has been
+# corrected.
+class DeliveryCandidates:
+    # Builds the index from the undelivered packages on the truck
+    # Big-O: O(n log n)
+    def __init__(self, scenario, truck):
+        self.scenario = scenario
+        self.position = {}          # package id -> position of the package in truck.packages
+        self.order = []             # heap of positions of deliverable packages, may hold removed positions
+        self.by_address = {}        # distance_id -> sorted positions of deliverable packages at that address
+        self.buckets = {}           # package.latest -> {distance_id -> sorted positions} of deliverable packages
+        self.bucket_keys = []       # sorted package.latest values with at least one deliverable package
+        self.packages = {}          # position -> deliverable package
+        self.address = {}           # position -> distance_id a deliverable package is indexed under
+        self.blocked = {}           # package id -> package waiting on an address correction
+        for i, p in enumerate(truck.packages):
+            if p.delivered is not None:
+                continue
+            self.position[p.id] = i
+            if "wrong address" in p.special_notes.lower():
+                self.blocked[p.id] = p
+            else:
+                self.add(p)
+
+    # Number of packages still to be delivered, including packages waiting on an address correction
+    # Big-O: O(1)
+    def __len__(self):
+        return len(self.packages) + len(self.blocked)
+
+    # Adds a deliverable package to the index
+    # Big-O: O(log n)
+    def add(self, package):
+        i = self.position[package.id]
+        distance_id = self.scenario.package_distance_id(package)
+        key = package.latest
+        self.packages[i] = package
+        self.address[i] = distance_id
+        heapq.heappush(self.order, i)
+        insort(self.by_address.setdefault(distance_id, []), i)
+        if key not in self.buckets:
+            self.buckets[key] = {}
+            insort(self.bucket_keys, key)
+        insort(self.buckets[key].setdefault(distance_id, []), i)
+
+    # Removes a package from the index, once it has been delivered
+    # Big-O: O(log n)
+    def remove(self, package):
+        if self.blocked.pop(package.id, None) is not None:
+            return
+        i = self.position[package.id]
+        if self.packages.pop(i, None) is None:
+            return
+        distance_id = self.address.pop(i)
+        key = package.latest
+        remove_sorted(self.by_address, distance_id, i)
+        bucket = self.buckets[key]
+        remove_sorted(bucket, distance_id, i)
+        if not bucket:
+            del self.buckets[key]
+            del self.bucket_keys[bisect_left(self.bucket_keys, key)]
+
+    # Removes every deliverable package going to the given distance_id from the index, and returns them in the order
+    # they were loaded, so they can all be delivered at one stop
+    # Big-O: O(k log n) -> k being the packages going to the address
+    def remove_address(self, distance_id):
+        packages = [self.packages[i] for i in self.by_address.get(distance_id, ())]
+        for p in packages:
+            self.remove(p)
+        return packages
+
+    # Updates the index for a package whose address has been corrected: a package that was waiting on the correction
+    # becomes deliverable, and a package that was already deliverable moves to the stop of its corrected address
+    # Big-O: O(log n)
+    def release(self, package):
+        if "wrong address" in package.special_notes.lower():
+            return
+        if package.id in self.blocked:
+            del self.blocked[package.id]
+        elif self.position.get(package.id) in self.packages:
+            self.remove(package)
+        else:
+            return
+        self.add(package)
+
+    # Returns the position of the first deliverable package in the truck's package list
+    # Big-O: O(log n) -> amortized, positions of removed packages are dropped from the heap as they are found
+    def first_position(self):
+        order = self.order
+        while order and order[0] not in self.packages:
+            heapq.heappop(order)
+        return order[0] if order else None
+
+    # Chooses the next package to deliver from the given distance_id, following the same rules as scanning the truck's
+    # packages in order: any package after the first deliverable one that is within NEARBY_DISTANCE is taken straight
+    # away (the earliest one in the truck's package list), otherwise packages whose time window ends first are
+    # preferred (a package without a deadline has a window to the end of the day), then shorter distances, and ties
+    # go to the package earliest in the list.
+    # Returns the package and its distance, or [None, None] if no package can be delivered
+    # Big-O: O(a) -> a being the number of distinct addresses still to be delivered to
+    def select(self, current_id):
+        first = self.first_position()
+        if first is None:
+            return [None, None]
+        row = self.scenario.distance_map.row(current_id)
+
+        by_address = self.by_address
+        nearby = None
+        for distance_id in [d for d in by_address if row[d] <= NEARBY_DISTANCE]:
+            positions = by_address[distance_id]
+            i = positions[0] if positions[0] != first else (positions[1] if len(positions) > 1 else None)
+            if i is not None and (nearby is None or i < nearby):
+                nearby = i
+        if nearby is not None:
+            package = self.packages[nearby]
+            return [package, row[package.distance_id]]
+
+        # the shortest distance in the bucket of the earliest deadline, then the earliest package at that distance
+        bucket = self.buckets[self.bucket_keys[0]]
+        shortest = min(map(row.__getitem__, bucket))
+        i = min([bucket[d][0] for d in bucket if row[d] == shortest])
+        return [self.packages[i], shortest]
+
+
+# Removes a position from the sorted list stored under key in the given dict, dropping the key once its list is empty
+# Big-O: O(log n) to find the position, and O(k) to remove it from a list of k positions
+def remove_sorted(lists, key, i):
+    positions = lists[key]
+    del positions[bisect_left(positions, i)]
+    if not positions:
+        del lists[key]
+
+
+# determines the next package to be delivered from the trucks of the given scenario. Will return a float
+# distance, and a package. When routing a whole route, the same DeliveryCandidates should be passed on every call
+# (and told about each delivery), otherwise a new index of the truck's undelivered packages is built for this call
+# Big-O: O(a) with candidates passed, a being the distinct addresses left, O(n log n) otherwise
+def next_delivery(scenario, truck, current_address, candidates=None):
     # logic ensures that the method can accept an int or a truck object, and still perform as intended
-    if truck is int:
-        for t in truck_list:
-            if t.truck == truck:
-                truck = t
-                break
-        if truck is int:
-            print(f"No Truck matching ID of {truck} Provide a valid Truck object or Truck ID")
+    if type(truck) is int:
+        truck_id = truck
+        truck = scenario.truck(truck_id)
+        if truck is None:
+            print(f"No Truck matching ID of {truck_id} Provide a valid Truck object or Truck ID")
             return
 
-    # Logic allows an address string or a package to be passed and for the method to still function
+    # Logic allows an address string or a package to be passed and for the method to still function.
+    # The current location is resolved to its distance_id once, so choosing the package only does integer lookups
     if type(current_address) is Package:
-        current_address = current_address.address
-    if type(current_address) is not str:
+        current_id = scenario.package_distance_id(current_address)
+    elif type(current_address) is str:
+        current_id = scenario.address_id(current_address)
+    else:
         print(f"Could not handle argument {current_address}, must be type package or string")
         return
+    if current_id is None:
+        print(f"No distance mapping found for {current_address}, cannot determine the next delivery")
+        return
 
-    # variable assignments to persist and change throughout the for loop
-    best_package = None
-    bp_distance = None
-    earliest_deadline = None
+    if candidates is None:
+        candidates = DeliveryCandidates(scenario, truck)
+    return candidates.select(current_id)
 
-    # for loop to cycle between all the packages that were assigned to this truck and perform the necessary
-    # logic to determine which package to deliver next
-    for p in truck.packages:
 
-        # ensures that any package with the wrong address is not selected, before it has been corrected
-        if "wrong address" in p.special_notes.lower():
-            continue
+# Marks a package as delivered at the given time, and issues a print statement if it was delivered after the end of
+# its time window
+# Big-O: O(1)
+def deliver_package(scenario, package, current_time):
+    # Updates the package using the package_map update_attr function, adding a delivery time
+    scenario.package_map.update_attr(package.id, "delivered", current_time)
+    if minutes(current_time) > package.latest:
+        print(f"\n{package} \nThe above package was not delivered on time.")
+
 
-        # we want to skip any package that has already been delivered, delivered packages will have a
-        # timestamp assigned to the delivered attribute
-        if p.delivered is not None:
+# Applies every address correction of the scenario that is known by current_time, to the undelivered packages loaded
+# on the given truck that don't have the corrected address yet, or are held back waiting on it, so that they may be
+# delivered from then on. Returns the packages that were corrected
+# Big-O: O(c) -> c being the number of corrections, which is expected to be small
+def apply_address_corrections(scenario, truck, current_time):
+    corrected = []
+    for correction in scenario.address_corrections:
+        if correction.time > current_time:
+            break
+        if correction.package_id not in scenario.package_map:
             continue
+        package = scenario.package_map.retrieve(correction.package_id)
+        if package.truck == truck.truck and package.delivered is None and \
+                (package.address != correction.address or "wrong address" in package.special_notes.lower()):
+            correction.apply(scenario)
+            corrected.append(package)
+    return corrected
 
-        # all undelivered packages will go through the logic below
-        else:
-            address = p.address
-            deadline = p.deadline
-            distance = address_distance(address, current_address)
-
-            # If best_package has not yet been assigned, the first valid package will be assigned
-            if best_package is None:
-                best_package = p
-                earliest_deadline = deadline
-                bp_distance = distance
-                continue
 
-            # Once best package has been assigned, the following logic will determine if the next
-            # package in the list has a higher priority deadline, or if it is closer
-            else:
-                # if distance is less than 1, it is extremely close or at the same address, and is considered
-                # the best package to deliver next by default.
-                if distance <= 1.0:
-                    best_package = p
-                    bp_distance = distance
-                    break
-                # If best package has a deadline, and the current package does not, we skip to the next
-                # iteration of the loop
-                if type(deadline) is not time and type(earliest_deadline) is time:
-                    continue
-                # if both the best package and current package have no deadline
-                elif type(deadline) is not time and type(earliest_deadline) is not time:
-                    # if the current package's distance from the current address is shorter than
-                    # the best package's distance, then the current package is the new best package
-                    if distance < bp_distance:
-                        best_package = p
-                        bp_distance = distance
-                        earliest_deadline = deadline
-                    continue
-                # if the best package has no deadline but the current package does, the current package
-                # is the new best package
-                elif type(deadline) is time and type(earliest_deadline) is not time:
-                    best_package = p
-                    earliest_deadline = deadline
-                    bp_distance = distance
-                    continue
-
-                # if this statement is reached, both packages have a deadline, and we must compare them.
-                else:
-                    # deadline comparison
-                    if deadline < earliest_deadline:
-                        best_package = p
-                        earliest_deadline = deadline
-                        bp_distance = distance
-                        continue
-
-                    # if both deadlines are the same, we pick best package based on distance.
-                    elif deadline == earliest_deadline:
-                        if distance < bp_distance:
-                            best_package = p
-                            earliest_deadline = deadline
-                            bp_distance = distance
-                            continue
-                        continue
-                    elif deadline > earliest_deadline:
-                        continue
-                    print(
-                        f" Something may have gone wrong, for loop in next_delivery() achieved what should have been an impossible result. May be missing a continue statement under an if clause.")
-                    continue
-    return [best_package, bp_distance]
-
-
-# Routes a truck through all it's packages from its departure to it's return.
+# Checks that every package on the truck received a delivery time, prints the result along with the truck's total
+# distance and return time, and updates the truck's return time
+# Big-O: O(n)
+def report_route(truck, truck_distance, return_time):
+    # Initialized boolean as True
+    all_delivered = True
+    # Iterates through all packages assigned to the truck
+    for p in truck.packages:
+        # If any of them have not received a delivery time, print to console and set all_delivered to False
+        if p.delivered is None:
+            print(f"Package \n  {p}\n   was not Delivered.")
+            all_delivered = False
+    # If all_delivered is still True, meaning all packages have been given a delivery time (and have been delivered),
+    # Print a statement to console of the success, the truck number, total distance, and return time.
+    if all_delivered:
+        print(f"All Packages on Truck {truck.truck} Delivered successfully, Total distance traveled was {round(truck_distance, 2)} miles. Return time was {return_time}")
+    # Otherwise print of the failure to deliver all packages, along with the same variable as before.
+    else:
+        print(f"Not all Packages on Truck {truck.truck} were delivered. Total Distance traveled was {round(truck_distance, 2)} miles. Return time was {return_time}")
+
+    # Update the trucks return time with the return time at end of operation. Especially important for truck_1.
+    truck.return_time = return_time
+
+
+# Routes a truck of the given scenario through all it's packages from its departure to it's return.
 # variable checks used at function start to allow int or truck objects, and to allow any variable type for
 # departure, though only valid Time objects will be used, and even then only if the truck did not already
-# have a departure time preset
+# have a departure time preset. Routes one truck on its own, Simulation.py routes the whole fleet together
 # Big-O: O(n^2)
-def route_delivery(truck, departure):
+def route_delivery(scenario, truck, departure):
+    package_map = scenario.package_map
     # logic ensures that the method can accept an int or a truck object, and still perform as intended
-    if truck is int:
-        for t in truck_list:
-            if t.truck == truck:
-                truck = t
-                break
-        if truck is int:
-            print(f"No Truck matching ID of {truck} Provide a valid Truck object or Truck ID")
+    if type(truck) is int:
+        truck_id = truck
+        truck = scenario.truck(truck_id)
+        if truck is None:
+            print(f"No Truck matching ID of {truck_id} Provide a valid Truck object or Truck ID")
             return
     # ensures preset departure times take priority over any argument passed
     if type(truck.departure_time) is time:
@@ -138,83 +255,70 @@ def route_delivery(truck, departure):
     elif type(departure) is time and type(truck.departure_time) is not time:
         truck.departure_time = departure
 
-    # new list to use as a boolean for the while loop
-    to_be_delivered = []
     for p in truck.packages:
-        to_be_delivered.append(p)
         # updates all packages with a 'departure' time for checking when they are considered 'en route'
         package_map.update_attr(p.id, "departure", departure)
 
-    # Variables to track total distance truck has traveled, as well as the current time
-    truck_distance = 0
-    current_time = departure
+    # any correction already known when the truck leaves is applied before indexing the packages to deliver
+    apply_address_corrections(scenario, truck, departure)
+    truck.route = []
+    # Initializes current package as "HUB" so that the first delivery is chosen by its distance from the HUB, and
+    # returns the total distance/mileage of the truck
+    return continue_route(scenario, truck, "HUB", departure, 0)
 
-    # Initializes current package as "HUB" so that the first loop checks the distance from HUB
-    current_package = "HUB"
-    # While loop to operate as long as the to_be_delivered list is populated
-    while to_be_delivered:
 
+# Routes a truck through its undelivered packages from a point part way through its route: current_package being the
+# last package it delivered ("HUB" if it has not delivered any), current_time the time it was delivered, and
+# truck_distance the distance the truck has traveled so far. Stops are appended to truck.route, and the truck returns
+# to the hub once nothing is left to deliver. Used by route_delivery() from the hub, and by LivePlan to route the rest
+# of a route again after the plan changed. Returns the total distance/mileage of the truck
+# Big-O: O(n*a) -> from next_delivery() being called once for every delivery, a being the addresses left on the truck
+def continue_route(scenario, truck, current_package, current_time, truck_distance):
+    # index of the packages still to be delivered, used as a boolean for the while loop
+    to_be_delivered = DeliveryCandidates(scenario, truck)
+
+    # While loop to operate as long as the to_be_delivered index is populated
+    while to_be_delivered:
         # Variables to call next_delivery() and store it's returned values
-        returned = next_delivery(truck, current_package)
+        returned = next_delivery(scenario, truck, current_package, to_be_delivered)
+        # if only packages waiting on an address correction are left, the truck waits where it is for the next
+        # correction of one of them, the same as in FleetSimulation, and can't deliver them if there is none
+        if returned[0] is None:
+            waiting = [c.time for c in scenario.address_corrections
+                       if c.time > current_time and c.package_id in to_be_delivered.blocked]
+            if not waiting:
+                break
+            current_time = waiting[0]
+            for p in apply_address_corrections(scenario, truck, current_time):
+                to_be_delivered.release(p)
+            continue
         current_package = returned[0]
         distance = returned[1]
         # adds the distance returned from next_delivery() to truck_distance, and updates it
         truck_distance += distance
 
-        # Calculates the travel time to the package, based on avg truck speed, and distance
-        travel_time = timedelta(hours=(distance / truck.avg_speed))
         # Calculates the current time, based on the time of last delivery, and travel time to the current one
-        current_time = (datetime.combine(date.today(), current_time) + travel_time).time()
-
-        # Removes the current package from the list used as a boolean in the while loop
-        to_be_delivered.remove(current_package)
-        # Updates the package using the package_map update_attr function, adding a delivery time
-        package_map.update_attr(current_package.id, "delivered", current_time)
-
-        # checks if the package has a deadline, and if so, checks if it was delivered before that deadline,
-        # issues a print statement if not
-        if type(current_package.deadline) is time:
-            if current_package.deadline < current_package.delivered:
-                print(f"\n{current_package} \nThe above package was not delivered on time.")
-
-        # special check for truck 3, package 9 is loaded on it, if it's current time is after 10:20 AM, when the
-        # correct address is known and received, so that all it's attributes may be updated, and it can be delivered.
-        if truck.truck == 3:
-            if current_time >= time(10, 20):
-                package_map.update_attr(9, "address", "410 S State St")
-                package_map.update_attr(9, "city", "Salt Lake City")
-                package_map.update_attr(9, "state", "UT")
-                package_map.update_attr(9, "zip", "84111")
-                # updates special notes so that the next_delivery() algorithm no longer skips over it.
-                package_map.update_attr(9, "special_notes", "address corrected")
+        current_time = truck.travel(current_time, distance)
+
+        # Every package going to the same address as the current package is delivered at this stop, and removed
+        # from the index used as a boolean in the while loop
+        stop_packages = to_be_delivered.remove_address(current_package.distance_id)
+        for p in stop_packages:
+            deliver_package(scenario, p, current_time)
+        truck.route.append(Stop(current_package.distance_id, stop_packages, current_time))
+
+        # applies any address correction that has become known by now, so that the package can be delivered.
+        for p in apply_address_corrections(scenario, truck, current_time):
+            to_be_delivered.release(p)
 
     # checks the distance for returning to the HUB from final delivery, and stores it in the 'distance' variable
-    distance = address_distance("HUB", current_package.address)
+    distance = scenario.hub_distance(current_package)
     # adds distance to truck_distance, and updates its value
     truck_distance += distance
-    # Calculates the travel time back to hub, the same way it's done within the loop
-    travel_time = timedelta(hours=(distance/truck.avg_speed))
     # gets the current time on the trucks return to the HUB
-    current_time = (datetime.combine(date.today(), current_time) + travel_time).time()
-
-    # Initialized boolean as True
-    all_delivered = True
-    # Iterates through all packages assigned to the truck
-    for p in truck.packages:
-        # If any of them have not received a delivery time, print to console and set all_delivered to False
-        if type(p.delivered) is None:
-            print(f"Package \n  {p}\n   was not Delivered.")
-            all_delivered = False
-    # If all_delivered is still True, meaning all packages have been given a delivery time (and have been delivered),
-    # Print a statement to console of the success, the truck number, total distance, and return time.
-    if all_delivered:
-        print(f"All Packages on Truck {truck.truck} Delivered successfully, Total distance traveled was {round(truck_distance, 2)} miles. Return time was {current_time}")
-    # Otherwise print of the failure to deliver all packages, along with the same variable as before.
-    else:
-        print(f"Not all Packages on Truck {truck.truck} were delivered. Total Distance traveled was {round(truck_distance, 2)} miles. Return time was {current_time}")
+    current_time = truck.travel(current_time, distance)
 
-    # Update the trucks return time with the current_time at end of operation. Especially important for truck_1.
-    truck.return_time = current_time
+    report_route(truck, truck_distance, current_time)
 
     # Return the total distance/mileage of the truck
     return truck_distance
@@ -1,10 +1,22 @@
 import csv
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from math import inf
+from operator import lt, sub
 
-from Package import Package
+# Paths through other addresses must be shorter than the direct distance by more than this many miles to replace it in
+# floyd_warshall(), so rounding errors in the sums of distances can't reroute a path through another address
+MIN_SHORTCUT = 1e-9
+# Next hop stored for 2 distance_ids with no path between them
+NO_PATH = -1
 
 
 # AddressMap class, used for creating a list of addresses, and assigning them an index that corresponds
-# to the distance table. Also Appends itself to the global address_list
+# to the distance table
 class AddressMap:
     # Initialize the Address mapping
     # Big-O: O(1)
@@ -12,7 +24,6 @@ class AddressMap:
         self.address = address
         self.zip = zip
         self.distance_id = int(distance_id)
-        address_list.append(self)
 
     # What to return when an AddressMapping is printed
     # Big-O: O(1)
@@ -20,119 +31,392 @@ class AddressMap:
         return f"Address: {self.address} ({self.zip}) || Distance mapping ID: {self.distance_id}"
 
 
-# Global Address list to be called anywhere in the program when needed to iterate through all address mappings
-address_list = []
+# Normalizes an address string for use as a key in an address index, so that differences in case and spacing between
+# the package file and the address file do not cause a failed lookup
+# Big-O: O(1) -> addresses are short strings
+def normalize_address(address):
+    return " ".join(str(address).split()).lower()
 
 
-# Readings through the Delivery Addresses csv file and create entries for all addresses
+# Readings through the Delivery Addresses csv file and returns a list of address mappings for all addresses
 # Big-O: O(n)
-def read_addresses_csv():
+def read_addresses_csv(file_name="WGUPS Delivery Addresses.csv"):
+    address_list = []
     # Opens the CSV
-    with open("WGUPS Delivery Addresses.csv", 'r') as file:
+    with open(file_name, 'r') as file:
         reader = csv.reader(file)
         # loops over each row in the csv reader and keeps an index of the loop count for assigning distance_id's
         for i, row in enumerate(reader):
             address = row[0].strip()
             # Special check for the HUB address mapping
             if address == 'HUB':
-                AddressMap(address, None, i)
+                address_list.append(AddressMap(address, None, i))
             # All other address mappings are handled the same
             else:
                 address, zip_code = address.rsplit('(', 1)
                 address = address.strip()
                 zip_code = zip_code.strip(')')
-                AddressMap(address, zip_code, i)
+                address_list.append(AddressMap(address, zip_code, i))
+    return address_list
 
 
-# Reading through the distance table csv to create a matrix/2D list for finding the distance between
+# Builds a lookup table of normalized address -> distance_id from a list of address mappings, so that finding the
+# distance_id of an address is a single dictionary lookup instead of a scan over every address mapping.
+# The first mapping for an address wins, matching the order the distance table was written in
+# Big-O: O(n)
+def build_address_index(address_list):
+    address_index = {}
+    for a in address_list:
+        address_index.setdefault(normalize_address(a.address), a.distance_id)
+    return address_index
+
+
+# Dense, symmetric distance table stored as one contiguous row-major array of floats, so that every lookup is a
+# single index and a full row of distances from one address can be sliced out at once for nearest neighbour searches.
+# The default typecode 'd' stores float64 values, 'f' can be passed to halve memory use with float32 values
+class DistanceMatrix:
+    # Initializes the matrix from a flat buffer holding size*size distances
+    # Big-O: O(1)
+    def __init__(self, size, values):
+        self.size = size
+        self.values = values
+
+    # Builds the dense matrix from a ragged list of rows, where a cell is either a float or None when it was left blank.
+    # Only one half of the table has to be filled in, blank cells are mirrored from the other half, and the
+    # diagonal is always 0.0. A cell blank in both halves has no known distance and is stored as infinity
+    # Big-O: O(n^2)
+    @classmethod
+    def from_rows(cls, rows, typecode='d'):
+        size = len(rows)
+        values = array(typecode, bytes(array(typecode).itemsize * size * size))
+        missing = 0
+        for i in range(size):
+            for j in range(size):
+                if i == j:
+                    continue
+                distance = cell_value(rows, i, j)
+                if distance is None:
+                    distance = cell_value(rows, j, i)
+                if distance is None:
+                    missing += 1
+                    distance = inf
+                values[i * size + j] = distance
+        if missing:
+            print(f"{missing // 2} pairs of addresses have no distance in either half of the distance table.")
+        return cls(size, values)
+
+    # Returns the distance between 2 distance_ids
+    # Big-O: O(1)
+    def distance(self, a1, a2):
+        return self.values[a1 * self.size + a2]
+
+    # Returns the distances from one distance_id to every other distance_id, indexed by distance_id
+    # Big-O: O(n)
+    def row(self, a):
+        start = a * self.size
+        return self.values[start:start + self.size]
+
+    # Returns the distances from one distance_id to each of the given distance_ids, in the same order
+    # Big-O: O(m) -> m being the number of distance_ids given
+    def one_to_many(self, a, ids):
+        row = self.row(a)
+        return [row[i] for i in ids]
+
+    # Returns a list of rows, one for each distance_id in ids_a, holding its distances to each of ids_b
+    # Big-O: O(n*m)
+    def many_to_many(self, ids_a, ids_b):
+        return [self.one_to_many(a, ids_b) for a in ids_a]
+
+    # Returns the distance_id out of ids closest to distance_id a along with its distance, or [None, None] if
+    # ids is empty. Ties go to whichever id comes first
+    # Big-O: O(m) -> m being the number of distance_ids given
+    def nearest(self, a, ids):
+        row = self.row(a)
+        best = min(ids, key=row.__getitem__, default=None)
+        if best is None:
+            return [None, None]
+        return [best, row[best]]
+
+
+# DistanceMatrix of the shortest path distances between addresses, which can be shorter than the distances in the
+# table when going through another address is shorter than the direct entry. next_hop holds, for every pair of
+# distance_ids, the first address after the start on the shortest path between them, in the same row-major layout as
+# the distances, so the full path can be rebuilt with path()
+class ShortestPathMatrix(DistanceMatrix):
+    # Initializes the matrix from flat buffers holding size*size distances and size*size next hops
+    # Big-O: O(1)
+    def __init__(self, size, values, next_hop):
+        super().__init__(size, values)
+        self.next_hop = next_hop
+
+    # Returns the distance_ids of the addresses on the shortest path from a1 to a2, starting with a1 and ending with
+    # a2, or an empty list if there is no path between them
+    # Big-O: O(p) -> p being the addresses on the path
+    def path(self, a1, a2):
+        next_hop = self.next_hop
+        size = self.size
+        if next_hop[a1 * size + a2] == NO_PATH:
+            return []
+        path = [a1]
+        while a1 != a2:
+            a1 = next_hop[a1 * size + a2]
+            path.append(a1)
+        return path
+
+
+# Computes the shortest path between every pair of addresses of a DistanceMatrix with the Floyd-Warshall algorithm,
+# and returns them as a ShortestPathMatrix. Each row is kept as a list, and for every intermediate address k a
+# single pass of map() over the rows of i and k tells if going through k shortens any path from i, so the slow
+# update of a row in Python only runs for the rows that actually change, which is rare in real distance tables.
+# When the table is symmetric, as distance tables filled in from one half are, only the part of each row after the
+# diagonal is compared and every shorter path found is mirrored to the other half, halving the comparisons.
+# The check still compares pairs of rows for every k, so the time grows with the cube of the addresses: about 0.6
+# seconds for 300 addresses, 5 seconds for 600 and 25 seconds for 1000, which puts 3000 addresses at around ten
+# minutes. load_shortest_paths() caches the result, so this is only paid once for each distance table.
+# Prints the number of pairs that were shortened
+# Big-O: O(n^3) -> n being the addresses
+def floyd_warshall(matrix):
+    size = matrix.size
+    rows = [list(matrix.row(i)) for i in range(size)]
+    hops = [[j if distance != inf else NO_PATH for j, distance in enumerate(row)] for row in rows]
+    symmetric = all(list(column) == row for row, column in zip(rows, zip(*rows)))
+    for k in range(size):
+        row_k = rows[k]
+        for i in range(size):
+            row_i = rows[i]
+            via = row_i[k] + MIN_SHORTCUT
+            if i == k or via == inf:
+                continue
+            # row_i[j] - row_k[j] > via is the same as a shorter path from i to j through k
+            if symmetric:
+                start = i + 1
+                if max(map(sub, row_i[start:], row_k[start:]), default=0) <= via:
+                    continue
+            else:
+                start = 0
+                if max(map(sub, row_i, row_k)) <= via:
+                    continue
+            hops_i = hops[i]
+            hop = hops_i[k]
+            for j in range(start, size):
+                if via + row_k[j] < row_i[j]:
+                    row_i[j] = row_i[k] + row_k[j]
+                    hops_i[j] = hop
+                    if symmetric:
+                        rows[j][i] = row_i[j]
+                        hops[j][i] = hops[j][k]
+    shortened = sum(sum(map(lt, rows[i], matrix.row(i))) for i in range(size))
+    if shortened:
+        print(f"{shortened} distances in the distance table are longer than a path through other addresses.")
+    typecode = matrix.values.typecode if type(matrix.values) is array else matrix.values.format
+    return ShortestPathMatrix(size, array(typecode, [d for row in rows for d in row]),
+                              array('i', [h for row in hops for h in row]))
+
+
+# Returns the value of a cell in a ragged list of rows, or None if the cell is blank or missing
+# Big-O: O(1)
+def cell_value(rows, i, j):
+    if j < len(rows[i]):
+        return rows[i][j]
+    return None
+
+
+# Reading through the distance table csv to create a DistanceMatrix for finding the distance between
 # any 2 address mappings
 # Big-O: O(n^2)
-def read_distance_csv():
-    with open("WGUPS Distance Table.csv", 'r') as file:
+def read_distance_csv(file_name="WGUPS Distance Table.csv", typecode='d'):
+    with open(file_name, 'r') as file:
         reader = csv.reader(file)
         distances = []
         # separating the csv into rows
         for row in reader:
+            # blank lines, such as a trailing newline, are not rows of the table
+            if not row:
+                continue
             distances_row = []
             # separating the rows into cells/columns
             for cell in row:
-                # Try/Catch block to fill in null cells with 0.0
+                # Try/Catch block to mark blank cells with None, so they are never mistaken for a true 0.0 distance
                 try:
                     distances_row.append(float(cell))
                 except ValueError:
-                    distances_row.append(0.0)
+                    distances_row.append(None)
             # appends the new row to the list of rows
             distances.append(distances_row)
-    # Returns the matrix
-    return distances
+    # Returns the dense matrix built from the rows
+    return DistanceMatrix.from_rows(distances, typecode)
 
 
-# Stores the matrix created by read_distance_csv()
-distance_map = read_distance_csv()
+# Layout of the compiled distance cache: a fixed size header followed by the dense matrix as raw row-major floats.
+# The header stores a magic tag, format version, byte order, typecode, matrix size and the modification time, size and
+# crc32 checksum of the csv it was compiled from, so a cache is only trusted while it still matches its source csv.
+# The header is padded to 64 bytes so that the floats after it stay aligned when the file is memory-mapped.
+CACHE_MAGIC = b"WGUDMAT1"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<8sHcc4xQqQI")
+CACHE_HEADER_SIZE = 64
+# A compiled shortest path cache has the same header with its own magic tag, followed by the shortest path distances
+# and then the next hops as 32 bit ints, both row-major
+PATH_CACHE_MAGIC = b"WGUPATH1"
 
 
-# Basic function call to return the value at the row and column specified, but in some cases it may return 0.0 when
-# the distance is not 0.0, because only the lower left half of the table contains the actual distances, and the
-# rest of the table is 0.0. To fix this it swaps the index mappings when they return 0.0 and tries again, if it
-# still returns 0.0 the actual distance is 0.0, otherwise it gets the true distance
+# Returns the default cache file name for a distance table csv, kept next to the csv it was compiled from. The name
+# holds the typecode of the cache, so matrices of each typecode loaded from the same csv keep their own cache instead
+# of replacing each other's on every load
 # Big-O: O(1)
-def int_distance(a1: int, a2: int):
-    distance = distance_map[a1][a2]
-    if distance == 0.0:
-        distance = distance_map[a2][a1]
-    if type(distance) is None:
-        print(f"something went wrong, int_distance({a1}{a2}) returned a NoneType")
-    return distance
+def distance_cache_name(file_name, typecode='d'):
+    return f"{os.path.splitext(file_name)[0]}.{typecode}.dmat"
 
 
-# This serves the same purpose as int_distance, but is instead fed 2 string arguments, which it then converts into
-# distance_ids before passing them along to the int_distance function
-# Big-O: O(n)
-def address_distance(a1: str, a2: str):
-    d1 = None
-    d2 = None
-    for a in address_list:
-        if str(a.address) == a1:
-            d1 = a.distance_id
-        if str(a.address) == a2:
-            d2 = a.distance_id
-    if d1 is None or d2 is None:
-        print("No distance mapping found for one or both of provided addresses.")
-        print(f"address 1 is {a1} id: {d1} \naddress 2 is {a2} id: {d2}")
-        return
-    distance = int_distance(int(d1), int(d2))
-    return distance
-
-
-# This function again serves the same purpose as int_distance() and address_distance(), but is passed 2
-# package objects instead, grabs their addresses and passes them to address_distance()
-# Big-O: O(n)
-def package_distance(p1: Package, p2: Package):
-    a1 = p1.address
-    a2 = p2.address
-    distance = address_distance(a1, a2)
+# Returns the crc32 checksum of a file, read in blocks so large tables do not need to fit in memory
+# Big-O: O(n) -> n being the size of the file
+def file_checksum(file_name):
+    checksum = 0
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            checksum = zlib.crc32(block, checksum)
+    return checksum
 
-    return distance
 
+# Packs the header of a compiled cache, stamped with the details of the source csv, and padded to CACHE_HEADER_SIZE
+# Big-O: O(n) -> n being the size of the source csv, for its checksum
+def cache_header(magic, typecode, size, source_file):
+    stat = os.stat(source_file)
+    byte_order = b"<" if sys.byteorder == "little" else b">"
+    header = CACHE_HEADER.pack(magic, CACHE_VERSION, byte_order, typecode.encode(), size,
+                               stat.st_mtime_ns, stat.st_size, file_checksum(source_file))
+    return header.ljust(CACHE_HEADER_SIZE, b"\0")
 
-# This function also returns a distance like the others, but has a specific use case for when the distance
-# to the hub is needed, and can be passed an int distance_id, an address string or a package obj
-# Big-O: O(n)
-def hub_distance(package):
-    if type(package) == int:
-        return int_distance(0, package)
-    elif type(package) == str:
-        for a in address_list:
-            if a.address == package:
-                return int_distance(0, a.distance_id)
-    elif type(package) == Package:
-        for a in address_list:
-            # print(f"{a.address} <-> {package.address}")
-            if a.address == package.address:
-                return int_distance(0, a.distance_id)
-        print(
-            f"Package #: {package.id} does not return an address matching any address in the database, distance cannot be mapped")
-        return
-    else:
-        print(f"{package} is an invalid  argument, cannot return distance from hub")
-        return
+
+# Writes a header and the given buffers to a cache file. The cache is written to a temporary file first and then moved
+# into place, so other processes never see a half written cache
+# Big-O: O(n) -> n being the size of the buffers
+def write_cache_file(cache_file, header, buffers):
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'wb') as file:
+        file.write(header)
+        for buffer in buffers:
+            file.write(buffer)
+    os.replace(temp_file, cache_file)
+
+
+# Opens a compiled cache with mmap and returns [size, memoryview of everything after the header], or None if the cache
+# is missing, damaged, or no longer matches its source csv (or the source csv can't be read). cell_bytes is the number
+# of bytes the cache stores for every cell of a size*size matrix. The source csv is only checksummed when its
+# modification time has changed
+# Big-O: O(1) -> O(n) for the checksum of a source csv that has been touched since the cache was written
+def map_cache_file(cache_file, source_file, magic, typecode, cell_bytes):
+    try:
+        with open(cache_file, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapped) < CACHE_HEADER_SIZE:
+        mapped.close()
+        return None
+    cache_magic, version, byte_order, cache_typecode, size, mtime, source_size, checksum = \
+        CACHE_HEADER.unpack_from(mapped)
+    # a source csv that can't be read can't be checked against the cache, so the cache is treated as stale
+    try:
+        stat = os.stat(source_file)
+    except OSError:
+        mapped.close()
+        return None
+    valid = (cache_magic == magic and version == CACHE_VERSION
+             and byte_order == (b"<" if sys.byteorder == "little" else b">")
+             and cache_typecode.decode() == typecode
+             and len(mapped) == CACHE_HEADER_SIZE + size * size * cell_bytes
+             and stat.st_size == source_size
+             and (stat.st_mtime_ns == mtime or file_checksum(source_file) == checksum))
+    if not valid:
+        mapped.close()
+        return None
+    return [size, memoryview(mapped)[CACHE_HEADER_SIZE:]]
+
+
+# Compiles a DistanceMatrix into the binary cache format, stamped with the details of the source csv
+# Big-O: O(n^2)
+def write_distance_cache(matrix, cache_file, source_file):
+    header = cache_header(CACHE_MAGIC, matrix.values.typecode, matrix.size, source_file)
+    write_cache_file(cache_file, header, [matrix.values.tobytes()])
+
+
+# Opens a compiled distance cache with mmap and returns a DistanceMatrix reading straight from the mapped pages, or
+# None if the cache is missing, damaged, or no longer matches its source csv. Only the header is read up front, so
+# opening takes the same time for any size of matrix, and every process opening the same cache shares its pages.
+# The source csv is only checksummed when its modification time has changed, e.g. after being copied
+# Big-O: O(1) -> O(n) for the checksum of a source csv that has been touched since the cache was written
+def open_distance_cache(cache_file, source_file, typecode='d'):
+    mapped = map_cache_file(cache_file, source_file, CACHE_MAGIC, typecode, array(typecode).itemsize)
+    if mapped is None:
+        return None
+    size, payload = mapped
+    return DistanceMatrix(size, payload.cast(typecode))
+
+
+# Returns the default shortest path cache file name for a distance table csv or distance cache, kept next to it. The
+# name holds the typecode the same as distance_cache_name(), and ends in .paths.dmat, so it never shares a name with a
+# distance cache but is treated alike as a generated file
+# Big-O: O(1)
+def shortest_path_cache_name(file_name, typecode='d'):
+    return f"{os.path.splitext(file_name)[0]}.paths.{typecode}.dmat"
+
+
+# Compiles a ShortestPathMatrix into the binary shortest path cache format, stamped with the details of the source csv
+# Big-O: O(n^2)
+def write_shortest_path_cache(paths, cache_file, source_file):
+    typecode = paths.values.typecode if type(paths.values) is array else paths.values.format
+    header = cache_header(PATH_CACHE_MAGIC, typecode, paths.size, source_file)
+    write_cache_file(cache_file, header, [paths.values.tobytes(), paths.next_hop.tobytes()])
+
+
+# Opens a compiled shortest path cache with mmap and returns a ShortestPathMatrix reading straight from the mapped
+# pages, or None if the cache is missing, damaged, or no longer matches its source csv
+# Big-O: O(1) -> O(n) for the checksum of a source csv that has been touched since the cache was written
+def open_shortest_path_cache(cache_file, source_file, typecode='d'):
+    item_size = array(typecode).itemsize
+    mapped = map_cache_file(cache_file, source_file, PATH_CACHE_MAGIC, typecode, item_size + array('i').itemsize)
+    if mapped is None:
+        return None
+    size, payload = mapped
+    split = size * size * item_size
+    return ShortestPathMatrix(size, payload[:split].cast(typecode), payload[split:].cast('i'))
+
+
+# Loads the distance table, using the compiled cache when it is still valid. Otherwise the csv is parsed, compiled into
+# a new cache for the next run, and the new cache is opened so this process also shares its pages. If the cache cannot
+# be written (e.g. a read only directory) the matrix parsed from the csv is used as is
+# Big-O: O(1) with a valid cache, O(n^2) when the csv has to be parsed
+def load_distance_matrix(file_name="WGUPS Distance Table.csv", cache_file=None, typecode='d'):
+    if cache_file is None:
+        cache_file = distance_cache_name(file_name, typecode)
+    matrix = open_distance_cache(cache_file, file_name, typecode)
+    if matrix is not None:
+        return matrix
+    matrix = read_distance_csv(file_name, typecode)
+    try:
+        write_distance_cache(matrix, cache_file, file_name)
+    except OSError as e:
+        print(f"Could not write distance cache {cache_file}, using the distance table csv directly. ({e})")
+        return matrix
+    return open_distance_cache(cache_file, file_name, typecode) or matrix
+
+
+# Loads the shortest path distances of the distance table, using the compiled shortest path cache when it is still
+# valid. Otherwise the distance table is loaded with load_distance_matrix() (from distance_cache if given), its
+# shortest paths are computed with floyd_warshall(), which takes minutes for tables of a thousand addresses or more,
+# and compiled into a new cache for the next run
+# Big-O: O(1) with a valid cache, O(n^3) when the shortest paths have to be computed
+def load_shortest_paths(file_name="WGUPS Distance Table.csv", cache_file=None, typecode='d', distance_cache=None):
+    if cache_file is None:
+        cache_file = shortest_path_cache_name(distance_cache or file_name, typecode)
+    paths = open_shortest_path_cache(cache_file, file_name, typecode)
+    if paths is not None:
+        return paths
+    paths = floyd_warshall(load_distance_matrix(file_name, distance_cache, typecode))
+    try:
+        write_shortest_path_cache(paths, cache_file, file_name)
+    except OSError as e:
+        print(f"Could not write shortest path cache {cache_file}, using the computed shortest paths directly. ({e})")
+        return paths
+    return open_shortest_path_cache(cache_file, file_name, typecode) or paths
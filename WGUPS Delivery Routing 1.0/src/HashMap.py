@@ -1,91 +1,261 @@
 import csv
+import gc
+import time
+from itertools import islice
+from sys import intern
 
+from Distances import normalize_address
 from Package import Package
 
 
-# Class for creating a mapping table of objects, to be easily retrieved using a key value
+# Markers for slots of the hash table that have never been used, and slots whose object has been deleted. Deleted
+# slots must stay distinct from empty ones, so that lookups keep probing past them to objects inserted later
+EMPTY = object()
+DELETED = object()
+
+# Multiplier for fibonacci hashing, spreads sequential or evenly spaced ids across the whole table
+FIBONACCI_MULTIPLIER = 11400714819323198485
+
+
+# Class for creating a mapping table of objects, to be easily retrieved using a key value. Uses open addressing with
+# linear probing over 2 parallel lists, one holding the id of each slot and one holding the object, and doubles its
+# capacity whenever the share of used slots passes max_load, so lookups stay O(1) no matter how many objects it holds
 class HashMap:
-    # Initializes the Hashmap class
-    # Big-O: O(1)
-    def __init__(self):
-        self.capacity = 20
-        self.buckets = [[] for _ in range(self.capacity)]
-        self.length = 0
+    # Initializes the Hashmap class, capacity is rounded up to a power of 2
+    # Big-O: O(n) -> n being the initial capacity
+    def __init__(self, capacity=16, max_load=0.7):
+        self.max_load = max_load
+        self.capacity = 8
+        while self.capacity < capacity:
+            self.capacity *= 2
+        self.shift = 65 - self.capacity.bit_length()    # keeps the top bits of the hash, enough to index capacity
+        self.keys = [EMPTY] * self.capacity
+        self.values = [None] * self.capacity
+        self.length = 0     # number of objects stored
+        self.used = 0       # number of slots that are not empty, including deleted slots
 
-    # Creates a key to find the correct bucket for an object
+    # Creates a key to find the first slot to probe for an object
     # Big-O: O(1)
     def create_key(self, id):
-        return hash(id) % self.capacity
+        return ((hash(id) * FIBONACCI_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> self.shift
 
-    # inserts an object into the hashmap
-    # Big-O: O(1)
+    # Returns the slot holding the given id, or -1 if the id is not in the hashmap
+    # Big-O: O(1) -> average, the table is never allowed to fill up past max_load
+    def find_slot(self, id):
+        keys = self.keys
+        mask = self.capacity - 1
+        i = self.create_key(id)
+        while True:
+            key = keys[i]
+            if key is EMPTY:
+                return -1
+            if key == id:
+                return i
+            i = (i + 1) & mask
+
+    # Rebuilds the table with the given capacity, re-inserting every object and dropping deleted slots. Every id is
+    # known to be unique, so objects are placed in the first empty slot found without checking for duplicates
+    # Big-O: O(n)
+    def resize(self, capacity):
+        objects = [p for p in self.values if p is not None]
+        self.capacity = capacity
+        self.shift = 65 - capacity.bit_length()
+        keys = self.keys = [EMPTY] * capacity
+        values = self.values = [None] * capacity
+        mask = capacity - 1
+        shift = self.shift
+        for p in objects:
+            id = p.id
+            i = ((hash(id) * FIBONACCI_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> shift
+            while keys[i] is not EMPTY:
+                i = (i + 1) & mask
+            keys[i] = id
+            values[i] = p
+        self.length = len(objects)
+        self.used = len(objects)
+
+    # Inserts a list of objects, growing the table once up front to fit all of them instead of doubling repeatedly
+    # Big-O: O(m) -> m being the number of objects given
+    def insert_many(self, packages):
+        needed = self.used + len(packages)
+        if needed > self.capacity * self.max_load:
+            capacity = self.capacity
+            while needed > capacity * self.max_load:
+                capacity *= 2
+            self.resize(capacity)
+        for p in packages:
+            self.insert(p)
+
+    # inserts an object into the hashmap, replacing any object already stored with the same id
+    # Big-O: O(1) -> amortized, as the table doubles in size when it needs to grow
     def insert(self, package):
-        key = self.create_key(package.id)
-        self.buckets[key].append(package)
+        if (self.used + 1) > self.capacity * self.max_load:
+            # grow when the table is mostly live objects, otherwise rebuilding in place clears the deleted slots
+            self.resize(self.capacity * 2 if self.length * 2 >= self.used else self.capacity)
+        id = package.id
+        keys = self.keys
+        mask = self.capacity - 1
+        i = self.create_key(id)
+        first_deleted = -1
+        while True:
+            key = keys[i]
+            if key is EMPTY:
+                break
+            if key is DELETED:
+                if first_deleted < 0:
+                    first_deleted = i
+            elif key == id:
+                self.values[i] = package
+                return
+            i = (i + 1) & mask
+        if first_deleted >= 0:
+            i = first_deleted
+        else:
+            self.used += 1
+        keys[i] = id
+        self.values[i] = package
         self.length += 1
 
     # Updates the variable of a object matching the ID given with a new value
-    # Big-O: O(n) -> However the number of objects in each bucket will typically
-    # be very small, so in practice the avg complexity should be O(1)
+    # Big-O: O(1)
     def update_attr(self, id, variable, new_value):
-        key = self.create_key(id)
-        bucket = self.buckets[key]
-        for p in bucket:
-            if p.id == id:
-                setattr(p, variable, new_value)
-                break
+        i = self.find_slot(id)
+        if i >= 0:
+            setattr(self.values[i], variable, new_value)
 
-    # Deletes a specified obj from the hashmap
-    # Big-O: O(n) -> However the number of objects in each bucket will typically
-    # be very small, so in practice the avg complexity should be O(1)
+    # Deletes a specified obj from the hashmap, leaving a deleted marker in its slot
+    # Big-O: O(1)
     def delete(self, id):
-        success = False
-        key = self.create_key(id)
-        for p in self.buckets[key]:
-            if p.id == id:
-                del self.buckets[key]
-                self.length -= 1
-                success = True
-                break
-        if not success:
+        i = self.find_slot(id)
+        if i < 0:
             print(f"Package with ID {id} not found.")
+            return
+        self.keys[i] = DELETED
+        self.values[i] = None
+        self.length -= 1
 
     # Retrieves an obj object from a given ID
-    # Big-O: O(n) -> However the number of objects in each bucket will typically
-    # be very small, so in practice the avg complexity should be O(1)
+    # Big-O: O(1)
     def retrieve(self, id):
-        key = self.create_key(id)
-        for p in self.buckets[key]:
-            if p.id == id:
-                return p
+        i = self.find_slot(id)
+        if i >= 0:
+            return self.values[i]
         print(f"no package matching id {id} found.")
 
     # Retrieves a specified attribute from an object matching the key given
-    # Big-O: O(n) -> However the number of objects in each bucket will typically
-    # be very small, so in practice the avg complexity should be O(1)
+    # Big-O: O(1)
     def retrieve_attr(self, id, variable_name):
-        key = self.create_key(id)
-        for p in self.buckets[key]:
-            if p.id == id:
-                return getattr(p, variable_name)
+        i = self.find_slot(id)
+        if i >= 0:
+            return getattr(self.values[i], variable_name)
         return None
 
+    # Retrieves the objects for a list of IDs in one call, in the same order, with None for any ID not found
+    # Big-O: O(m) -> m being the number of IDs given
+    def get_many(self, ids):
+        values = self.values
+        slots = [self.find_slot(id) for id in ids]
+        return [values[i] if i >= 0 else None for i in slots]
+
+    # Checks if an object with the given ID is in the hashmap
+    # Big-O: O(1)
+    def __contains__(self, id):
+        return self.find_slot(id) >= 0
+
+    # Returns the number of objects in the hashmap
+    # Big-O: O(1)
+    def __len__(self):
+        return self.length
+
+    # Iterates over every object in the hashmap, in no particular order
+    # Big-O: O(n)
+    def __iter__(self):
+        return (p for p in self.values if p is not None)
+
 
-# Creates a hash map of packages from the package file csv, and returns it.
+# Reads the package file csv in chunks of up to chunk_size rows, so a large manifest never has to be held in memory
+# as rows all at once. Blank lines are skipped
 # Big-O: O(n)
-def package_csv_hashmap():
-    hashmap = HashMap()
-    with open("WGUPS Package File.csv", "r") as file:
+def read_package_chunks(file_name="WGUPS Package File.csv", chunk_size=10000):
+    with open(file_name, "r", newline="") as file:
         reader = csv.reader(file)
+        while True:
+            chunk = [line for line in islice(reader, chunk_size) if line]
+            if not chunk:
+                return
+            yield chunk
 
-        for line in reader:
-            id, address, city, state, zip, deadline, kilos, special_notes, *_ = line
-            package = Package(id, address, city, state, zip, deadline, kilos, special_notes)
-            hashmap.insert(package)
 
-        return hashmap
+# Creates Package objects from a list of package file rows. Address, city, state and zip strings are interned, so
+# packages going to the same address share one copy of each string. When an address_index is given, each package
+# also gets its distance_id resolved in the same pass, with each distinct address normalized only once
+# Big-O: O(n)
+def packages_from_rows(rows, address_index=None, address_ids=None):
+    if address_ids is None:
+        address_ids = {}
+    packages = []
+    for line in rows:
+        id, address, city, state, zip, deadline, kilos, special_notes, *_ = line
+        address = intern(address)
+        package = Package(id, address, intern(city), intern(state), intern(zip), deadline, kilos, intern(special_notes))
+        if address_index is not None:
+            if address not in address_ids:
+                address_ids[address] = address_index.get(normalize_address(address))
+            package.distance_id = address_ids[address]
+            if package.distance_id is None:
+                print(f"Package #: {package.id} does not return an address matching any address in the database, distance cannot be mapped")
+        packages.append(package)
+    return packages
 
 
-# call to the package_csv_hashmap() method to assign a global persistent variable name to the hashmap to be
-# easily referenced elsewhere in the program
-package_map = package_csv_hashmap()
+# Creates a hash map of packages from the package file csv, and returns it. The file is read chunk_size rows at a
+# time, and when an address_index is given, packages get their distance_id resolved while they are loaded
+# Big-O: O(n)
+def package_csv_hashmap(file_name="WGUPS Package File.csv", address_index=None, chunk_size=10000):
+    hashmap = HashMap()
+    address_ids = {}    # address string -> distance_id, shared across chunks
+    # The cyclic garbage collector is paused while loading, otherwise it repeatedly scans every package created so
+    # far as the number of live objects grows, which makes loading a large manifest far slower than linear
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for chunk in read_package_chunks(file_name, chunk_size):
+            hashmap.insert_many(packages_from_rows(chunk, address_index, address_ids))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return hashmap
+
+
+# Follows a package file that is still being written to, like "tail -f", yielding batches of up to chunk_size new
+# rows as they are appended. A partly written last line is held back until it is complete. Waits poll_interval
+# seconds between checks for new rows, and stops once no new rows have arrived for idle_timeout seconds
+# (an idle_timeout of 0 reads the rows already in the file and stops)
+# Big-O: O(n)
+def follow_package_file(file_name, chunk_size=10000, poll_interval=1.0, idle_timeout=0.0):
+    with open(file_name, "r", newline="") as file:
+        partial = ""
+        lines = []
+        idle_since = time.monotonic()
+        while True:
+            line = file.readline()
+            if line:
+                partial += line
+                if partial.endswith("\n"):
+                    if partial.strip():
+                        lines.append(partial)
+                    partial = ""
+                    idle_since = time.monotonic()
+                    if len(lines) >= chunk_size:
+                        yield list(csv.reader(lines))
+                        lines = []
+                continue
+            # no new data, hand over whatever has arrived before waiting for more
+            if lines:
+                yield list(csv.reader(lines))
+                lines = []
+            if time.monotonic() - idle_since >= idle_timeout:
+                if partial.strip():
+                    yield list(csv.reader([partial]))
+                return
+            time.sleep(poll_interval)
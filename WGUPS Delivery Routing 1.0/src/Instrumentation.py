@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import cProfile
+import io
+import pstats
+import sys
+import time as clock
+import tracemalloc
+
+import DeliveryRouting
+import LivePlan
+import Simulation
+import TruckSort
+from Distances import DistanceMatrix
+from HashMap import EMPTY, HashMap
+from Scenario import Scenario
+
+# True while the counting and timing wrappers of enable() are in place. When it is False the program runs its own
+# functions untouched, so instrumentation costs nothing unless it is turned on
+ENABLED = False
+
+counters = {}       # name -> number of times it was counted
+timers = {}         # name -> [calls, seconds]
+replaced = []       # [owner, attribute name, original] of everything replaced by enable(), restored by disable()
+
+
+# Adds n to a counter
+# Big-O: O(1)
+def count(name, n=1):
+    counters[name] = counters.get(name, 0) + n
+
+
+# Adds one call taking the given number of seconds to a timer
+# Big-O: O(1)
+def add_time(name, seconds):
+    timer = timers.get(name)
+    if timer is None:
+        timers[name] = [1, seconds]
+    else:
+        timer[0] += 1
+        timer[1] += seconds
+
+
+# Times the code run inside a with block, adding it to the named timer. Unlike the wrappers of enable(), the block is
+# timed whether or not instrumentation is enabled, so it should only be used outside the hot paths
+# Big-O: O(1)
+@contextlib.contextmanager
+def section(name):
+    start = clock.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, clock.perf_counter() - start)
+
+
+# Clears every counter and timer
+# Big-O: O(1)
+def reset():
+    counters.clear()
+    timers.clear()
+
+
+# Returns a wrapper around a function that counts each call under the given name
+# Big-O: O(1)
+def counted(function, name):
+    def wrapper(*args, **kwargs):
+        counters[name] = counters.get(name, 0) + 1
+        return function(*args, **kwargs)
+    return wrapper
+
+
+# Returns a wrapper around a function that times each call under the given name followed by the id of the truck passed
+# as the argument at truck_position, which may be a Truck or a truck id
+# Big-O: O(1)
+def timed_per_truck(function, name, truck_position):
+    def wrapper(*args, **kwargs):
+        truck = args[truck_position]
+        start = clock.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            add_time(f"{name} truck {truck if type(truck) is int else truck.truck}", clock.perf_counter() - start)
+    return wrapper
+
+
+# Replacement for HashMap.find_slot() while instrumentation is enabled, probing the same way and counting every lookup
+# and every slot it probes
+# Big-O: O(1) -> average, see HashMap.find_slot()
+def counted_find_slot(self, id):
+    keys = self.keys
+    mask = self.capacity - 1
+    i = self.create_key(id)
+    probes = 1
+    while True:
+        key = keys[i]
+        if key is EMPTY or key == id:
+            break
+        i = (i + 1) & mask
+        probes += 1
+    counters["hashmap lookups"] = counters.get("hashmap lookups", 0) + 1
+    counters["hashmap probes"] = counters.get("hashmap probes", 0) + probes
+    return -1 if key is EMPTY else i
+
+
+# Replaces an attribute of a class or module, remembering the original so disable() can put it back
+# Big-O: O(1)
+def replace(owner, name, value):
+    replaced.append([owner, name, getattr(owner, name)])
+    setattr(owner, name, value)
+
+
+# Turns instrumentation on, replacing the functions on the hot paths with wrappers that count and time them:
+#   distance lookups        DistanceMatrix.distance(), which Scenario.int_distance() goes through
+#   distance rows           DistanceMatrix.row(), read by the loaders and by next_delivery() for a whole row at once
+#   hashmap lookups/probes  HashMap.find_slot(), behind retrieve(), update_attr(), delete() and the in operator
+#   next_delivery calls     next_delivery(), as called by FleetSimulation and continue_route()
+#   loader iterations       each stop chosen by truck_sort(), from LoadingCandidates.select()
+#   loading truck N         the time truck_sort() spends loading each truck
+#   routing truck N         the time spent choosing each truck's stops, in FleetSimulation or continue_route()
+# Functions bound to a local name before instrumentation is enabled, such as scenario.int_distance inside a loop that
+# is already running, keep calling the originals. Reads of a DistanceMatrix's values made directly, as PlanSearch
+# does, are not counted
+# Big-O: O(1)
+def enable():
+    global ENABLED
+    if ENABLED:
+        return
+    ENABLED = True
+    replace(DistanceMatrix, "distance", counted(DistanceMatrix.distance, "distance lookups"))
+    replace(DistanceMatrix, "row", counted(DistanceMatrix.row, "distance rows"))
+    replace(HashMap, "find_slot", counted_find_slot)
+    for module in (DeliveryRouting, Simulation):
+        replace(module, "next_delivery", counted(module.next_delivery, "next_delivery calls"))
+    replace(TruckSort.LoadingCandidates, "select", counted(TruckSort.LoadingCandidates.select, "loader iterations"))
+    replace(TruckSort, "truck_sort", timed_per_truck(TruckSort.truck_sort, "loading", 1))
+    replace(Simulation.FleetSimulation, "next_stop", timed_per_truck(Simulation.FleetSimulation.next_stop, "routing", 1))
+    for module in (DeliveryRouting, LivePlan):
+        replace(module, "continue_route", timed_per_truck(module.continue_route, "routing", 1))
+
+
+# Turns instrumentation off, putting back every function replaced by enable(). Counters and timers are kept until
+# reset() is called
+# Big-O: O(1)
+def disable():
+    global ENABLED
+    while replaced:
+        owner, name, original = replaced.pop()
+        setattr(owner, name, original)
+    ENABLED = False
+
+
+# Writes the counters and timers to a file, timers with their total and average time per call
+# Big-O: O(c log c) -> c being the counters and timers
+def report(file=sys.stdout):
+    print("counter                              count", file=file)
+    for name in sorted(counters):
+        print(f"{name:<28} {counters[name]:>12}", file=file)
+    if counters.get("hashmap lookups"):
+        print(f"{'hashmap probes per lookup':<28} {counters['hashmap probes'] / counters['hashmap lookups']:>12.3f}",
+              file=file)
+    print("\ntimer                                calls     total ms   ms per call", file=file)
+    for name in sorted(timers):
+        calls, seconds = timers[name]
+        print(f"{name:<28} {calls:>12} {seconds * 1000:>12.2f} {seconds * 1000 / calls:>13.4f}", file=file)
+
+
+# Profiles a full run of load_trucks() and FleetSimulation on a scenario, with cProfile and, if memory is True,
+# tracemalloc, and with the counters and timers of enable() (unless instrument is False, which leaves cProfile
+# measuring the program's own functions only). The printing of the run is discarded. Writes a report of the counters
+# and timers, the top functions by cumulative time, and the peak memory with the lines allocating the most, to the
+# given file. Returns the total distance traveled by all trucks. Both profilers slow the run down, so the times are
+# for comparing parts of the run with each other, not for comparing with runs made without them
+# Big-O: see load_trucks() and FleetSimulation.run()
+def profile_run(scenario=None, file=sys.stdout, top=25, memory=True, instrument=True):
+    if scenario is None:
+        scenario = Scenario()
+    reset()
+    if instrument:
+        enable()
+    if memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            profiler.enable()
+            with section("load_trucks"):
+                TruckSort.load_trucks(scenario)
+            with section("FleetSimulation.run"):
+                miles = Simulation.FleetSimulation(scenario).run()
+            profiler.disable()
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+    finally:
+        profiler.disable()
+        if memory:
+            tracemalloc.stop()
+        disable()
+
+    print(f"Profiled load_trucks and FleetSimulation on {len(scenario.package_map)} packages and "
+          f"{len(scenario.truck_list)} trucks: {round(miles, 2)} miles\n", file=file)
+    report(file)
+    print(f"\nTop {top} functions by cumulative time", file=file)
+    pstats.Stats(profiler, stream=file).strip_dirs().sort_stats("cumulative").print_stats(top)
+    if memory:
+        print(f"Peak traced memory: {peak / 1024:.1f} KiB\nTop {top} lines by memory still allocated:", file=file)
+        for statistic in snapshot.statistics("lineno")[:top]:
+            print(f"  {statistic}", file=file)
+    return miles
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profiles loading and routing the trucks of the sample scenario.")
+    parser.add_argument("--output", default="-", help="file to write the report to, - for stdout")
+    parser.add_argument("--top", type=int, default=25, help="number of functions and lines to list")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracing memory with tracemalloc")
+    parser.add_argument("--no-counters", action="store_true", help="profile without the counters and timers")
+    parser.add_argument("--shortest-paths", action="store_true",
+                        help="route on the shortest paths between addresses instead of the table as is")
+    arguments = parser.parse_args()
+    profiled = Scenario(shortest_paths=arguments.shortest_paths)
+    if arguments.output == "-":
+        profile_run(profiled, sys.stdout, arguments.top, not arguments.no_memory, not arguments.no_counters)
+    else:
+        with open(arguments.output, "w") as report_file:
+            profile_run(profiled, report_file, arguments.top, not arguments.no_memory, not arguments.no_counters)
@@ -0,0 +1,281 @@
+from bisect import bisect_right, insort
+
+from DeliveryRouting import continue_route, deliver_package, report_route
+from Package import AddressCorrection, minutes, parse_special_notes
+from Truck import Stop
+from TruckSort import add_unloaded
+
+
+# LivePlan class, applies changes that become known during the day to a scenario whose trucks have already been
+# planned, without planning the whole day again. Each change re-routes only the truck it affects, from where that truck
+# is at the time of the change: stops it has already reached, and the stop it is driving to, are kept as they are, and
+# the rest of its packages are routed again from there, in the order they were planned in when possible. A truck that
+# has not left the hub yet is routed again from its departure. Each method takes the time of day the change becomes
+# known, and returns the truck that was routed again, or None if no truck was. A change to an address that is not in
+# the address file is rejected before anything is changed, returning False. Other trucks are left as they were, so a
+# truck leaving later than before does not move the departure of a truck waiting on its driver
+class LivePlan:
+    # Initializes the live plan for a scenario that has been planned
+    # Big-O: O(1)
+    def __init__(self, scenario):
+        self.scenario = scenario
+
+    # Returns True if an address can be mapped to a distance_id, otherwise prints why the change to the given package
+    # is rejected and returns False, the same as Scenario.resolve_distance_ids() reports an unmapped address
+    # Big-O: O(1)
+    def mapped(self, package_id, address):
+        if self.scenario.address_id(address) is not None:
+            return True
+        print(f"Package #: {package_id} address {address} does not match any address in the database, the change is rejected.")
+        return False
+
+    # Returns the number of stops at the start of a truck's route that can no longer change at the given time, being
+    # the stops reached by then and the stop the truck is driving to. Returns 0 for a truck that has not left yet
+    # Big-O: O(s) -> s being the stops on the route
+    def fixed_stops(self, truck, at):
+        if truck.departure_time is None or at < truck.departure_time:
+            return 0
+        reached = bisect_right([stop.arrival for stop in truck.route], at)
+        return min(reached + 1, len(truck.route))
+
+    # Returns True if a package can no longer be changed at the given time, as it has been delivered, is about to be,
+    # or is on a truck that has already returned to the hub
+    # Big-O: O(s) -> s being the stops on the package's truck
+    def is_fixed(self, package, at):
+        truck = self.scenario.truck(package.truck) if package.on_truck else None
+        if truck is None:
+            return False
+        if truck.return_time is not None and truck.return_time <= at:
+            return True
+        return any(package in stop.packages for stop in truck.route[:self.fixed_stops(truck, at)])
+
+    # Routes the rest of a truck's route again from where it is at the given time, keeping its fixed stops (see
+    # fixed_stops()), and updates its mileage, return time and the delivery times of the packages routed again. A
+    # package whose address correction only becomes known after the truck carries on from its last fixed stop is held
+    # back until then, even if the plan has already applied the correction. The rest of the route keeps its order when
+    # it still meets every deadline (see keep_order()), otherwise it is routed again with continue_route(). Returns the
+    # truck
+    # Big-O: O(n*a) -> n being the packages on the truck and a their addresses, see continue_route()
+    def reroute(self, truck, at):
+        scenario = self.scenario
+        package_map = scenario.package_map
+        route = truck.route
+        prefix = route[:self.fixed_stops(truck, at)]
+        kept = {p.id for stop in prefix for p in stop.packages}
+        resume = prefix[-1].arrival if prefix else truck.departure_time
+        pending = {c.package_id for c in scenario.address_corrections if c.time > resume}
+        for p in truck.packages:
+            if p.id not in kept:
+                package_map.update_attr(p.id, "delivered", None)
+                package_map.update_attr(p.id, "departure", truck.departure_time)
+                if p.id in pending:
+                    package_map.update_attr(p.id, "special_notes", "Wrong address listed")
+        truck.route = prefix
+
+        # the distance driven up to the last fixed stop is summed from the stops, instead of routing them again
+        distance = 0
+        previous = 0
+        for stop in prefix:
+            distance += scenario.int_distance(previous, stop.distance_id)
+            previous = stop.distance_id
+        if self.keep_order(truck, route[len(prefix):], distance):
+            return truck
+        if prefix:
+            truck.mileage = continue_route(scenario, truck, prefix[-1].packages[0], prefix[-1].arrival, distance)
+        else:
+            truck.mileage = continue_route(scenario, truck, "HUB", truck.departure_time, 0)
+        return truck
+
+    # Routes the undelivered packages of a truck whose route has been cut back to its fixed stops, in the order of the
+    # stops they had before (the rest of the route), inserting each package that was not on it, or whose address
+    # changed, where it adds the fewest miles. distance is the distance driven up to the last fixed stop. Returns
+    # False, leaving the truck unchanged, if a package is still waiting on an address correction, or the order would
+    # deliver a package late or return after the driver's shift
+    # Big-O: O(n*s) -> n being the packages inserted and s the stops left on the route
+    def keep_order(self, truck, rest, distance):
+        scenario = self.scenario
+        distance_between = scenario.int_distance
+        kept = {p.id for stop in truck.route for p in stop.packages}
+        onboard = {p.id: p for p in truck.packages if p.id not in kept}
+        if any("wrong address" in p.special_notes.lower() for p in onboard.values()):
+            return False
+        stops = []      # [distance_id, packages] of the stops left, in order
+        placed = set()
+        for stop in rest:
+            packages = [p for p in stop.packages if p.id in onboard and p.distance_id == stop.distance_id]
+            if packages:
+                stops.append([stop.distance_id, packages])
+                placed.update(p.id for p in packages)
+
+        start = truck.route[-1].distance_id if truck.route else 0
+        for p in onboard.values():
+            if p.id in placed:
+                continue
+            distance_id = scenario.package_distance_id(p)
+            same_address = [stop for stop in stops if stop[0] == distance_id]
+            if same_address:
+                same_address[0][1].append(p)
+                continue
+            ids = [start] + [stop[0] for stop in stops] + [0]
+            best = min(range(len(stops) + 1), key=lambda k: distance_between(ids[k], distance_id) +
+                       distance_between(distance_id, ids[k + 1]) - distance_between(ids[k], ids[k + 1]))
+            stops.insert(best, [distance_id, [p]])
+
+        current = truck.route[-1].arrival if truck.route else truck.departure_time
+        previous = start
+        arrivals = []
+        for distance_id, packages in stops:
+            leg = distance_between(previous, distance_id)
+            distance += leg
+            current = truck.travel(current, leg)
+            if any(minutes(current) > p.latest for p in packages):
+                return False
+            arrivals.append(current)
+            previous = distance_id
+        leg = distance_between(previous, 0)
+        distance += leg
+        return_time = truck.travel(current, leg)
+        if minutes(return_time) > truck.shift_end:
+            return False
+
+        for (distance_id, packages), arrival in zip(stops, arrivals):
+            for p in packages:
+                deliver_package(scenario, p, arrival)
+            truck.route.append(Stop(distance_id, packages, arrival))
+        truck.mileage = distance
+        report_route(truck, distance, return_time)
+        return True
+
+    # Returns the truck a package should be added to at the given time, or None if no truck can take it. Only trucks
+    # that have not left yet, have room, and leave after the package arrives at the hub are considered, along with the
+    # truck the package's notes assign it to, if any. Of those, the truck with a stop closest to the package's address
+    # is chosen, ties going to the truck leaving first
+    # Big-O: O(t*s) -> t being the trucks and s the stops on each route
+    def choose_truck(self, package, at):
+        scenario = self.scenario
+        distance_id = scenario.package_distance_id(package)
+        pinned = parse_special_notes(package.special_notes)[0] if package.special_notes else None
+        best = None
+        for t in scenario.truck_list:
+            if pinned is not None and t.truck != pinned:
+                continue
+            if t.departure_time is None or t.departure_time <= at or len(t.packages) >= t.capacity:
+                continue
+            if minutes(t.departure_time) < package.earliest:
+                continue
+            closest = min([scenario.int_distance(0, distance_id)] +
+                          [scenario.int_distance(stop.distance_id, distance_id) for stop in t.route])
+            if best is None or [closest, t.departure_time] < best[:2]:
+                best = [closest, t.departure_time, t]
+        return None if best is None else best[2]
+
+    # Loads a package that is not on a truck onto the truck chosen by choose_truck(), and routes that truck again.
+    # A package no truck can take is left with the scenario's unloaded packages
+    # Big-O: see reroute()
+    def place_package(self, package, at):
+        scenario = self.scenario
+        truck = self.choose_truck(package, at)
+        if truck is None:
+            print(f"No truck leaving after {at} can take package #: {package.id}, it is left unloaded.")
+            if scenario.unloaded_packages is not None:
+                add_unloaded(scenario, [package])
+            return None
+        if scenario.unloaded_packages is not None:
+            scenario.unloaded_packages.pop(package.id, None)
+        truck.packages.append(package)
+        scenario.package_map.update_attr(package.id, "truck", truck.truck)
+        scenario.package_map.update_attr(package.id, "on_truck", True)
+        return self.reroute(truck, at)
+
+    # Takes a package that has not been delivered off its truck, and returns the truck
+    # Big-O: O(n) -> n being the packages on the truck
+    def unload(self, package):
+        truck = self.scenario.truck(package.truck)
+        truck.packages.remove(package)
+        self.scenario.package_map.update_attr(package.id, "on_truck", False)
+        self.scenario.package_map.update_attr(package.id, "departure", None)
+        self.scenario.package_map.update_attr(package.id, "delivered", None)
+        return truck
+
+    # Corrects the address of a package at the given time, recording the correction with the scenario's address
+    # corrections in place of any correction of the package expected later, and routes its truck again so that it is
+    # delivered to the corrected address. Returns False if the corrected address is not in the address file
+    # Big-O: see reroute()
+    def correct_address(self, at, package_id, address, city, state, zip):
+        scenario = self.scenario
+        if package_id not in scenario.package_map:
+            print(f"Package with ID {package_id} not found.")
+            return None
+        package = scenario.package_map.retrieve(package_id)
+        if self.is_fixed(package, at):
+            print(f"Package #: {package_id} has already been delivered or is being delivered, its address can't be corrected.")
+            return None
+        if not self.mapped(package_id, address):
+            return False
+        # the correction known now replaces any correction of the package expected later in the day
+        scenario.address_corrections[:] = [c for c in scenario.address_corrections
+                                           if c.package_id != package_id or c.time <= at]
+        correction = AddressCorrection(at, package_id, address, city, state, zip)
+        insort(scenario.address_corrections, correction, key=lambda c: c.time)
+        correction.apply(scenario)
+        if not package.on_truck:
+            return None
+        return self.reroute(scenario.truck(package.truck), at)
+
+    # Changes the time a package arrives at the hub. A truck that has not left yet waits for the package if it would
+    # leave before it arrives, the same as in FleetSimulation. A package on a truck that has already left is taken off
+    # it and placed on a truck leaving after it arrives, if there is one
+    # Big-O: see reroute()
+    def change_pickup(self, at, package_id, pickup):
+        scenario = self.scenario
+        if package_id not in scenario.package_map:
+            print(f"Package with ID {package_id} not found.")
+            return None
+        package = scenario.package_map.retrieve(package_id)
+        if self.is_fixed(package, at):
+            print(f"Package #: {package_id} has already been delivered or is being delivered, its pickup can't change.")
+            return None
+        scenario.package_map.update_attr(package_id, "pickup", pickup)
+        package.set_window()
+        if not package.on_truck:
+            return self.place_package(package, at)
+        truck = scenario.truck(package.truck)
+        if at < truck.departure_time:
+            if truck.departure_time < pickup:
+                truck.departure_time = pickup
+            return self.reroute(truck, at)
+        self.reroute(self.unload(package), at)
+        return self.place_package(package, at)
+
+    # Adds a new package to the scenario at the given time, and loads it onto the truck chosen by choose_truck().
+    # Returns False if the package's address is not in the address file
+    # Big-O: see reroute()
+    def add_package(self, at, package):
+        scenario = self.scenario
+        if package.id in scenario.package_map:
+            print(f"Package with ID {package.id} already exists.")
+            return None
+        if not self.mapped(package.id, package.address):
+            return False
+        scenario.package_map.insert(package)
+        scenario.resolve_distance_ids([package])
+        return self.place_package(package, at)
+
+    # Cancels a package that has not been delivered at the given time, removing it from the scenario, and routes its
+    # truck again without it
+    # Big-O: see reroute()
+    def cancel_package(self, at, package_id):
+        scenario = self.scenario
+        if package_id not in scenario.package_map:
+            print(f"Package with ID {package_id} not found.")
+            return None
+        package = scenario.package_map.retrieve(package_id)
+        if self.is_fixed(package, at):
+            print(f"Package #: {package_id} has already been delivered or is being delivered, it can't be cancelled.")
+            return None
+        if scenario.unloaded_packages is not None:
+            scenario.unloaded_packages.pop(package.id, None)
+        # the package is unloaded while it is still in the package map, so its truck and times are cleared on it
+        truck = self.reroute(self.unload(package), at) if package.on_truck else None
+        scenario.package_map.delete(package_id)
+        return truck
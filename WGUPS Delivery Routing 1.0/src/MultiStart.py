@@ -0,0 +1,71 @@
+import contextlib
+import io
+import os
+import time as clock
+from concurrent.futures import ProcessPoolExecutor
+
+from PlanSearch import PlanSearch
+from RouteImprovement import EXACT_STOP_LIMIT, improve_routes
+from Scenario import Scenario
+from Simulation import FleetSimulation
+from TruckSort import load_trucks
+
+
+# Plans a day from scratch in a new scenario created from the given keyword arguments (see Scenario.arguments()), the
+# same way main.py does, with the plan search seeded by seed. Meant to run in a worker process, so the printing of the
+# loading and routing steps is discarded. The distance matrix is read from the scenario's compiled distance cache,
+# which every process maps read-only from the same file instead of parsing the distance table again.
+# Returns [miles, seed, plan], with miles being infinity if no plan meeting every deadline was found
+# Big-O: O(i*n) -> i being the iterations of the plan search, see PlanSearch.run()
+def plan_run(arguments, seed, iterations):
+    with contextlib.redirect_stdout(io.StringIO()):
+        scenario = Scenario(**arguments)
+        load_trucks(scenario)
+        FleetSimulation(scenario).run()
+        improve_routes(scenario, time_budget=0.5, exact_limit=EXACT_STOP_LIMIT)
+        search = PlanSearch(scenario, seed=seed)
+        search.run(time_limit=None, max_iterations=iterations)
+    return [search.best_cost, seed, search.plan()]
+
+
+# Runs the plan search from runs different seeds, spread across a pool of worker processes (one per core by default),
+# and returns [miles, seed, plan] of the shortest plan that meets every deadline, or None if no run found one. Runs are
+# independent, so they scale with the number of cores, and ties go to the lowest seed, so the plan returned does not
+# depend on the number of workers
+# Big-O: O(r*i*n / w) -> r being the runs and w the workers, see plan_run()
+def multi_start(scenario, runs=8, iterations=20000, workers=None, first_seed=0):
+    arguments = scenario.arguments()
+    # compiles the distance cache once, before any worker needs it
+    scenario.distance_map
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(plan_run, arguments, seed, iterations)
+                   for seed in range(first_seed, first_seed + runs)]
+        results = [future.result() for future in futures]
+    best = min(results, key=lambda result: (result[0], result[1]))
+    if best[0] == float("inf"):
+        return None
+    return best
+
+
+# Plans the scenario with multi_start() and stores the best plan found on its trucks, which must already be loaded and
+# routed the same way plan_run() does it. Returns the miles of the plan stored, or None if no plan was stored
+# Big-O: see multi_start()
+def apply_multi_start(scenario, runs=8, iterations=20000, workers=None):
+    best = multi_start(scenario, runs, iterations, workers)
+    if best is None:
+        return None
+    search = PlanSearch(scenario)
+    search.use_plan(best[2])
+    if not search.apply():
+        return None
+    return search.best_cost
+
+
+# Times multi_start() with 1 worker and then with one per core, to show how the runs scale across cores
+if __name__ == "__main__":
+    sample = Scenario()
+    for worker_count in sorted({1, os.cpu_count() or 1}):
+        start = clock.perf_counter()
+        miles, best_seed, _ = multi_start(sample, runs=8, workers=worker_count)
+        print(f"{worker_count} workers: best plan {round(miles, 2)} miles from seed {best_seed}, "
+              f"{clock.perf_counter() - start:.2f} seconds")
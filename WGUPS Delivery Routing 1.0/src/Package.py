@@ -1,9 +1,97 @@
-
 from datetime import time, datetime
+from functools import lru_cache
 import re
 
+# Patterns used while parsing the package file, compiled once instead of on every package
+DEADLINE_PATTERN = re.compile(r'^\d{1,2}:\d{2} [ap]m$')
+PICKUP_PATTERN = re.compile(r'\d{1,2}:\d{2}\s*[aApP][mM]')
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# Time windows of packages and trucks are kept as minutes since midnight, so that checking a window is a comparison
+# of numbers instead of branching on whether a deadline is a time or "EOD". A package without a deadline may be
+# delivered until the end of the day, and one without a pickup time is at the hub from the start of it
+DAY_START = 0
+DAY_END = 24 * 60
+
+
+# Returns the minutes since midnight of a time of day, as an int for whole minutes (every time in the package file)
+# and with the seconds as a fraction otherwise (times computed while routing)
+# Big-O: O(1)
+def minutes(time_of_day):
+    whole = time_of_day.hour * 60 + time_of_day.minute
+    if time_of_day.second or time_of_day.microsecond:
+        return whole + (time_of_day.second + time_of_day.microsecond / 1000000) / 60
+    return whole
+
+
+# Returns the time of day that a number of minutes since midnight falls on, the inverse of minutes(), rounded to the
+# second. Minutes past the end of the day give the last second of it
+# Big-O: O(1)
+def time_at(minutes_since_midnight):
+    total = round(minutes_since_midnight * 60)
+    if total >= DAY_END * 60:
+        return time(23, 59, 59)
+    return time(total // 3600, total // 60 % 60, total % 60)
+
+
+# Parses a deadline string from the package file into a time object, or returns the string as is when it is not a
+# time (e.g. "EOD"). A manifest only has a handful of distinct deadlines, so each string is parsed once and every
+# package with the same deadline shares the same time object
+# Big-O: O(1)
+@lru_cache(maxsize=None)
+def parse_deadline(deadline):
+    if DEADLINE_PATTERN.match(deadline.lower()):
+        return datetime.strptime(deadline, "%I:%M %p").time()
+    return deadline
+
+
+# Parses the special notes of a package into the truck it must be on, the ids of the packages it must be delivered
+# with, the time it is available for pickup, and the kind of problem found while parsing (None when there was none).
+# Notes repeat across a manifest, so each distinct note is parsed once. The package group is returned as a tuple,
+# since the cached result is shared by every package with the same note
+# Big-O: O(1) the complexity does not change much or at all with varying inputs &
+# the patterns are assumed to be parsing a relatively small string.
+@lru_cache(maxsize=None)
+def parse_special_notes(special_notes):
+    # ensures all comparisons perform properly by making notes all lowercase
+    notes = special_notes.lower()
+    # Packages intended to be on a specific truck are checked for here, and assigned
+    if "truck" in notes:
+        words = notes.split()
+        for i, word in enumerate(words):
+            if word == "truck":
+                try:
+                    return int(words[i + 1]), (), None, None
+                except (ValueError, IndexError):
+                    return None, (), None, "truck"
+        return None, (), None, "truck"
+
+    # Checks for package groups, packages that for whatever reason must be on the same truck
+    elif "delivered with" in notes:
+        return None, tuple(int(x) for x in NUMBER_PATTERN.findall(notes)), None, None
+    # Packages that are not present at the start of day, are assigned to truck 2, which will be set to leave
+    # whenever the last package needed is received
+    elif "delayed" in notes:
+        match = PICKUP_PATTERN.search(notes)
+        if match:
+            return 2, (), datetime.strptime(match.group(0), '%I:%M %p').time(), None
+        return 2, (), None, "delayed"
+    # Packages with the wrong address listed, will be assigned to truck 3, so that they do not slow down other
+    # deliveries before having their address corrected.
+    elif "wrong address" in notes:
+        return 3, (), None, None
+    # If a package has special notes, but it cannot be parsed by any of the above messages, relevant
+    # attributes are all set to None
+    else:
+        return None, None, None, "unknown"
+
 
 class Package:
+    # Packages are created once per row of the package file, so attributes are declared in __slots__ instead of a per
+    # object __dict__, which keeps the memory of each package small on large daily manifests
+    __slots__ = ("id", "address", "city", "state", "zip", "deadline", "kilos", "special_notes", "on_truck",
+                 "departure", "delivered", "distance_id", "truck", "package_group", "pickup",
+                 "earliest", "latest")
 
     # Initializes the Package Class object, assigning it variables based on the input from the Package File csv.
     # Also calls the special_notes_parser() to automatically parse and assign varaibles based on the 'special_notes'
@@ -15,16 +103,14 @@ class Package:
         self.city = city
         self.state = state
         self.zip = zip
-        if re.match(r'^\d{1,2}:\d{2} [ap]m$', deadline.lower()):
-            self.deadline = datetime.strptime(deadline, "%I:%M %p").time()
-        else:
-            self.deadline = deadline
+        self.deadline = parse_deadline(deadline)
         self.kilos = kilos
         self.special_notes = special_notes
         self.on_truck = False  # tracks if package has been assigned/loaded onto a truck yet.
 
         self.departure = None  # time when the truck the package is loaded onto leaves the facility to deliver packages
         self.delivered = None  # time when package is delivered and no longer on truck.
+        self.distance_id = None  # index of the package address in the distance table, cached once addresses are read
 
         # Parsing special_notes for key information
         if self.special_notes:
@@ -33,66 +119,66 @@ class Package:
             self.truck = None
             self.package_group = []
             self.pickup = None  # the time when the package is available for pickup, None means it is there at start of day.
+        self.set_window()
 
-    # Parses Package notes to determine package attributes for sorting onto trucks
-    # Big-O: O(1) the complexity does not change much or at all with varying inputs &
-    # re.findall is assumed to be parsing a relatively small string.
+    # Sets the time window of the package from its pickup time and deadline, earliest being the minute it is available
+    # at the hub and latest the minute it must be delivered by. Must be called again if either of them changes
+    # Big-O: O(1)
+    def set_window(self):
+        self.earliest = DAY_START if self.pickup is None else minutes(self.pickup)
+        self.latest = minutes(self.deadline) if type(self.deadline) is time else DAY_END
+
+    # Parses Package notes to determine package attributes for sorting onto trucks, using the cached
+    # parse_special_notes(), and prints a notification for any note that could not be fully parsed
+    # Big-O: O(1)
     def special_notes_parser(self):
-        # ensures all comparisons perform properly by making notes all lowercase
-        notes = self.special_notes.lower()
-        # Packages intended to be on a specific truck are checked for here, and assigned
-        if "truck" in notes:
-            words = notes.split()
-            for i, word in enumerate(words):
-                if word == "truck":
-                    try:
-                        self.truck = int(words[i + 1])
-                        self.package_group = []
-                        self.pickup = None
-                        return
-                    except (ValueError, IndexError):
-                        print(f"Cannot parse special notes from package {self.id}, checking for truck assignment.")
-                        self.truck = None
-                        self.package_group = []
-                        self.pickup = None
-                        return
-
-        # Checks for package groups, packages that for whatever reason must be on the same truck
-        elif "delivered with" in notes:
-            self.truck = None
-            self.package_group = [int(x) for x in re.findall(r'\d+', notes)]
-            self.pickup = None
-            return
-        # Packages that are not present at the start of day, are assigned to truck 2, which will be set to leave
-        # whenever the last package needed is received
-        elif "delayed" in notes:
-            self.truck = 2
-            self.package_group = []
-            match = re.search(r'\d{1,2}:\d{2}\s*[aApP][mM]', notes)
-            if match:
-                self.pickup = datetime.strptime(match.group(0), '%I:%M %p').time()
-            else:
-                self.pickup = None
-                print(f"Special notes mentioned delayed, but no time object could be parsed from {self}")
-            return
-        # Packages with the wrong address listed, will be assigned to truck 3, so that they do not slow down other
-        # deliveries before having their address corrected.
-        elif "wrong address" in notes:
-            self.truck = 3
-            self.package_group = []
-            self.pickup = None
-            return
-        # If a package has special notes, but it cannot be parsed by any of the above messages, a notification is
-        # printed to the console, and relevant attributes are all set to None
-        else:
+        self.truck, package_group, self.pickup, problem = parse_special_notes(self.special_notes)
+        self.package_group = None if package_group is None else list(package_group)
+        if problem == "truck":
+            print(f"Cannot parse special notes from package {self.id}, checking for truck assignment.")
+        elif problem == "delayed":
+            print(f"Special notes mentioned delayed, but no time object could be parsed from {self}")
+        elif problem == "unknown":
             print(
                 f"Special Notes exist on Package # {self.id} but do not contain usual keywords. Package may be mishandled as a result. \n "
                 f"This message shouldn't be seen with sample data provided with project.")
-            self.truck = None
-            self.package_group = None
-            self.pickup = None
 
     # to string method, for determining what string to return when package objects are called as a string.
     # Big-O: O(1)
     def __str__(self):
         return f"Package ID: {self.id}  ||Address: {self.city}, {self.state}, {self.address} ({self.zip})  ||En Route: {self.departure}  ||Deadline: {self.deadline}  ||Delivered: {self.delivered}  ||Truck: {self.truck}  ||Grouped with: {self.package_group}  ||On truck: {self.on_truck} ||Special Notes: {self.special_notes}"
+
+
+# AddressCorrection class, a change to the address of a package that only becomes known at a set time of day, such as
+# the wrong address listed for package #9 in the project scenario. Until it is applied, the package keeps its
+# "wrong address" special note, so that it is not selected for delivery
+class AddressCorrection:
+    __slots__ = ("time", "package_id", "address", "city", "state", "zip")
+
+    # Initializes the correction with the time it becomes known, and the corrected address of the package
+    # Big-O: O(1)
+    def __init__(self, time, package_id, address, city, state, zip):
+        self.time = time
+        self.package_id = package_id
+        self.address = address
+        self.city = city
+        self.state = state
+        self.zip = zip
+
+    # Updates the package in the scenario's package_map with the corrected address, and updates its special
+    # notes so that the next_delivery() algorithm no longer skips over it
+    # Big-O: O(1)
+    def apply(self, scenario):
+        package_map = scenario.package_map
+        package_map.update_attr(self.package_id, "address", self.address)
+        package_map.update_attr(self.package_id, "city", self.city)
+        package_map.update_attr(self.package_id, "state", self.state)
+        package_map.update_attr(self.package_id, "zip", self.zip)
+        # the cached distance_id must follow the corrected address
+        package_map.update_attr(self.package_id, "distance_id", scenario.address_id(self.address))
+        package_map.update_attr(self.package_id, "special_notes", "address corrected")
+
+    # What to return when a correction is printed
+    # Big-O: O(1)
+    def __str__(self):
+        return f"Package #: {self.package_id} address corrected at {self.time} to {self.address}, {self.city}, {self.state} ({self.zip})"
@@ -0,0 +1,424 @@
+import heapq
+import math
+import random
+import time as clock
+from datetime import datetime, timedelta, time
+
+from Package import minutes, parse_special_notes
+from RouteImprovement import seconds
+from Truck import Stop
+
+# Miles added to the cost of a plan for every minute a package is delivered past its deadline. Plans that are late are
+# never kept as the best plan, the penalty only lets the search pass through them on the way to a better one
+LATE_PENALTY = 1.0
+# Temperature of the simulated annealing at the start and end of a run, in miles. A move that makes the plan longer
+# by as much as the temperature is accepted about a third of the time
+START_TEMPERATURE = 2.0
+END_TEMPERATURE = 0.01
+
+
+# PlanSearch class, searches for a shorter plan for the whole fleet, moving packages between trucks and reordering the
+# deliveries of each truck together with simulated annealing, starting from the plan the trucks already have. Loading
+# and routing are searched together, so a package loaded onto the wrong truck can be moved instead of only routed
+# around. Packages that must be delivered together (package_group, followed transitively) always move as one unit,
+# packages whose notes pin them to a truck never leave it, trucks never carry more than their capacity, a truck leaves
+# once its driver is free and all its packages have arrived at the hub, and a package with a corrected address is not
+# driven to before its correction is known. Each move changes one or two routes, and only the trucks whose route or
+# departure time changed are timed again, so thousands of moves are measured each second.
+# The search is anytime: run() can be stopped by a time limit or a number of iterations, reports each new best plan to
+# a callback, and can be called again to continue from where it stopped. The same seed and number of iterations always
+# give the same plan
+class PlanSearch:
+    # Initializes the search from the packages currently on the trucks of the scenario, in the order of each truck's
+    # route if it has made one
+    # Big-O: O(n + a^2) -> n being the packages on the trucks and a the addresses they go to
+    def __init__(self, scenario, seed=0):
+        self.scenario = scenario
+        self.random = random.Random(seed)
+        self.trucks = list(scenario.truck_list)
+        preset = scenario.preset_departures
+        self.preset = [seconds(preset.get(t.truck)) if type(preset.get(t.truck)) is time else None for t in self.trucks]
+        self.capacity = [t.capacity for t in self.trucks]
+        self.seconds_per_mile = [3600 / t.avg_speed for t in self.trucks]
+        self.shift_start = [t.shift_start * 60 for t in self.trucks]
+        self.shift_end = [t.shift_end * 60 for t in self.trucks]
+
+        # packages are numbered in the order they are found on the trucks, and every list below is indexed by number
+        self.packages = []
+        routes = []
+        for t in self.trucks:
+            if t.route:
+                packages = [p for stop in t.route for p in stop.packages]
+                packages += [p for p in t.packages if p.delivered is None]
+            else:
+                packages = list(t.packages)
+            routes.append(list(range(len(self.packages), len(self.packages) + len(packages))))
+            self.packages += packages
+        number = {p.id: i for i, p in enumerate(self.packages)}
+        self.number = number
+
+        corrections = {}    # package id -> the last address correction of the package
+        for correction in scenario.address_corrections:
+            corrections[correction.package_id] = correction
+        distance_ids = [0]
+        self.address = []       # position in dist of the package's address, 0 being the hub
+        self.ready = []         # time the package's address is known
+        self.latest = []        # end of the package's time window
+        self.pickup = []        # start of the package's time window, when it arrives at the hub
+        self.pin = []           # position in self.trucks of the truck the package must be on, or None
+        positions = {t.truck: i for i, t in enumerate(self.trucks)}
+        for p in self.packages:
+            correction = corrections.get(p.id)
+            if correction is None:
+                distance_id = scenario.package_distance_id(p)
+                self.ready.append(0)
+            else:
+                distance_id = scenario.address_id(correction.address)
+                self.ready.append(seconds(correction.time))
+            if distance_id not in distance_ids:
+                distance_ids.append(distance_id)
+            self.address.append(distance_ids.index(distance_id))
+            self.latest.append(p.latest * 60)
+            self.pickup.append(p.earliest * 60)
+            pin = parse_special_notes(p.special_notes)[0] if p.special_notes else None
+            self.pin.append(positions.get(pin))
+        distance = scenario.distance_map.distance
+        self.dist = [[distance(a, b) for b in distance_ids] for a in distance_ids]
+        self.distance_ids = distance_ids
+        self.corrections = corrections
+
+        # units of packages that must be on the same truck, the transitive closure of the package groups
+        self.unit = list(range(len(self.packages)))
+        for i, p in enumerate(self.packages):
+            for pid in p.package_group or ():
+                if pid in number:
+                    self.join(i, number[pid])
+        members = {}
+        for i in range(len(self.packages)):
+            members.setdefault(self.find(i), []).append(i)
+        self.units = list(members.values())
+        self.unit = [0] * len(self.packages)
+        for u, unit in enumerate(self.units):
+            for i in unit:
+                self.unit[i] = u
+        # a unit is pinned to the truck any of its packages is pinned to
+        self.unit_pin = [next((self.pin[i] for i in unit if self.pin[i] is not None), None) for unit in self.units]
+
+        self.routes = routes
+        self.results = [None] * len(self.trucks)    # (departure, miles, return time, seconds late) of each truck
+        self.cost = self.evaluate()
+        self.best_cost = self.cost if self.late == 0 else math.inf
+        self.best_routes = [list(r) for r in routes]
+        self.iterations = 0
+
+    # Finds the representative of a package's unit while the units are being joined, shortening the path as it goes
+    # Big-O: O(log n) amortized
+    def find(self, i):
+        while self.unit[i] != i:
+            self.unit[i] = self.unit[self.unit[i]]
+            i = self.unit[i]
+        return i
+
+    # Joins the units of 2 packages
+    # Big-O: O(log n) amortized
+    def join(self, i, j):
+        i = self.find(i)
+        j = self.find(j)
+        if i != j:
+            self.unit[max(i, j)] = min(i, j)
+
+    # Times a route leaving the hub at the given departure, returning (miles, return time, seconds late), returning
+    # after the end of the driver's shift counting as late
+    # Big-O: O(n) -> n being the packages on the route
+    def time_route(self, t, route, departure):
+        dist = self.dist
+        address = self.address
+        ready = self.ready
+        latest = self.latest
+        seconds_per_mile = self.seconds_per_mile[t]
+        current = departure
+        previous = 0
+        miles = 0
+        late = 0
+        for i in route:
+            if ready[i] > current:
+                current = ready[i]
+            d = dist[previous][address[i]]
+            miles += d
+            current += d * seconds_per_mile
+            if current > latest[i]:
+                late += current - latest[i]
+            previous = address[i]
+        d = dist[previous][0]
+        current += d * seconds_per_mile
+        if current > self.shift_end[t]:
+            late += current - self.shift_end[t]
+        return miles + d, current, late
+
+    # Works out when each truck leaves, the same way FleetSimulation hands drivers out: trucks with a preset departure
+    # get the drivers first, and the rest leave in truck list order as drivers return. A truck also waits for its last
+    # package to arrive at the hub and for its driver's shift to start. Trucks whose route or departure changed are
+    # timed again, the rest keep their results. Returns the cost of the plan, its miles plus LATE_PENALTY for every
+    # minute late
+    # Big-O: O(t log t + c) -> t being the trucks, and c the packages on the trucks that are timed again
+    def evaluate(self):
+        routes = self.routes
+        results = self.results
+        active = [t for t in range(len(self.trucks)) if routes[t]]
+        start = min((self.preset[t] for t in active if self.preset[t] is not None), default=8 * 3600)
+        drivers = self.scenario.drivers
+        running = []        # heap of (return time, truck) of the trucks out on a route
+        waiting = []
+        first = sorted((t for t in active if self.preset[t] is not None), key=lambda t: self.preset[t])
+        leaving = []
+        for t in first:
+            if drivers > 0:
+                drivers -= 1
+                leaving.append([t, self.preset[t]])
+            else:
+                waiting.append(t)
+        waiting += [t for t in active if self.preset[t] is None]
+        while drivers > 0 and waiting:
+            drivers -= 1
+            leaving.append([waiting.pop(0), start])
+
+        miles = 0
+        late = 0
+        while leaving or waiting:
+            if not leaving:
+                returned = heapq.heappop(running)[0]
+                t = waiting.pop(0)
+                departure = returned if self.preset[t] is None or self.preset[t] < returned else self.preset[t]
+                leaving.append([t, departure])
+            t, departure = leaving.pop(0)
+            departure = max([departure, self.shift_start[t]] + [self.pickup[i] for i in routes[t]])
+            if results[t] is None or results[t][0] != departure:
+                results[t] = (departure,) + self.time_route(t, routes[t], departure)
+            miles += results[t][1]
+            late += results[t][3]
+            heapq.heappush(running, (results[t][2], t))
+        self.late = late
+        self.miles = miles
+        return miles + LATE_PENALTY * late / 60
+
+    # Returns the position in a route where inserting the package adds the fewest miles
+    # Big-O: O(n) -> n being the packages on the route
+    def cheapest_position(self, route, i):
+        dist = self.dist
+        address = self.address
+        a = address[i]
+        best = 0
+        best_added = math.inf
+        previous = 0
+        for position in range(len(route) + 1):
+            following = address[route[position]] if position < len(route) else 0
+            added = dist[previous][a] + dist[a][following] - dist[previous][following]
+            if added < best_added:
+                best_added = added
+                best = position
+            previous = following
+        return best
+
+    # Returns the trucks a unit may be moved to, those other than its current truck with room for it, unless pinned
+    # Big-O: O(t)
+    def destinations(self, u, current):
+        if self.unit_pin[u] is not None:
+            return []
+        size = len(self.units[u])
+        return [t for t in range(len(self.trucks))
+                if t != current and len(self.routes[t]) + size <= self.capacity[t]]
+
+    # Moves a random unit onto another truck, inserting each of its packages where it adds the fewest miles. Returns the
+    # trucks changed, or None if the chosen unit can't move
+    # Big-O: O(k*n) -> k being the packages in the unit
+    def relocate(self):
+        source = self.random_truck()
+        u = self.unit[self.random.choice(self.routes[source])]
+        targets = self.destinations(u, source)
+        if not targets:
+            return None
+        target = self.random.choice(targets)
+        self.routes[source] = [i for i in self.routes[source] if self.unit[i] != u]
+        route = list(self.routes[target])
+        for i in self.units[u]:
+            route.insert(self.cheapest_position(route, i), i)
+        self.routes[target] = route
+        return [source, target]
+
+    # Swaps 2 single package units between 2 trucks, inserting each where it adds the fewest miles. Returns the trucks
+    # changed, or None if the chosen packages can't be swapped
+    # Big-O: O(n)
+    def swap(self):
+        first = self.random_truck()
+        second = self.random_truck()
+        i = self.random.choice(self.routes[first])
+        j = self.random.choice(self.routes[second])
+        ui = self.unit[i]
+        uj = self.unit[j]
+        if first == second or len(self.units[ui]) != 1 or len(self.units[uj]) != 1 or \
+                self.unit_pin[ui] is not None or self.unit_pin[uj] is not None:
+            return None
+        route = [k for k in self.routes[first] if k != i]
+        route.insert(self.cheapest_position(route, j), j)
+        self.routes[first] = route
+        route = [k for k in self.routes[second] if k != j]
+        route.insert(self.cheapest_position(route, i), i)
+        self.routes[second] = route
+        return [first, second]
+
+    # Moves a random package of a truck to a random position in the same route. Returns the truck changed
+    # Big-O: O(n)
+    def shift(self):
+        t = self.random_truck()
+        route = list(self.routes[t])
+        i = route.pop(self.random.randrange(len(route)))
+        route.insert(self.random.randrange(len(route) + 1), i)
+        self.routes[t] = route
+        return [t]
+
+    # Reverses a random part of a truck's route (a 2-opt move). Returns the truck changed
+    # Big-O: O(n)
+    def reverse(self):
+        t = self.random_truck()
+        route = self.routes[t]
+        i = self.random.randrange(len(route))
+        j = self.random.randrange(len(route))
+        if i > j:
+            i, j = j, i
+        self.routes[t] = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+        return [t]
+
+    # Returns a random truck that has packages
+    # Big-O: O(t)
+    def random_truck(self):
+        return self.random.choice([t for t in range(len(self.trucks)) if self.routes[t]])
+
+    # Runs the simulated annealing until time_limit seconds have passed or max_iterations moves have been tried,
+    # whichever comes first, and returns the cost of the best plan found. callback(best_cost, search) is called every
+    # time a better plan is found. Without a time limit the run only depends on the seed and max_iterations, so it
+    # always finds the same plan
+    # Big-O: O(i*n) -> i being the iterations, and n the packages on the 1 or 2 trucks changed by each move
+    def run(self, time_limit=1.0, max_iterations=None, callback=None):
+        if time_limit is None and max_iterations is None:
+            print("PlanSearch.run() needs a time limit or a number of iterations, running for 1 second.")
+            time_limit = 1.0
+        if not any(self.routes):
+            return self.best_cost
+        started = clock.perf_counter()
+        moves = (self.relocate, self.swap, self.shift, self.reverse)
+        ratio = END_TEMPERATURE / START_TEMPERATURE
+        done = 0
+        while True:
+            # progress through the run, from 0 to 1, sets the temperature
+            progress = 0
+            if max_iterations is not None:
+                progress = done / max_iterations
+            if time_limit is not None:
+                progress = max(progress, (clock.perf_counter() - started) / time_limit)
+            if progress >= 1:
+                break
+            temperature = START_TEMPERATURE * ratio ** progress
+            done += 1
+            self.iterations += 1
+
+            routes = list(self.routes)
+            results = list(self.results)
+            changed = self.random.choice(moves)()
+            if changed is None:
+                continue
+            for t in changed:
+                self.results[t] = None
+            cost = self.evaluate()
+            delta = cost - self.cost
+            if delta <= 0 or self.random.random() < math.exp(-delta / temperature):
+                self.cost = cost
+                if self.late == 0 and cost < self.best_cost - 1e-9:
+                    self.best_cost = cost
+                    self.best_routes = [list(r) for r in self.routes]
+                    if callback is not None:
+                        callback(cost, self)
+            else:
+                self.routes = routes
+                self.results = results
+                self.evaluate()
+        return self.best_cost
+
+    # Returns the best plan found as a list holding, for each truck, the ids of its packages in delivery order
+    # Big-O: O(n) -> n being the packages
+    def plan(self):
+        return [[self.packages[i].id for i in route] for route in self.best_routes]
+
+    # Replaces the current plan with one returned by plan(), such as from a search on a copy of the scenario in another
+    # process, and keeps it as the best plan if it meets every deadline and is shorter. Returns True if it was kept
+    # Big-O: O(n) -> n being the packages
+    def use_plan(self, plan):
+        routes = [[self.number[pid] for pid in ids] for ids in plan]
+        if sorted(i for route in routes for i in route) != list(range(len(self.packages))):
+            print("The plan given does not hold every package on the trucks exactly once, it was not used.")
+            return False
+        self.routes = routes
+        self.results = [None] * len(self.trucks)
+        self.cost = self.evaluate()
+        if self.late == 0 and self.cost < self.best_cost:
+            self.best_cost = self.cost
+            self.best_routes = [list(r) for r in routes]
+            return True
+        return False
+
+    # Stores the best plan found on the scenario, loading each truck with its packages and timing its route with
+    # Truck.travel() the same way the trucks are routed, and updating each truck's route, departure and return times
+    # and mileage, and each package's truck, departure and delivery times. Returns False, leaving the scenario as it
+    # was, if no plan was found, or if the rounding of the times made the best plan late
+    # Big-O: O(n) -> n being the packages
+    def apply(self):
+        if self.best_cost == math.inf:
+            return False
+        self.routes = [list(r) for r in self.best_routes]
+        self.results = [None] * len(self.trucks)
+        self.evaluate()
+        plan = []
+        for t, truck in enumerate(self.trucks):
+            route = self.routes[t]
+            if not route:
+                plan.append([truck, None, [], [], None])
+                continue
+            departure = (datetime.min + timedelta(seconds=self.results[t][0])).time()
+            current = departure
+            previous = 0
+            stops = []
+            for i in route:
+                p = self.packages[i]
+                ready = (datetime.min + timedelta(seconds=self.ready[i])).time()
+                address = self.address[i]
+                if stops and address == previous and current >= ready:
+                    stops[-1].packages.append(p)
+                    continue
+                if ready > current:
+                    current = ready
+                current = truck.travel(current, self.dist[previous][address])
+                if minutes(current) > p.latest:
+                    return False
+                stops.append(Stop(self.distance_ids[address], [p], current))
+                previous = address
+            return_time = truck.travel(current, self.dist[previous][0])
+            plan.append([truck, departure, stops, [self.packages[i] for i in route], return_time])
+
+        package_map = self.scenario.package_map
+        for t, (truck, departure, stops, packages, return_time) in enumerate(plan):
+            # corrections not yet applied are known by the time their packages are delivered
+            for p in packages:
+                if p.id in self.corrections and p.distance_id != self.distance_ids[self.address[self.number[p.id]]]:
+                    self.corrections[p.id].apply(self.scenario)
+            truck.packages = packages
+            truck.route = stops
+            truck.return_time = return_time
+            truck.mileage = self.results[t][1] if packages else 0
+            if departure is not None:
+                truck.departure_time = departure
+            for stop in stops:
+                for p in stop.packages:
+                    package_map.update_attr(p.id, "truck", truck.truck)
+                    package_map.update_attr(p.id, "on_truck", True)
+                    package_map.update_attr(p.id, "departure", departure)
+                    package_map.update_attr(p.id, "delivered", stop.arrival)
+        return True
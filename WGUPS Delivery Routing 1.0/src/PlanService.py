@@ -0,0 +1,239 @@
+import argparse
+import contextlib
+import io
+import json
+import threading
+import time as clock
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from CommandLine import STATUS_NAMES, add_scenario_arguments, package_record, plan_day, scenario_from, \
+    time_argument, time_text, truck_record
+from Scenario import Scenario
+from StatusIndex import StatusIndex
+
+
+# PlanSnapshot class, a planned day frozen for answering queries. The record of every package and truck is encoded to
+# JSON once when the snapshot is taken, so looking one up is a dictionary lookup, and time queries are answered by a
+# StatusIndex. A snapshot is never changed after it is built, so any number of threads may read it at once, and it
+# holds no reference to the scenario, so it can be built in another process and sent back
+class PlanSnapshot:
+    # Takes a snapshot of a scenario that has been planned
+    # Big-O: O(n log n) -> n being the packages, from building the StatusIndex
+    def __init__(self, scenario, generation, planning_seconds):
+        self.generation = generation
+        self.planned_at = clock.time()
+        self.planning_seconds = planning_seconds
+        self.index = StatusIndex(scenario)
+        self.packages = {p.id: encode(package_record(p)) for p in self.index.packages}
+        self.trucks = {}
+        for t in scenario.truck_list:
+            record = truck_record(t)
+            record["stops"] = [{"distance_id": stop.distance_id, "arrival": time_text(stop.arrival),
+                                "packages": [p.id for p in stop.packages]} for stop in t.route]
+            self.trucks[t.truck] = encode(record)
+        self.miles = round(sum(t.mileage for t in scenario.truck_list), 2)
+        self.summary = encode({"generation": generation, "miles": self.miles,
+                               "trucks": [truck_record(t) for t in scenario.truck_list]})
+
+
+# Plans the day in a new scenario created from the given keyword arguments (see Scenario.arguments()) with plan_day(),
+# and returns a snapshot of it. The printing of the planning steps is discarded, the queries are answered in JSON
+# instead. Used both in the service's process and in its replanning worker process
+# Big-O: see plan_day()
+def plan_snapshot(scenario_arguments, improve, iterations, seed, generation):
+    start = clock.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scenario = Scenario(**scenario_arguments)
+        plan_day(scenario, improve, iterations, seed)
+    return PlanSnapshot(scenario, generation, clock.perf_counter() - start)
+
+
+# Returns a record encoded as a JSON response body
+# Big-O: O(n) -> n being the size of the record
+def encode(record):
+    return json.dumps(record).encode()
+
+
+# PlanService class, keeps the latest planned day in memory and plans the day again in the background on request.
+# Queries read whichever snapshot is current when they start, and a new plan replaces it with a single assignment once
+# it is complete, so reads never wait on planning and never see a half planned day. Replanning runs in a worker
+# process, so that it does not hold the interpreter lock the threads answering queries need
+class PlanService:
+    # Initializes the service with the keyword arguments of the scenario to plan (see Scenario.arguments()), and
+    # whether routes are improved, the plan search iterations and the seed used by plan_day(). By default the service
+    # serves the same greedy plan as main.py run without options, improve and iterations serve the plan of main.py
+    # --improve and --plan-search instead. The first plan is made before the service starts answering
+    # Big-O: see plan_day()
+    def __init__(self, scenario_arguments, improve=False, iterations=0, seed=0):
+        self.scenario_arguments = scenario_arguments
+        self.improve = improve
+        self.iterations = iterations
+        self.seed = seed
+        self.planner = None         # thread waiting on the worker process planning the day again, while one is running
+        self.executor = None        # pool of the worker process, started on the first replanning
+        self.last_error = None      # message of the last failed replanning, None if it succeeded
+        self.lock = threading.Lock()
+        self.snapshot = plan_snapshot(scenario_arguments, improve, iterations, seed, 1)
+
+    # Starts planning the day again in a background thread, the current snapshot keeps answering queries until the
+    # new one is ready. Returns False if a replanning is already running
+    # Big-O: O(1)
+    def replan(self):
+        with self.lock:
+            if self.planner is not None:
+                return False
+            self.planner = threading.Thread(target=self.run_replan, daemon=True)
+            self.planner.start()
+            return True
+
+    # Body of the background replanning thread, which waits on the worker process planning the day
+    # Big-O: see plan_day()
+    def run_replan(self):
+        try:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=1)
+            future = self.executor.submit(plan_snapshot, self.scenario_arguments, self.improve, self.iterations,
+                                          self.seed, self.snapshot.generation + 1)
+            self.snapshot = future.result()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+        finally:
+            with self.lock:
+                self.planner = None
+
+    # Returns the state of replanning as a record, along with how the day is planned
+    # Big-O: O(1)
+    def replan_status(self):
+        snapshot = self.snapshot
+        return {"running": self.planner is not None, "generation": snapshot.generation,
+                "planned_at": snapshot.planned_at, "planning_seconds": round(snapshot.planning_seconds, 3),
+                "last_error": self.last_error, "improve": self.improve, "plan_search": self.iterations}
+
+
+# PlanRequestHandler class, answers the HTTP requests of a PlanServer. Every response is JSON:
+#   GET  /summary                       every truck of the plan and the total miles
+#   GET  /packages/ID                   a package with its truck, departure and delivery times
+#   GET  /packages/ID/status?at=HH:MM   the status of a package at a time of day
+#   GET  /status?at=HH:MM               the status of every package at a time of day, with the count of each status
+#   GET  /trucks/ID                     a truck with the stops of its route
+#   GET  /replan                        whether a replanning is running, the generation of the current plan, and
+#                                       whether it was improved and plan searched
+#   POST /replan                        plans the day again in the background, 202 if started, 409 if already running
+class PlanRequestHandler(BaseHTTPRequestHandler):
+    # Writes a response with a JSON body
+    # Big-O: O(n) -> n being the size of the body
+    def respond(self, status, body):
+        if type(body) is not bytes:
+            body = encode(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Returns the time of day of the "at" query parameter, or None after answering with an error if it is missing or
+    # not a time
+    # Big-O: O(1)
+    def query_time(self, query):
+        try:
+            return time_argument(query["at"][0])
+        except (KeyError, argparse.ArgumentTypeError):
+            self.respond(400, {"error": "a time of day is required as ?at=HH:MM or ?at=HH:MM:SS"})
+            return None
+
+    # Answers GET requests from the current snapshot
+    # Big-O: O(1) for single packages and trucks, O(n) for the status of all packages
+    def do_GET(self):
+        service = self.server.service
+        snapshot = service.snapshot
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = parse_qs(url.query)
+
+        if parts == ["summary"]:
+            self.respond(200, snapshot.summary)
+        elif parts == ["replan"]:
+            self.respond(200, service.replan_status())
+        elif parts == ["status"]:
+            at = self.query_time(query)
+            if at is None:
+                return
+            index = snapshot.index
+            statuses = index.statuses(at)
+            at_hub, en_route, delivered = index.counts(at)
+            self.respond(200, {"generation": snapshot.generation, "time": time_text(at),
+                               "counts": {"at_hub": at_hub, "en_route": en_route, "delivered": delivered},
+                               "packages": [{"package": p.id, "truck": p.truck, "status": STATUS_NAMES[s]}
+                                            for p, s in zip(index.packages, statuses)]})
+        elif len(parts) in (2, 3) and parts[0] in ("packages", "trucks") and parts[1].isdigit():
+            record_id = int(parts[1])
+            if parts[0] == "trucks" and len(parts) == 2:
+                body = snapshot.trucks.get(record_id)
+            elif len(parts) == 2:
+                body = snapshot.packages.get(record_id)
+            elif parts[2] == "status":
+                at = self.query_time(query)
+                if at is None:
+                    return
+                status = snapshot.index.status(record_id, at)
+                body = None if status is None else {"package": record_id, "time": time_text(at),
+                                                    "status": STATUS_NAMES[status]}
+            else:
+                body = None
+            if body is None:
+                self.respond(404, {"error": f"no {parts[0][:-1]} with id {record_id}"})
+            else:
+                self.respond(200, body)
+        else:
+            self.respond(404, {"error": f"unknown path {url.path}"})
+
+    # Answers POST /replan by starting a replanning in the background
+    # Big-O: O(1)
+    def do_POST(self):
+        if urlsplit(self.path).path.strip("/") != "replan":
+            self.respond(404, {"error": f"unknown path {self.path}"})
+        elif self.server.service.replan():
+            self.respond(202, self.server.service.replan_status())
+        else:
+            self.respond(409, {"error": "a replanning is already running"})
+
+    # Requests are only logged when the server was started with verbose logging
+    # Big-O: O(1)
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+# PlanServer class, a threaded HTTP server answering each request on its own thread from the PlanService given
+class PlanServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # Initializes the server on the given address
+    # Big-O: O(1)
+    def __init__(self, address, service, verbose=False):
+        super().__init__(address, PlanRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves queries about the planned day over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8950)
+    add_scenario_arguments(parser)
+    parser.add_argument("--verbose", action="store_true", help="log every request to stderr")
+    arguments = parser.parse_args()
+    plan_service = PlanService(scenario_from(arguments).arguments(), arguments.improve, arguments.plan_search,
+                               arguments.seed)
+    server = PlanServer((arguments.host, arguments.port), plan_service, arguments.verbose)
+    print(f"Serving plan generation {plan_service.snapshot.generation} ({plan_service.snapshot.miles} miles) on "
+          f"http://{arguments.host}:{arguments.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        if plan_service.executor is not None:
+            plan_service.executor.shutdown(cancel_futures=True)
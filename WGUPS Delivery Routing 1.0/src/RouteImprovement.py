@@ -0,0 +1,322 @@
+import time as clock
+from datetime import datetime, timedelta
+
+from Package import minutes
+
+# Improvements smaller than this many miles are ignored, so rounding errors in the distances can't cause endless moves
+MIN_IMPROVEMENT = 1e-9
+# Routes with up to this many stops can be solved exactly by ExactRoute within a second or two, longer routes use
+# the local search of RouteImprovement, as the number of partial routes grows exponentially with the stops
+EXACT_STOP_LIMIT = 16
+
+
+# Returns the number of seconds since midnight of a time of day
+# Big-O: O(1)
+def seconds(time_of_day):
+    return time_of_day.hour * 3600 + time_of_day.minute * 60 + time_of_day.second + time_of_day.microsecond / 1e6
+
+
+# Returns the time a truck may leave for each stop on its route and the latest time it may arrive there, in seconds
+# since midnight. A stop for a package whose address was corrected can't be driven to before the correction was known,
+# and a stop must be reached by the end of the time windows of its packages
+# Big-O: O(n + c) -> n being the packages on the route and c the address corrections
+def stop_windows(scenario, truck):
+    corrected = {}      # package id -> time its address correction was known
+    for correction in scenario.address_corrections:
+        corrected[correction.package_id] = seconds(correction.time)
+    ready = []
+    latest = []
+    for stop in truck.route:
+        ready.append(max((corrected.get(p.id, 0) for p in stop.packages), default=0))
+        latest.append(min(p.latest for p in stop.packages) * 60)
+    return [ready, latest]
+
+
+# RouteImprovement class, a local search that shortens the route a truck drove, by applying 2-opt moves (reversing a
+# part of the route) and Or-opt moves (moving 1 to 3 consecutive stops elsewhere in the route) as long as they lower
+# the route's mileage. Each move is first measured by the change in distance of the few legs it touches, and only
+# moves that shorten the route have their timing checked, so that every deadline is still met, no stop is driven to
+# before its address is known, and the truck is back at the hub no later than before.
+class RouteImprovement:
+    # Initializes the search for a truck that has finished its route. Distances between the hub and the stops are
+    # copied into a small matrix, where position 0 is the hub and position k is the k-th stop of the route
+    # Big-O: O(n^2) -> n being the stops on the route
+    def __init__(self, scenario, truck):
+        self.scenario = scenario
+        self.truck = truck
+        distance_map = scenario.distance_map
+        ids = [0] + [stop.distance_id for stop in truck.route]
+        self.dist = [[distance_map.distance(a, b) for b in ids] for a in ids]
+        self.ready, self.latest = stop_windows(scenario, truck)
+        self.start = seconds(truck.departure_time)
+        self.finish = seconds(truck.return_time)
+        self.seconds_per_mile = 3600 / truck.avg_speed
+        self.order = list(range(1, len(ids)))   # positions in dist of the stops, in the order they are visited
+
+    # Returns the mileage of a route, including leaving and returning to the hub
+    # Big-O: O(n)
+    def length(self, order):
+        dist = self.dist
+        previous = 0
+        total = 0
+        for k in order:
+            total += dist[previous][k]
+            previous = k
+        return total + dist[previous][0]
+
+    # Checks if a route meets the deadline of every stop, leaves for each stop no earlier than its address is known,
+    # and returns to the hub no later than the truck's return time
+    # Big-O: O(n)
+    def feasible(self, order):
+        dist = self.dist
+        ready = self.ready
+        latest = self.latest
+        seconds_per_mile = self.seconds_per_mile
+        current = self.start
+        previous = 0
+        for k in order:
+            if ready[k - 1] > current:
+                current = ready[k - 1]
+            current += dist[previous][k] * seconds_per_mile
+            if current > latest[k - 1]:
+                return False
+            previous = k
+        return current + dist[previous][0] * seconds_per_mile <= self.finish + MIN_IMPROVEMENT
+
+    # Tries every 2-opt move once, reversing the stops between positions i and j of the route, and keeps every move
+    # that shortens the route and is feasible. Returns True if the route was changed
+    # Big-O: O(n^2) moves measured, plus O(n) for each shortening move checked
+    def two_opt(self, deadline):
+        dist = self.dist
+        order = self.order
+        n = len(order)
+        improved = False
+        for i in range(n - 1):
+            if clock.perf_counter() > deadline:
+                break
+            for j in range(i + 1, n):
+                a = order[i - 1] if i > 0 else 0
+                b = order[i]
+                c = order[j]
+                d = order[j + 1] if j + 1 < n else 0
+                delta = dist[a][c] + dist[b][d] - dist[a][b] - dist[c][d]
+                if delta < -MIN_IMPROVEMENT:
+                    candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                    if self.feasible(candidate):
+                        order = candidate
+                        improved = True
+        self.order = order
+        return improved
+
+    # Tries every Or-opt move once, moving a segment of 1 to 3 consecutive stops between 2 other stops, in either
+    # direction, and keeps every move that shortens the route and is feasible. Returns True if the route was changed
+    # Big-O: O(n^2) moves measured, plus O(n) for each shortening move checked
+    def or_opt(self, deadline):
+        dist = self.dist
+        order = self.order
+        improved = False
+        for segment_length in (1, 2, 3):
+            i = 0
+            while i + segment_length <= len(order):
+                if clock.perf_counter() > deadline:
+                    self.order = order
+                    return improved
+                first = order[i]
+                last = order[i + segment_length - 1]
+                before = order[i - 1] if i > 0 else 0
+                after = order[i + segment_length] if i + segment_length < len(order) else 0
+                removed = dist[before][first] + dist[last][after] - dist[before][after]
+                rest = order[:i] + order[i + segment_length:]
+                segment = order[i:i + segment_length]
+                moved = False
+                for j in range(len(rest) + 1):
+                    if j == i:
+                        continue
+                    u = rest[j - 1] if j > 0 else 0
+                    v = rest[j] if j < len(rest) else 0
+                    for placed in (segment, segment[::-1]):
+                        added = dist[u][placed[0]] + dist[placed[-1]][v] - dist[u][v]
+                        if added - removed < -MIN_IMPROVEMENT:
+                            candidate = rest[:j] + placed + rest[j:]
+                            if self.feasible(candidate):
+                                order = candidate
+                                improved = moved = True
+                                break
+                    if moved:
+                        break
+                if not moved:
+                    i += 1
+        self.order = order
+        return improved
+
+    # Applies 2-opt and Or-opt moves until neither shortens the route any further or the deadline (a
+    # time.perf_counter() value) has passed
+    # Big-O: O(p*n^3) -> p being the passes made, each pass is O(n^2) moves with O(n) feasibility checks
+    def search(self, deadline):
+        while clock.perf_counter() < deadline:
+            changed = self.two_opt(deadline)
+            changed = self.or_opt(deadline) or changed
+            if not changed:
+                break
+
+    # Searches for a shorter route for up to time_budget seconds, then updates the truck's route, the delivery time of
+    # its packages, its mileage and its return time. Returns the miles saved
+    # Big-O: O(p*n^3) -> see search()
+    def improve(self, time_budget=0.5):
+        original = self.order
+        self.search(clock.perf_counter() + time_budget)
+        return self.commit(original)
+
+    # Stores the route found on the truck if it differs from the original order and is still feasible once timed with
+    # Truck.travel(), and returns the miles saved, or 0 if the truck was left as it was
+    # Big-O: O(n) -> n being the packages on the truck
+    def commit(self, original):
+        mileage = self.truck.mileage
+        if self.order == original or not self.apply():
+            self.order = original
+            return 0
+        return mileage - self.truck.mileage
+
+    # Times the improved route the same way the trucks are routed, with Truck.travel(), and if it is still feasible,
+    # stores it on the truck and its packages. Returns False, leaving the truck as it was, if rounding of the times
+    # made the route miss a deadline or return late
+    # Big-O: O(n) -> n being the packages on the truck
+    def apply(self):
+        truck = self.truck
+        dist = self.dist
+        ready = [(datetime.min + timedelta(seconds=s)).time() for s in self.ready]
+        current = truck.departure_time
+        previous = 0
+        arrivals = []
+        for k in self.order:
+            if ready[k - 1] > current:
+                current = ready[k - 1]
+            current = truck.travel(current, dist[previous][k])
+            for p in truck.route[k - 1].packages:
+                if minutes(current) > p.latest:
+                    return False
+            arrivals.append(current)
+            previous = k
+        return_time = truck.travel(current, dist[previous][0])
+        if return_time > truck.return_time:
+            return False
+
+        route = [truck.route[k - 1] for k in self.order]
+        package_map = self.scenario.package_map
+        for stop, arrival in zip(route, arrivals):
+            stop.arrival = arrival
+            for p in stop.packages:
+                package_map.update_attr(p.id, "delivered", arrival)
+        truck.route = route
+        truck.mileage = self.length(self.order)
+        truck.return_time = return_time
+        return True
+
+
+# ExactRoute class, finds the shortest route through a truck's stops that meets the same constraints as
+# RouteImprovement, using dynamic programming over the set of stops visited (Held-Karp). Each partial route is
+# labeled with its mileage and the time it reaches its last stop, and for each set of stops and last stop only the
+# labels that are not both longer and later than another are kept, as deadlines and address corrections make a
+# shorter partial route not always the better one. The route found by the local search is used as an upper bound,
+# and partial routes that can't beat it are pruned. Routes with more than exact_limit stops fall back to the local
+# search alone
+class ExactRoute(RouteImprovement):
+    # Initializes the solver the same way as RouteImprovement, along with the shortest distance into each position of
+    # the distance matrix, used for the lower bound of the miles left to drive
+    # Big-O: O(n^2) -> n being the stops on the route
+    def __init__(self, scenario, truck, exact_limit=EXACT_STOP_LIMIT):
+        super().__init__(scenario, truck)
+        self.exact_limit = exact_limit
+        self.min_in = [min(self.dist[a][b] for a in range(len(self.dist)) if a != b) if len(self.dist) > 1 else 0
+                       for b in range(len(self.dist))]
+
+    # Returns the shortest feasible order of the stops, or None if there is none shorter than the bound given. A
+    # partial route is pruned once its mileage plus the shortest leg into each stop left and into the hub reaches the
+    # bound, which holds even where the distance table doesn't obey the triangle inequality
+    # Big-O: O(2^n * n^2 * l) -> n being the stops and l the labels kept per set of stops and last stop
+    def solve(self, bound):
+        dist = self.dist
+        ready = self.ready
+        latest = self.latest
+        min_in = self.min_in
+        seconds_per_mile = self.seconds_per_mile
+        n = len(self.order)
+        full = (1 << n) - 1
+        # labels are (mileage, time, lower bound of miles left, position, previous label), keyed by (visited, position)
+        layer = {(0, 0): [(0, self.start, sum(min_in), 0, None)]}
+        for _ in range(n):
+            next_layer = {}
+            for (visited, last), labels in layer.items():
+                for label in labels:
+                    mileage, current, left, _, _ = label
+                    for k in range(1, n + 1):
+                        bit = 1 << (k - 1)
+                        if visited & bit:
+                            continue
+                        leave = ready[k - 1] if ready[k - 1] > current else current
+                        arrival = leave + dist[last][k] * seconds_per_mile
+                        if arrival > latest[k - 1]:
+                            continue
+                        new_mileage = mileage + dist[last][k]
+                        new_left = left - min_in[k]
+                        if new_mileage + new_left >= bound - MIN_IMPROVEMENT:
+                            continue
+                        key = (visited | bit, k)
+                        kept = next_layer.get(key)
+                        if kept is None:
+                            next_layer[key] = [(new_mileage, arrival, new_left, k, label)]
+                            continue
+                        # the new label is dropped if another is no longer and no later, and replaces any it beats
+                        if any(m <= new_mileage and t <= arrival for m, t, _, _, _ in kept):
+                            continue
+                        kept[:] = [kl for kl in kept if not (new_mileage <= kl[0] and arrival <= kl[1])]
+                        kept.append((new_mileage, arrival, new_left, k, label))
+            layer = next_layer
+
+        best = None
+        best_mileage = bound
+        for (visited, last), labels in layer.items():
+            if visited != full:
+                continue
+            for label in labels:
+                mileage = label[0] + dist[last][0]
+                if mileage < best_mileage - MIN_IMPROVEMENT and \
+                        label[1] + dist[last][0] * seconds_per_mile <= self.finish + MIN_IMPROVEMENT:
+                    best_mileage = mileage
+                    best = label
+        if best is None:
+            return None
+        order = []
+        while best[4] is not None:
+            order.append(best[3])
+            best = best[4]
+        return order[::-1]
+
+    # Runs the local search for up to time_budget seconds to find a good route quickly, then, if the route has no more
+    # than exact_limit stops, replaces it with the shortest route, and updates the truck. Returns the miles saved
+    # Big-O: O(2^n * n^2 * l) -> see solve()
+    def improve(self, time_budget=0.5):
+        original = self.order
+        self.search(clock.perf_counter() + time_budget)
+        if len(self.order) <= self.exact_limit:
+            order = self.solve(self.length(self.order))
+            if order is not None:
+                self.order = order
+        return self.commit(original)
+
+
+# Runs the route improvement on every truck of the scenario that made a route, giving each truck time_budget seconds
+# of local search, and prints the miles saved on each truck. Routes with up to exact_limit stops are then solved
+# exactly by ExactRoute, by default no route is. Returns a dictionary of truck id -> miles saved
+# Big-O: O(t*p*n^3) -> t being the trucks, see RouteImprovement.improve(), or ExactRoute.improve() for exact routes
+def improve_routes(scenario, time_budget=0.5, exact_limit=0):
+    saved = {}
+    for truck in scenario.truck_list:
+        if not truck.route or truck.return_time is None:
+            continue
+        if len(truck.route) <= exact_limit:
+            saved[truck.truck] = ExactRoute(scenario, truck, exact_limit).improve(time_budget)
+        else:
+            saved[truck.truck] = RouteImprovement(scenario, truck).improve(time_budget)
+        print(f"Route of truck {truck.truck} improved by {round(saved[truck.truck], 2)} miles. Mileage is now {round(truck.mileage, 2)}, returning at {truck.return_time}")
+    return saved
@@ -0,0 +1,202 @@
+import os
+from datetime import time
+
+from Distances import build_address_index, load_distance_matrix, load_shortest_paths, normalize_address, \
+    read_addresses_csv
+from HashMap import HashMap, package_csv_hashmap, packages_from_rows
+from Package import AddressCorrection, Package
+from Truck import create_fleet
+
+# Directory holding the sample data files, default file names are resolved against it so that loading a scenario
+# does not depend on the directory the program is started from
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_FILE = "WGUPS Package File.csv"
+ADDRESS_FILE = "WGUPS Delivery Addresses.csv"
+DISTANCE_FILE = "WGUPS Distance Table.csv"
+
+# The wrong delivery address for package #9 in the sample package file is corrected at 10:20 a.m.
+SAMPLE_ADDRESS_CORRECTIONS = (
+    AddressCorrection(time(10, 20), 9, "410 S State St", "Salt Lake City", "UT", "84111"),
+)
+
+
+# Scenario class, the data context for planning one day of deliveries from one depot. It holds the file paths of the
+# package, address and distance files, and only reads each of them the first time it is needed. Every loading and
+# routing function is passed a scenario instead of reading module globals, so several scenarios can be loaded and
+# planned side by side in one process (each scenario should be planned by a single thread at a time).
+class Scenario:
+    # Initializes the scenario with the paths of its data files, and an optional fleet function returning a new
+    # list of trucks. Relative paths are resolved against data_dir, which defaults to the directory of this file.
+    # A package_file of None starts with no packages, for manifests that are streamed in with ingest_rows().
+    # drivers is the number of drivers available to drive the fleet, and address_corrections the list of
+    # AddressCorrections known for the day, defaulting to the correction of package #9 for the sample package file,
+    # however its path is given.
+    # With shortest_paths, trucks are routed on the shortest path distances between addresses (see
+    # Distances.floyd_warshall()) instead of the distances in the table as is
+    # Big-O: O(1)
+    def __init__(self, package_file=PACKAGE_FILE, address_file=ADDRESS_FILE, distance_file=DISTANCE_FILE,
+                 distance_cache=None, data_dir=DATA_DIR, fleet=create_fleet, drivers=2, address_corrections=None,
+                 shortest_paths=False):
+        self.package_file = None if package_file is None else os.path.join(data_dir, package_file)
+        self.address_file = os.path.join(data_dir, address_file)
+        self.distance_file = os.path.join(data_dir, distance_file)
+        self.distance_cache = None if distance_cache is None else os.path.join(data_dir, distance_cache)
+        self.fleet = fleet
+        self.drivers = drivers
+        self.shortest_paths = shortest_paths
+        if address_corrections is None:
+            sample = self.package_file is not None and \
+                os.path.abspath(self.package_file) == os.path.join(DATA_DIR, PACKAGE_FILE)
+            address_corrections = SAMPLE_ADDRESS_CORRECTIONS if sample else ()
+        self.address_corrections = sorted(address_corrections, key=lambda c: c.time)
+        self.unloaded_packages = None   # package id -> package not yet on a truck, see TruckSort.list_unloaded()
+        self.preset_departures = {}     # truck id -> departure time the fleet function gave it, see truck_list
+        self._package_map = None
+        self._address_list = None
+        self._address_index = None
+        self._distance_map = None
+        self._truck_list = None
+
+    # Returns the keyword arguments that create a new scenario with the same data files, fleet, drivers and address
+    # corrections as this one, such as in another process. The new scenario starts with nothing loaded
+    # Big-O: O(1)
+    def arguments(self):
+        return {"package_file": self.package_file, "address_file": self.address_file,
+                "distance_file": self.distance_file, "distance_cache": self.distance_cache, "fleet": self.fleet,
+                "drivers": self.drivers, "address_corrections": list(self.address_corrections),
+                "shortest_paths": self.shortest_paths}
+
+    # Hash map of all packages, read from the package file on first use. Every package gets its distance_id
+    # resolved as it is loaded
+    # Big-O: O(n) on first use, O(1) afterwards
+    @property
+    def package_map(self):
+        if self._package_map is None:
+            if self.package_file is None:
+                self._package_map = HashMap()
+            else:
+                self._package_map = package_csv_hashmap(self.package_file, self.address_index)
+        return self._package_map
+
+    # Creates packages from a batch of package file rows, adds them to the package_map and returns them
+    # Big-O: O(n) -> n being the number of rows
+    def ingest_rows(self, rows):
+        packages = packages_from_rows(rows, self.address_index)
+        self.package_map.insert_many(packages)
+        return packages
+
+    # List of all address mappings, read from the address file on first use
+    # Big-O: O(n) on first use, O(1) afterwards
+    @property
+    def address_list(self):
+        if self._address_list is None:
+            self._address_list = read_addresses_csv(self.address_file)
+        return self._address_list
+
+    # Lookup table of normalized address -> distance_id, built from address_list on first use
+    # Big-O: O(n) on first use, O(1) afterwards
+    @property
+    def address_index(self):
+        if self._address_index is None:
+            self._address_index = build_address_index(self.address_list)
+        return self._address_index
+
+    # The DistanceMatrix of the scenario, loaded from the distance file (or its compiled cache) on first use. With
+    # shortest_paths it is the ShortestPathMatrix of the distance file (or its compiled shortest path cache) instead
+    # Big-O: O(1) with a valid cache, O(n^2) when the distance file has to be parsed, O(n^3) for its shortest paths
+    @property
+    def distance_map(self):
+        if self._distance_map is None and self.shortest_paths:
+            self._distance_map = load_shortest_paths(self.distance_file, distance_cache=self.distance_cache)
+        elif self._distance_map is None:
+            self._distance_map = load_distance_matrix(self.distance_file, self.distance_cache)
+        return self._distance_map
+
+    # List of trucks of the scenario, created by the fleet function on first use. The departure time each truck was
+    # created with is recorded in preset_departures, as routing the trucks replaces it
+    # Big-O: O(n) on first use, O(1) afterwards
+    @property
+    def truck_list(self):
+        if self._truck_list is None:
+            self._truck_list = self.fleet()
+            self.preset_departures = {t.truck: t.departure_time for t in self._truck_list}
+        return self._truck_list
+
+    # Returns the truck with the given truck id, or None if there is no such truck
+    # Big-O: O(n) -> n being the number of trucks
+    def truck(self, truck_id):
+        for t in self.truck_list:
+            if t.truck == truck_id:
+                return t
+        return None
+
+    # Returns the distance_id mapped to an address string, or None if the address is not in the address file
+    # Big-O: O(1)
+    def address_id(self, address):
+        return self.address_index.get(normalize_address(address))
+
+    # Resolves and caches the distance_id of every package given, so that distance lookups on packages are pure
+    # integer lookups into the distance table. Packages whose address cannot be mapped are left with a distance_id of None
+    # Big-O: O(n)
+    def resolve_distance_ids(self, packages):
+        for p in packages:
+            p.distance_id = self.address_id(p.address)
+            if p.distance_id is None:
+                print(f"Package #: {p.id} does not return an address matching any address in the database, distance cannot be mapped")
+
+    # Returns the cached distance_id of a package, resolving it from the package's address if it has not been cached yet
+    # Big-O: O(1)
+    def package_distance_id(self, package):
+        if package.distance_id is None:
+            package.distance_id = self.address_id(package.address)
+        return package.distance_id
+
+    # Basic function call to return the distance between the 2 distance_ids specified
+    # Big-O: O(1)
+    def int_distance(self, a1: int, a2: int):
+        return self.distance_map.distance(a1, a2)
+
+    # This serves the same purpose as int_distance, but is instead fed 2 string arguments, which it then converts into
+    # distance_ids using the address_index before passing them along to the int_distance function
+    # Big-O: O(1)
+    def address_distance(self, a1: str, a2: str):
+        d1 = self.address_id(a1)
+        d2 = self.address_id(a2)
+        if d1 is None or d2 is None:
+            print("No distance mapping found for one or both of provided addresses.")
+            print(f"address 1 is {a1} id: {d1} \naddress 2 is {a2} id: {d2}")
+            return
+        return self.int_distance(d1, d2)
+
+    # This function again serves the same purpose as int_distance() and address_distance(), but is passed 2
+    # package objects instead, and uses their cached distance_ids to look up the distance directly
+    # Big-O: O(1)
+    def package_distance(self, p1: Package, p2: Package):
+        d1 = self.package_distance_id(p1)
+        d2 = self.package_distance_id(p2)
+        if d1 is None or d2 is None:
+            print("No distance mapping found for one or both of provided packages.")
+            print(f"package 1 is {p1.id} id: {d1} \npackage 2 is {p2.id} id: {d2}")
+            return
+        return self.int_distance(d1, d2)
+
+    # This function also returns a distance like the others, but has a specific use case for when the distance
+    # to the hub is needed, and can be passed an int distance_id, an address string or a package obj
+    # Big-O: O(1)
+    def hub_distance(self, package):
+        if type(package) == int:
+            return self.int_distance(0, package)
+        elif type(package) == str:
+            d = self.address_id(package)
+            if d is not None:
+                return self.int_distance(0, d)
+        elif type(package) == Package:
+            d = self.package_distance_id(package)
+            if d is not None:
+                return self.int_distance(0, d)
+            print(
+                f"Package #: {package.id} does not return an address matching any address in the database, distance cannot be mapped")
+            return
+        else:
+            print(f"{package} is an invalid  argument, cannot return distance from hub")
+            return
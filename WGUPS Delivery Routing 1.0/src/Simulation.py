@@ -0,0 +1,174 @@
+import heapq
+from datetime import time
+
+from DeliveryRouting import DeliveryCandidates, deliver_package, next_delivery, report_route
+from Package import minutes, time_at
+from Truck import Stop
+
+# Kinds of events in the simulation. When several events happen at the same time they are handled in this order, so
+# that a correction or a package arriving at the hub is known before any truck decides where to go next, and a driver
+# returning with one truck can leave with another at the same minute.
+ADDRESS_CORRECTION = 0      # an address correction becomes known
+PACKAGE_AVAILABLE = 1       # a delayed package arrives at the hub
+ARRIVAL = 2                 # a truck arrives at the address of the package it is delivering
+RETURN = 3                  # a truck returns to the hub and its driver becomes free
+DEPARTURE = 4               # a truck with a driver is due to leave the hub
+
+
+# FleetSimulation class, a discrete-event simulation that routes every truck of a scenario together in time order.
+# Timed events (departures, arrivals, returns, packages arriving at the hub and address corrections) are kept in a
+# priority queue, so any number of trucks advance through the day side by side, and constraints that depend on the
+# time of day are handled by events instead of special cases inside the routing loop. Each truck still picks its next
+# delivery with next_delivery(), so each truck's route matches routing it on its own with route_delivery().
+class FleetSimulation:
+    # Initializes the simulation for a scenario whose trucks have already been loaded
+    # Big-O: O(1)
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.events = []            # priority queue of (time, kind, sequence, truck, item) tuples
+        self.sequence = 0           # insertion counter, keeps events of the same time and kind in order
+        self.free_drivers = scenario.drivers
+        self.waiting_for_driver = []        # trucks with packages, waiting for a driver, in truck list order
+        self.location = {}          # truck id -> package last delivered, or "HUB"
+        self.candidates = {}        # truck id -> DeliveryCandidates of a truck that has left the hub
+        self.distance = {}          # truck id -> distance traveled so far
+        self.unavailable = {}       # truck id -> number of its packages not yet at the hub
+        self.ready = set()          # ids of trucks with a driver, due to leave once all their packages are at the hub
+        self.stalled = []           # trucks whose only undelivered packages are waiting on an address correction
+        self.stalled_since = {}     # truck id -> time a stalled truck started waiting
+
+    # Adds an event to the priority queue
+    # Big-O: O(log n)
+    def schedule(self, event_time, kind, truck=None, item=None):
+        heapq.heappush(self.events, (event_time, kind, self.sequence, truck, item))
+        self.sequence += 1
+
+    # Runs the simulation until every truck has returned to the hub, and returns the total distance traveled by all
+    # trucks. Each truck's mileage, departure and return times, and each package's departure and delivery times are
+    # updated along the way
+    # Big-O: O(n*a) -> from next_delivery() being called once for every delivery, a being the addresses on a truck
+    def run(self):
+        scenario = self.scenario
+        package_map = scenario.package_map
+        trucks = [t for t in scenario.truck_list if t.packages]
+        start = min((t.departure_time for t in trucks if type(t.departure_time) is time), default=time(8, 00))
+
+        for correction in scenario.address_corrections:
+            self.schedule(correction.time, ADDRESS_CORRECTION, item=correction)
+        for t in trucks:
+            self.distance[t.truck] = 0
+            self.unavailable[t.truck] = 0
+            for p in t.packages:
+                if p.earliest > minutes(start):
+                    self.unavailable[t.truck] += 1
+                    self.schedule(time_at(p.earliest), PACKAGE_AVAILABLE, item=p)
+
+        # trucks with a preset departure time get drivers first, in order of departure, the rest wait for a driver
+        preset = sorted((t for t in trucks if type(t.departure_time) is time), key=lambda t: t.departure_time)
+        for t in preset:
+            if self.free_drivers > 0:
+                self.free_drivers -= 1
+                self.schedule(t.departure_time, DEPARTURE, t)
+            else:
+                self.waiting_for_driver.append(t)
+        self.waiting_for_driver += [t for t in trucks if type(t.departure_time) is not time]
+        while self.free_drivers > 0 and self.waiting_for_driver:
+            self.free_drivers -= 1
+            t = self.waiting_for_driver.pop(0)
+            self.schedule(max(start, time_at(t.shift_start)), DEPARTURE, t)
+
+        while self.events or self.stalled:
+            # trucks still waiting on a correction once nothing else can happen return with those packages undelivered
+            if not self.events:
+                for t in self.stalled:
+                    self.return_to_hub(t, self.stalled_since[t.truck])
+                self.stalled = []
+                continue
+            event_time, kind, _, truck, item = heapq.heappop(self.events)
+
+            if kind == ADDRESS_CORRECTION:
+                if item.package_id in package_map:
+                    package = package_map.retrieve(item.package_id)
+                    if package.delivered is None:
+                        item.apply(scenario)
+                        # a truck already out with the package can now deliver it
+                        if package.truck in self.candidates:
+                            self.candidates[package.truck].release(package)
+                # trucks that were only waiting on a correction carry on from where they are
+                stalled = self.stalled
+                self.stalled = []
+                for t in stalled:
+                    self.next_stop(t, event_time)
+
+            elif kind == PACKAGE_AVAILABLE:
+                truck_id = item.truck
+                self.unavailable[truck_id] -= 1
+                if truck_id in self.ready and self.unavailable[truck_id] == 0:
+                    self.depart(scenario.truck(truck_id), event_time)
+
+            elif kind == DEPARTURE:
+                self.ready.add(truck.truck)
+                if self.unavailable[truck.truck] == 0:
+                    self.depart(truck, event_time)
+
+            elif kind == ARRIVAL:
+                # every package going to the address is delivered at this stop
+                stop_packages = self.candidates[truck.truck].remove_address(item.distance_id)
+                for p in stop_packages:
+                    deliver_package(scenario, p, event_time)
+                truck.route.append(Stop(item.distance_id, stop_packages, event_time))
+                self.location[truck.truck] = item
+                self.next_stop(truck, event_time)
+
+            elif kind == RETURN:
+                truck.mileage = self.distance[truck.truck]
+                report_route(truck, truck.mileage, event_time)
+                if minutes(event_time) > truck.shift_end:
+                    print(f"Truck {truck.truck} returned at {event_time}, after the end of its driver's shift.")
+                # the driver hands over to the next truck waiting for one, which leaves as soon as it can
+                if self.waiting_for_driver:
+                    t = self.waiting_for_driver.pop(0)
+                    if type(t.departure_time) is not time or t.departure_time < event_time:
+                        t.departure_time = max(event_time, time_at(t.shift_start))
+                    self.schedule(t.departure_time, DEPARTURE, t)
+                else:
+                    self.free_drivers += 1
+
+        return sum(t.mileage for t in scenario.truck_list)
+
+    # Sends a truck out from the hub at the given time, updating the departure time of the truck and its packages
+    # Big-O: O(n) -> n being the packages on the truck
+    def depart(self, truck, departure):
+        self.ready.discard(truck.truck)
+        truck.departure_time = departure
+        for p in truck.packages:
+            self.scenario.package_map.update_attr(p.id, "departure", departure)
+        self.location[truck.truck] = "HUB"
+        self.candidates[truck.truck] = DeliveryCandidates(self.scenario, truck)
+        truck.route = []
+        self.next_stop(truck, departure)
+
+    # Chooses the next delivery of a truck at the given time and schedules its arrival there. When nothing is left to
+    # deliver the truck's return to the hub is scheduled instead, and when only packages waiting on an address correction
+    # are left the truck waits where it is until the next correction
+    # Big-O: O(a) -> from next_delivery(), a being the addresses left to deliver to
+    def next_stop(self, truck, current_time):
+        candidates = self.candidates[truck.truck]
+        returned = next_delivery(self.scenario, truck, self.location[truck.truck], candidates)
+        package, distance = returned[0], returned[1]
+        if package is None:
+            if candidates:
+                self.stalled.append(truck)
+                self.stalled_since[truck.truck] = current_time
+                return
+            self.return_to_hub(truck, current_time)
+            return
+        self.distance[truck.truck] += distance
+        self.schedule(truck.travel(current_time, distance), ARRIVAL, truck, package)
+
+    # Schedules a truck's return to the hub from its current location, leaving at the given time
+    # Big-O: O(1)
+    def return_to_hub(self, truck, current_time):
+        distance = self.scenario.hub_distance(self.location[truck.truck])
+        self.distance[truck.truck] += distance
+        self.schedule(truck.travel(current_time, distance), RETURN, truck)
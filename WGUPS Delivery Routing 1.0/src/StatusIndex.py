@@ -0,0 +1,86 @@
+from array import array
+from bisect import bisect_right
+from math import inf
+
+from Package import minutes
+
+# Status of a package at a time of day. A package is at the hub until its truck leaves, en route until it is delivered,
+# and delivered from then on. Packages that never left the hub, or were never delivered, keep their last status
+AT_HUB = 0
+EN_ROUTE = 1
+DELIVERED = 2
+
+
+# Returns the message printed by the lookup menus for the status of a package at a time of day
+# Big-O: O(1)
+def status_message(package, status, time_of_day):
+    details = f"Deadline: {package.deadline}; Package group: {package.package_group}; Special Notes: {[package.special_notes]}"
+    if status == AT_HUB:
+        return f"Package {package.id} is at the HUB, as of {time_of_day}. {details}"
+    if status == EN_ROUTE:
+        return f"Package {package.id} is on truck {package.truck} and en route as of {time_of_day}. {details}"
+    return f"Package {package.id} is delivered as of {time_of_day}. {details}"
+
+
+# StatusIndex class, answers what the status of packages is at any time of day once the trucks have been routed,
+# without comparing the departure and delivery times of every package on each query. The departure and delivery
+# times of all packages are kept in sorted arrays, so the number of packages with each status at a time is found with
+# 2 binary searches. Packages leaving together on the same truck are kept in a group sorted by delivery time, so the
+# status of every package at a time is found with one binary search per group and a single sweep over the packages.
+# The index is a snapshot, it must be built again if the plan changes
+class StatusIndex:
+    # Builds the index from the departure and delivery times of every package of the scenario, in minutes since
+    # midnight. A package without a departure or delivery time has infinity in its place
+    # Big-O: O(n log n) -> n being the packages
+    def __init__(self, scenario):
+        self.packages = sorted(scenario.package_map, key=lambda p: p.id)
+        self.position = {p.id: i for i, p in enumerate(self.packages)}
+        self.departure = array('d', [inf if p.departure is None else minutes(p.departure) for p in self.packages])
+        self.delivered = array('d', [inf if p.delivered is None else minutes(p.delivered) for p in self.packages])
+        self.departures = array('d', sorted(self.departure))
+        self.deliveries = array('d', sorted(self.delivered))
+
+        # [departure, delivery times in order, positions of the packages in the same order] of the packages that left
+        # on the same truck at the same time
+        groups = {}
+        for i, p in enumerate(self.packages):
+            if p.departure is not None:
+                groups.setdefault((p.truck, self.departure[i]), []).append(i)
+        self.groups = []
+        for (truck, departure), positions in groups.items():
+            positions.sort(key=self.delivered.__getitem__)
+            self.groups.append([departure, array('d', [self.delivered[i] for i in positions]), positions])
+
+    # Returns the status of a package at a time of day, or None if there is no package with that id
+    # Big-O: O(1)
+    def status(self, package_id, time_of_day):
+        i = self.position.get(package_id)
+        if i is None:
+            return None
+        current = minutes(time_of_day)
+        if current < self.departure[i]:
+            return AT_HUB
+        if current < self.delivered[i]:
+            return EN_ROUTE
+        return DELIVERED
+
+    # Returns the number of packages [at the hub, en route, delivered] at a time of day
+    # Big-O: O(log n)
+    def counts(self, time_of_day):
+        current = minutes(time_of_day)
+        departed = bisect_right(self.departures, current)
+        delivered = bisect_right(self.deliveries, current)
+        return [len(self.packages) - departed, departed - delivered, delivered]
+
+    # Returns the status of every package at a time of day, in the same order as self.packages (by package id)
+    # Big-O: O(n + g log n) -> g being the groups of packages that left together
+    def statuses(self, time_of_day):
+        current = minutes(time_of_day)
+        statuses = [AT_HUB] * len(self.packages)
+        for departure, deliveries, positions in self.groups:
+            if current < departure:
+                continue
+            delivered = bisect_right(deliveries, current)
+            for k, i in enumerate(positions):
+                statuses[i] = DELIVERED if k < delivered else EN_ROUTE
+        return statuses
@@ -1,7 +1,12 @@
-from datetime import time
+from datetime import time, timedelta, datetime, date
+
+from Package import DAY_END, DAY_START, minutes
 
 
 class Truck:
+    # Attributes are declared in __slots__ instead of a per object __dict__, keeping each truck small in large fleets
+    __slots__ = ("truck", "avg_speed", "capacity", "departure_time", "return_time", "packages", "mileage", "route",
+                 "shift_start", "shift_end")
 
     # Initializes the truck class, only needing a numer, the rest of its
     # attributes must be initialized or filled in later
@@ -14,6 +19,26 @@ class Truck:
         self.return_time = None
         self.packages = []
         self.mileage = 0
+        self.route = []     # Stops made by the truck on its last route, in the order they were made
+        # the driver's shift on the truck in minutes since midnight, it may not leave before the start or return after
+        # the end of it. By default the whole day
+        self.shift_start = DAY_START
+        self.shift_end = DAY_END
+
+    # Returns [earliest, latest] minutes since midnight the truck may leave the hub. A truck with a preset departure
+    # time leaves exactly then, any other truck may leave at any time during its driver's shift
+    # Big-O: O(1)
+    def departure_window(self):
+        if type(self.departure_time) is time:
+            departure = minutes(self.departure_time)
+            return [departure, departure]
+        return [self.shift_start, self.shift_end]
+
+    # Returns the time the truck arrives after driving the given distance, starting at start_time, at its average speed
+    # Big-O: O(1)
+    def travel(self, start_time, distance):
+        travel_time = timedelta(hours=(distance / self.avg_speed))
+        return (datetime.combine(date.today(), start_time) + travel_time).time()
 
     # What to return when a truck object is printed.
     # Big-O: O(1)
@@ -21,14 +46,31 @@ class Truck:
         return f"Truck #: {self.truck}  ||Capacity: {len(self.packages)}/{self.capacity} ||Mileage: {self.mileage}  ||Departure: {self.departure_time}  ||Return: {self.return_time}"
 
 
+# Stop class, one stop on a truck's route, where every package going to the same address is delivered together
+class Stop:
+    __slots__ = ("distance_id", "packages", "arrival")
+
+    # Initializes the stop with the distance_id of its address, the packages delivered there and the arrival time
+    # Big-O: O(1)
+    def __init__(self, distance_id, packages, arrival):
+        self.distance_id = distance_id
+        self.packages = packages
+        self.arrival = arrival
+
+    # What to return when a stop is printed
+    # Big-O: O(n) -> n being the packages delivered at the stop
+    def __str__(self):
+        return f"Stop at distance mapping ID: {self.distance_id}  ||Arrival: {self.arrival}  ||Packages: {[p.id for p in self.packages]}"
+
+
 # Creates all 3 Trucks used in the project scenario, and assigns them a departure time, to meet project constraints.
 # Truck 3 is assigned a departure time later in runtime to coincide with truck 1's Return time, since we only have 2
-# drivers.
-# Everything below is also O(1) as it is constant.
-truck_1 = Truck(1)
-truck_1.departure_time = time(8, 00)
-truck_2 = Truck(2)
-truck_2.departure_time = time(9, 5)
-truck_3 = Truck(3)
-# Creates a truck list, so that we may iterate over it for ease of performing operations on all trucks.
-truck_list = [truck_1, truck_2, truck_3]
+# drivers. Returns a new truck list, so that we may iterate over it for ease of performing operations on all trucks.
+# Big-O: O(1) as it is constant.
+def create_fleet():
+    truck_1 = Truck(1)
+    truck_1.departure_time = time(8, 00)
+    truck_2 = Truck(2)
+    truck_2.departure_time = time(9, 5)
+    truck_3 = Truck(3)
+    return [truck_1, truck_2, truck_3]
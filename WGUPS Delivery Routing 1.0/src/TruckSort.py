@@ -1,304 +1,613 @@
+from array import array
 from datetime import time
+from math import inf
 
-from Distances import package_distance, hub_distance
-from HashMap import package_map
-from Truck import truck_list, truck_1, truck_2
+from Package import DAY_END
 
+# Number of trucks with room left above which fill_trucks() first partitions the unloaded packages into one zone per
+# truck with cluster_zones(), instead of letting each truck in turn take the packages nearest to it
+CLUSTER_TRUCKS = 10
+# Number of times cluster_zones() moves each zone's center to the address closest to the rest of its zone, and
+# reassigns the packages to the new centers
+CLUSTER_ROUNDS = 2
 
-# Creates a list of all packages that have not yet been loaded onto a
-# truck, for iterating over when sorting packages onto trucks
+# Creates a dict of package id -> package of all packages of the scenario that have not yet been loaded onto a
+# truck, in order of package id, for iterating over when sorting packages onto trucks. Packages are keyed by id, so a
+# package is taken off it in O(1) once it is loaded
 # Big-O: O(n log n) if we ignore the sorting operation, complexity would be O(n)
-def list_unloaded():
+def list_unloaded(scenario):
     packages = []
-    for bucket in package_map.buckets:
-        for p in bucket:
-            if not p.on_truck:
-                packages.append(p)
-    return sorted(packages, key=lambda package: package.id)
-
-
-# Assigns a global variable to the list returned by list_unloaded()
-unloaded_packages = list_unloaded()
-
-
-# Method to load all packages that are assigned to a specific truck
+    for p in scenario.package_map:
+        if not p.on_truck:
+            packages.append(p)
+    return {p.id: p for p in sorted(packages, key=lambda package: package.id)}
+
+
+# Adds newly arrived packages to the scenario's unloaded packages, keeping them in order of package id. Packages
+# usually arrive in id order, so the unloaded packages are only sorted again when one arrives out of order
+# Big-O: O(n) -> n being the packages given, O(m log m) when one arrives out of order, m being the unloaded packages
+def add_unloaded(scenario, packages):
+    if scenario.unloaded_packages is None:
+        scenario.unloaded_packages = {}
+    unloaded_packages = scenario.unloaded_packages
+    in_order = True
+    for p in packages:
+        if not p.on_truck:
+            if in_order and unloaded_packages and p.id not in unloaded_packages and \
+                    p.id < next(reversed(unloaded_packages)):
+                in_order = False
+            unloaded_packages[p.id] = p
+    if not in_order:
+        ordered = sorted(unloaded_packages.items())
+        unloaded_packages.clear()
+        unloaded_packages.update(ordered)
+
+
+# Method to load all packages that are assigned to a specific truck. Checks every unloaded package, or only the
+# packages given, which lets newly arrived packages be loaded without rechecking the rest
 # Big-O: O(n*m) -> 2 inputs  truck_list and unloaded_packages. However, Truck_list is,
 # for the purposes of this project, static, so the complexity can be considered O(n)
-def load_assigned_packages():
-    # temporary list to track packages for removal from the unloaded_packages list
+def load_assigned_packages(scenario, packages=None):
+    package_map = scenario.package_map
+    unloaded_packages = scenario.unloaded_packages
+    if packages is None:
+        packages = unloaded_packages.values()
+    # temporary list to track packages for removal from unloaded_packages
     packages_to_remove = []
-    for t in truck_list:                # iterates over the list of trucks
-        for p in unloaded_packages:     # iterates over the list of unloaded packages
+    for t in scenario.truck_list:       # iterates over the list of trucks
+        for p in packages:              # iterates over the list of unloaded packages
             # if the assigned truck id on a package (p.truck), matches the truck id (t.truck), it is
             # loaded on the truck and added to the temp list for removal from the unloaded list
-            if p.truck == t.truck:
+            if p.truck == t.truck and not p.on_truck:
                 t.packages.append(p)
                 package_map.update_attr(p.id, 'on_truck', True)
                 packages_to_remove.append(p)
                 continue
     # after finishing iterating through all packages and each truck,
-    # we remove all packages in the temp list from the unloaded list
+    # we remove all packages in the temp list from the unloaded packages
     for p in packages_to_remove:
-        unloaded_packages.remove(p)
-
-
-# This method is run before truck_sort, to ensure all packages with deadline besides EOD are prioritized on trucks that
-# have a driver at the start of the day.
-# This method references Truck objects directly instead of dynamically, and may need updating if the number of trucks changes
-# Big-O: O(n^2*m) ->  truck_list is ignored for complexity as we consider it to be relatively constant.
-# as package groups should be relatively rare and the nested loop should only run once (only 1 group of packages exit)
-# we can realistically consider this to be O(n log n), or O(n^2) depending on if we want to include the sorting operation
-# in our complexity evaluation, as early packages should be relatively short.
-def load_early_packages():
-    early_packages = []     # temp list for storing early packages for iterating over
-    for p in unloaded_packages:     # iterate over the list of unloaded packages
-        if type(p.deadline) == str or type(p.deadline) is None:     # if no deadline is set, move on to the next
-            continue
-        else:       # Otherwise append the package to early_packages
-            early_packages.append(p)
-    early_packages.sort(key=lambda ep: ep.deadline)     # Sort the early packages list by deadline
-    while_iterations = 0    # tracks iterations of the while loop
-    while early_packages:   # loop will iterate until list is empty, or the set iteration limit is reached
-        if while_iterations >= 50:  # Infinite loop prevention
-            print(
-                f"while loop in load_early_packages reached {while_iterations} iterations, terminating potential infinite loop.")
-            return
-        for p in early_packages:    # iterates over early packages
-            if p.on_truck:      # if statement to remove packages that have already been added to a truck. Redundancy check.
-                early_packages.remove(p)
-                unloaded_packages.remove(p)
+        del unloaded_packages[p.id]
+
+
+# Returns the root of a package id in a union-find dictionary of package id -> parent id, shortening the path to it
+# Big-O: O(log n) amortized
+def find_unit(parent, pid):
+    root = pid
+    while parent[root] != root:
+        root = parent[root]
+    while parent[pid] != root:
+        parent[pid], pid = root, parent[pid]
+    return root
+
+
+# Returns the units of the unloaded packages of the scenario (or of the packages given), the packages that have to be on the same truck, found
+# by following package_group transitively (a package grouped with a package grouped with a third puts all 3 in one
+# unit). Each unit is [packages, truck, complete], packages being the unit's unloaded packages in id order, truck the
+# id of the truck its other packages are already loaded on (None when none are), and complete False while a package
+# of the group has not arrived in the package map yet, when streaming a manifest. Units are in the order of their
+# first package id
+# Big-O: O(n log n) -> n being the unloaded packages
+def package_units(scenario, packages=None):
+    package_map = scenario.package_map
+    if packages is None:
+        packages = scenario.unloaded_packages.values()
+    parent = {}     # package id -> parent package id
+    for p in packages:
+        parent.setdefault(p.id, p.id)
+        for pid in p.package_group or ():
+            parent.setdefault(pid, pid)
+            a = find_unit(parent, p.id)
+            b = find_unit(parent, pid)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    members = {}    # root id -> ids in the unit
+    for pid in sorted(parent):
+        members.setdefault(find_unit(parent, pid), []).append(pid)
+
+    units = []
+    for ids in members.values():
+        packages = []
+        truck = None
+        complete = True
+        for pid in ids:
+            if pid not in package_map:
+                complete = False
                 continue
-            # If a package has a deadline before or equal to 10:30 AM, and does
-            # not have a pickup time (delayed packages) it will be added to truck 1
-            if (p.deadline <= time(10, 30)) and (p.pickup is None) and (
-                        # Also performs a capacity check to ensure there is room on the truck.
-                    (len(truck_1.packages) + len(p.package_group) + 1) <= truck_1.capacity):
-                truck_1.packages.append(p)
-                unloaded_packages.remove(p)
-                package_map.update_attr(p.id, 'on_truck', True)
-                package_map.update_attr(p.id, 'truck', 1)
-                # If the package also has a package group, the entire package group will be added, so long as
-                # there is space for it, as checked by the previous if statement
-                if p.package_group:
-                    for pid in p.package_group:     # Iterates over the package group
-                        p1 = package_map.retrieve(pid)  # Looks up each package id, and assigns a reference
-                        truck_1.packages.append(p1)        # adds the package to truck 1
-                        package_map.update_attr(p1.id, 'on_truck', True)    # Updates package status
-                        package_map.update_attr(p1.id, 'truck', 1)
-                        unloaded_packages.remove(p1)        # removes package from unloaded packages
-                        if p1 in early_packages:            # removes package if it is in early packages
-                            early_packages.remove(p1)
-                early_packages.remove(p)        # removes the package from the first for loop
-                # the while loop ensures that any packages skipped by index changes are not left
-                # behind, and loops until the list is empty
-
-            # Otherwise any package with a deadline after 10:30 or that has a deadline prior,
-            # but cannot be physically on the truck until a later time is loaded on truck 2
-            elif len(truck_2.packages) + len(p.package_group) + 1 <= truck_2.capacity:  # Capacity check
-                # All the same operations as above are performed, but on truck 2 instead.
-                truck_2.packages.append(p)
-                unloaded_packages.remove(p)
+            p = package_map.retrieve(pid)
+            if not p.on_truck:
+                packages.append(p)
+            elif truck is None:
+                truck = p.truck
+            elif p.truck != truck:
+                print(f"Packages grouped with package {pid} are already loaded on trucks {truck} and {p.truck}.")
+        if packages:
+            units.append([packages, truck, complete])
+    return units
+
+
+# Returns the trucks of the scenario in the order they leave the hub, trucks with a preset departure time in order of
+# departure, followed by the trucks leaving once a driver is free, in truck list order
+# Big-O: O(t log t) -> t being the trucks
+def trucks_by_departure(scenario):
+    preset = sorted((t for t in scenario.truck_list if type(t.departure_time) is time), key=lambda t: t.departure_time)
+    return preset + [t for t in scenario.truck_list if type(t.departure_time) is not time]
+
+
+# Loads the units of packages (see package_units()) with a deadline besides EOD before truck_sort, so that they are
+# prioritized on the trucks that leave first. A unit's time window runs from the latest earliest minute to the
+# earliest latest minute of its packages, and units are placed in order of the end of their window, each on the first
+# truck to leave that has room for the whole unit, that may leave within the unit's window (see
+# Truck.departure_window()), and that its other packages are already loaded on, if any. Units whose group has not
+# fully arrived yet (when streaming a manifest) wait for a later call. The room on the trucks is checked before
+# loading, and units that can't be placed are reported and left for truck_sort
+# Big-O: O(n log n + u*t) -> n being the unloaded packages, u the units with a deadline and t the trucks
+def load_early_packages(scenario):
+    package_map = scenario.package_map
+    unloaded_packages = scenario.unloaded_packages
+    trucks = trucks_by_departure(scenario)
+    windows = [t.departure_window() for t in trucks]
+    units = []
+    for packages, truck_id, complete in package_units(scenario):
+        latest = min(p.latest for p in packages)
+        if latest < DAY_END and complete:
+            units.append([max(p.earliest for p in packages), latest, packages, truck_id])
+    units.sort(key=lambda unit: (unit[1], unit[2][0].id))
+
+    # Feasibility check, every unit must fit on some truck, and all of them on the trucks together
+    room = sum(t.capacity - len(t.packages) for t in trucks)
+    needed = sum(len(unit[2]) for unit in units)
+    if needed > room:
+        print(f"{needed} packages with a deadline are waiting to be loaded, but the trucks only have room for {room}.")
+    largest = max((t.capacity for t in trucks), default=0)
+    for earliest, latest, packages, truck_id in units:
+        if len(packages) > largest:
+            print(f"Packages {[p.id for p in packages]} must be on the same truck, but no truck can hold {len(packages)} packages.")
+
+    for earliest, latest, packages, truck_id in units:
+        for t, window in zip(trucks, windows):
+            if truck_id is not None and t.truck != truck_id:
+                continue
+            if len(t.packages) + len(packages) > t.capacity:
+                continue
+            # the truck must be able to leave once every package has arrived at the hub, and before any deadline
+            if window[1] < earliest or window[0] >= latest:
+                continue
+            for p in packages:
+                t.packages.append(p)
                 package_map.update_attr(p.id, 'on_truck', True)
-                package_map.update_attr(p.id, 'truck', 2)
-                if p.package_group:
-                    for pid in p.package_group:
-                        p1 = package_map.retrieve(pid)
-                        truck_2.packages.append(p1)
-                        package_map.update_attr(p1.id, 'on_truck', True)
-                        package_map.update_attr(p1.id, 'truck', 2)
-                        unloaded_packages.remove(p1)
-                        if p1 in early_packages:
-                            early_packages.remove(p1)
-                early_packages.remove(p)
-
-        while_iterations += 1
-        # the iteration count is incremented at the end of each loop, as an infinite loop prevention measure
+                package_map.update_attr(p.id, 'truck', t.truck)
+                unloaded_packages.pop(p.id, None)
+            break
+        else:
+            print(f"No truck could be found for packages {[p.id for p in packages]}, leaving them for truck_sort.")
+
+
+# Groups the unloaded packages of the scenario (or the packages given) into stops for truck_sort() onto the given
+# truck, or for cluster_zones() when no truck is given. Packages that are
+# not part of a unit of several packages (see package_units()) and go to the same address (distance_id) form a single
+# stop, [distance_id, packages], so an address with many packages is only compared once. A unit of several packages
+# is its own stop, [None, packages], as it has to be loaded together. Units already partly loaded on another truck
+# are left out, and when no truck is given, every unit partly loaded already is. Stops are in the order of their first
+# package id, so ties are broken the same way as when every package was compared separately
+# Big-O: O(n log n) -> n being the unloaded packages, see package_units()
+def unloaded_stops(scenario, truck=None, packages=None):
+    package_distance_id = scenario.package_distance_id
+    stops = []
+    by_address = {}     # distance_id -> stop, for the stops of packages without a group
+    for packages, truck_id, complete in package_units(scenario, packages):
+        if truck_id is not None and (truck is None or truck_id != truck.truck):
+            continue
+        if len(packages) > 1:
+            stops.append([None, packages])
+            continue
+        p = packages[0]
+        distance_id = package_distance_id(p)
+        stop = by_address.get(distance_id)
+        if stop is None:
+            stop = by_address[distance_id] = [distance_id, []]
+            stops.append(stop)
+        stop[1].append(p)
+    return stops
+
+
+# Loads a package onto the truck, updates it in the package map, and removes it from the unloaded packages
+# Big-O: O(1)
+def load_package(scenario, truck, package):
+    package_map = scenario.package_map
+    truck.packages.append(package)
+    package_map.update_attr(package.id, 'on_truck', True)
+    package_map.update_attr(package.id, 'truck', truck.truck)
+    del scenario.unloaded_packages[package.id]
+
+
+# LoadingCandidates class, keeps the unloaded stops of the scenario (see unloaded_stops()) along with each stop's
+# distance to the nearest address already on a truck, for truck_sort(). The distance from every address is held in one
+# array indexed by distance_id, and is updated with a single row of the distance matrix each time a new address is
+# loaded, instead of comparing every unloaded package against every onboard package on each loading step.
+# Units of several packages keep their own nearest distance, the smallest average distance to the unit's packages.
+# Along with each distance the position of the onboard address it was first measured from is kept, so ties are broken
+# by the order the addresses were loaded and then by the order of the stops
+class LoadingCandidates:
+    # Builds the candidates from the unloaded stops, or the stops of the packages given, measuring distances from the
+    # addresses already on the truck, or from the hub if the truck has no packages loaded currently
+    # Big-O: O(n + a*m) -> n being the unloaded packages, a the distinct addresses on the truck and m the addresses
+    def __init__(self, scenario, truck, packages=None):
+        self.scenario = scenario
+        self.truck = truck
+        self.address_ids = []       # distance_ids of the address stops, in the order of their first package id
+        self.address_packages = {}  # distance_id -> packages going to the address
+        self.groups = []            # packages of each unit of several packages
+        self.group_distance = []    # nearest distance of each unit in groups
+        self.order = {}             # distance_id, or first package of a unit -> position of the stop, for breaking ties
+        for distance_id, packages in unloaded_stops(scenario, truck, packages):
+            if distance_id is None:
+                self.order[packages[0]] = len(self.order)
+                self.groups.append(packages)
+            else:
+                self.order[distance_id] = len(self.order)
+                self.address_ids.append(distance_id)
+                self.address_packages[distance_id] = packages
+        self.group_distance = [inf] * len(self.groups)
+        self.group_source = [0] * len(self.groups)
+        self.nearest = array('d', [inf]) * scenario.distance_map.size
+        self.source = array('q', [0]) * scenario.distance_map.size
+        self.onboard = set()    # distance_ids whose row has been added to nearest
+        self.from_hub = not truck.packages
+        if self.from_hub:
+            self.add_row(scenario.distance_map.row(0))
+        else:
+            for tp in truck.packages:
+                self.add_address(scenario.package_distance_id(tp))
+
+    # Returns the number of stops left to load
+    # Big-O: O(1)
+    def __len__(self):
+        return len(self.address_ids) + len(self.groups)
+
+    # Returns the average distance from a row of the distance matrix to the packages of a unit
+    # Big-O: O(g) -> g being the packages in the unit
+    def group_average(self, row, packages):
+        package_distance_id = self.scenario.package_distance_id
+        return sum(row[package_distance_id(p)] for p in packages) / len(packages)
+
+    # Lowers the nearest distance of every stop to its distance in the given row of the distance matrix, if smaller
+    # Big-O: O(m + g) -> m being the addresses and g the packages in groups
+    def add_row(self, row):
+        nearest = self.nearest
+        source = self.source
+        position = len(self.onboard)
+        for i in [i for i, closer in enumerate(map(float.__lt__, row, nearest)) if closer]:
+            nearest[i] = row[i]
+            source[i] = position
+        group_distance = self.group_distance
+        for i, packages in enumerate(self.groups):
+            distance = self.group_average(row, packages)
+            if distance < group_distance[i]:
+                group_distance[i] = distance
+                self.group_source[i] = position
+
+    # Adds an address that is now on the truck, so distances are measured from it. The first address loaded onto an
+    # empty truck replaces the distances from the hub
+    # Big-O: O(m + g)
+    def add_address(self, distance_id):
+        if distance_id in self.onboard:
+            return
+        if self.from_hub:
+            self.from_hub = False
+            self.nearest = array('d', [inf]) * len(self.nearest)
+            self.group_distance = [inf] * len(self.groups)
+            self.group_source = [0] * len(self.groups)
+        self.add_row(self.scenario.distance_map.row(distance_id))
+        self.onboard.add(distance_id)
+
+    # Returns the stop closest to the truck as [distance_id, packages], with a distance_id of None for a unit of several
+    # packages. Units that no longer fit on the truck are dropped. Returns None if no stop is left
+    # Big-O: O(n) -> n being the stops left, as a single pass over the nearest distances
+    def select(self):
+        space = self.truck.capacity - len(self.truck.packages)
+        for i in range(len(self.groups) - 1, -1, -1):
+            if len(self.groups[i]) > space:
+                del self.groups[i]
+                del self.group_distance[i]
+                del self.group_source[i]
+        best = None     # [distance, source, order, stop]
+        if self.address_ids:
+            distances = list(map(self.nearest.__getitem__, self.address_ids))
+            min_distance = min(distances)
+            # only the stops tied for the smallest distance are compared by source and order
+            distance_id = min((self.address_ids[i] for i, d in enumerate(distances) if d == min_distance),
+                              key=lambda d: (self.source[d], self.order[d]))
+            best = [min_distance, self.source[distance_id], self.order[distance_id],
+                    [distance_id, self.address_packages[distance_id]]]
+        for i, packages in enumerate(self.groups):
+            key = [self.group_distance[i], self.group_source[i], self.order[packages[0]]]
+            if best is None or key < best[:3]:
+                best = key + [[None, packages]]
+        if best is None:
+            return None
+        return best[3]
+
+    # Marks the given packages as loaded, removing them from their stops, and measures distances from their addresses
+    # Big-O: O(k*(n + m)) -> k being the packages loaded
+    def loaded(self, packages):
+        package_distance_id = self.scenario.package_distance_id
+        for p in packages:
+            distance_id = package_distance_id(p)
+            if p in self.order:
+                index = [packages[0] for packages in self.groups].index(p)
+                del self.groups[index]
+                del self.group_distance[index]
+                del self.group_source[index]
+            elif distance_id in self.address_packages:
+                stop = self.address_packages[distance_id]
+                if p in stop:
+                    stop.remove(p)
+                if not stop:
+                    del self.address_packages[distance_id]
+                    self.address_ids.remove(distance_id)
+        for p in packages:
+            self.add_address(package_distance_id(p))
 
 
 # Method to sort any packages not loaded by load_assigned_packages(), or
-# load_early_packages() onto trucks, based on distance
-# Big-O: O(n^2)
-def truck_sort(truck):
+# load_early_packages() onto trucks, based on distance. Packages are compared as address-level stops (see
+# unloaded_stops()) by their distance to the nearest address already on the truck, kept up to date by
+# LoadingCandidates, and all packages of the closest stop are loaded together, as far as the truck's capacity allows.
+# When a list of packages is given, such as a zone from cluster_zones(), only those packages are loaded
+# Big-O: O(n*s) -> n being the unloaded stops and s the stops loaded
+def truck_sort(scenario, truck, packages=None):
     # Value check. Allows passing of an int as long as it corresponds to a truck id, instead of just a truck obj
-    if truck is int:
-        for t in truck_list:
-            if t.truck == truck:
-                truck = t
-                break
-        if truck is int:
-            print(f"No Truck matching ID of {truck} Provide a valid Truck object or Truck ID")
+    if type(truck) is int:
+        truck_id = truck
+        truck = scenario.truck(truck_id)
+        if truck is None:
+            print(f"No Truck matching ID of {truck_id} Provide a valid Truck object or Truck ID")
             return
 
-    unproductive_loop_counter = 0   # infinite loop protection variable
+    candidates = LoadingCandidates(scenario, truck, packages)
     # While truck is below capacity, and there are still packages to load
-    while len(truck.packages) < truck.capacity and unloaded_packages:
-
-        # infinite loop detection, This counter should be adjusted depending on the number packages that are part of a group.
-        # if an infinite loop occurs due to the only packages left being in a group too large to fit on the truck, this statement
-        # will end the loop, leaving the truck below full capacity, but allowing the program to continue.
-        if unproductive_loop_counter > 50:
-            print(
-                f"A potential infinite loop has been detected and halted. Unproductive loop counter reached: {unproductive_loop_counter}.")
-            # packages = []
-            # for p in truck.packages:
-            # packages.append(p)
+    while len(truck.packages) < truck.capacity and candidates:
+        # If no stop is left that fits, such as the only packages left being in a group too large to fit on the
+        # truck, the truck is left below full capacity, allowing the program to continue.
+        stop = candidates.select()
+        if stop is None:
             return
 
-        # checks if any packages are already loaded onto the truck
-        if truck.packages:
-            min_distance = None
-            min_package = None
-            # Iterate over packages on truck to find an unloaded package
-            # with the smallest distance to any package already onboard
-            for tp in truck.packages:
+        distance_id, packages = stop
+        # a unit of several packages is loaded whole, it was only selected if the truck has room for all of it
+        if distance_id is not None:
+            # Loads every package going to the stop's address that still fits on the truck
+            packages = packages[:truck.capacity - len(truck.packages)]
+        for p in packages:
+            load_package(scenario, truck, p)
+        candidates.loaded(packages)
+
+        if len(truck.packages) > truck.capacity:
+            print(f"Truck {truck.truck} has been loaded beyond capacity, something went wrong.")
+            return
 
-                for p in unloaded_packages:     # Iterate over unloaded packages for comparison
-                    if p.on_truck:
-                        unproductive_loop_counter += 1
-                        print("You shouldn't see this message. package in unloaded_packages was already loaded")
-                        continue
 
-                    # checks if package is part of a group (needs to be on same truck)
-                    if p.package_group:
-
-                        # If the package group would exceed the capacity of a truck, the current loop iteration
-                        # is skipped and the unproductive loop counter is increased
-                        if len(truck.packages) + (len(p.package_group) + 1) > truck.capacity:
-                            unproductive_loop_counter += 1
-                            continue
-
-                        sum_distance = 0  # tracks the sum distance from location to all packages in group for averaging
-                        distance_list = [package_distance(tp, p)]  # Creates a list of distances
-                        for pid in p.package_group:     # Iterates over package group and adds each distance to the list
-                            p1 = package_map.retrieve(pid)
-                            distance_list.append(package_distance(tp, p1))
-                        for d in distance_list:     # adds all the distances in the list together
-                            sum_distance += d
-                        # Assigns the average distance of the group to the distance variable
-                        distance = sum_distance / len(distance_list)
-
-                    else:   # if not part of a group, assigns distance to package address
-                        distance = package_distance(tp, p)
-
-                    if min_distance is None:  # if no min_distance is set, assigns the current distance and package
-
-                        min_distance = distance
-                        min_package = p
-                    else:   # Otherwise a comparison is performed for the lowest distance.
-                        if distance < min_distance:     # If new distance is lower, it becomes the new min package
-                            min_distance = distance
-                            min_package = p
-            # Redundancy check incase for some reason min_package is still None, if unloaded
-            # packages is not empty will continue the while loop, otherwise returns
-            if min_package is None:
-                if unloaded_packages:
-                    continue
+# ZoneAssignment class, the state of cluster_zones() while it assigns stops to zones around a center address each,
+# one zone per truck, without going over the room left on each truck
+class ZoneAssignment:
+    # Initializes the zones of the given trucks with their centers (distance_ids) and the room left on each truck
+    # Big-O: O(k) -> k being the trucks
+    def __init__(self, scenario, trucks, centers):
+        self.scenario = scenario
+        self.trucks = trucks
+        self.centers = centers
+        self.room = [t.capacity - len(t.packages) for t in trucks]
+        self.zones = [[] for _ in trucks]    # packages assigned to each zone
+        self.second = []    # distance to the second nearest center of each address, filled in by nearest()
+
+    # Returns, for each of the distance_ids given, the distance to the nearest center of the zones given and the zone
+    # it belongs to. The distance to the second nearest center is kept in self.second. Each center's row of the
+    # distance matrix is compared against all addresses at once
+    # Big-O: O(k*a) -> k being the zones and a the addresses
+    def nearest(self, addresses, zones):
+        distance_map = self.scenario.distance_map
+        best = [inf] * len(addresses)
+        best_zone = [None] * len(addresses)
+        second = [inf] * len(addresses)
+        for z in zones:
+            distances = list(map(distance_map.row(self.centers[z]).__getitem__, addresses))
+            for i in [i for i, closer in enumerate(map(float.__lt__, distances, second)) if closer]:
+                if distances[i] < best[i]:
+                    second[i] = best[i]
+                    best[i] = distances[i]
+                    best_zone[i] = z
                 else:
-                    return
-            # Appends the minimum/best package to the truck and updates it, and removes it from the unloaded package list
-            truck.packages.append(min_package)
-            package_map.update_attr(min_package.id, 'on_truck', True)
-            package_map.update_attr(min_package.id, 'truck', truck.truck)
-            unloaded_packages.remove(min_package)
-
-            # if min_package is part of a package group, this statement ensures all packages
-            # in it's group are loaded onto the truck, updated in the package_map, and
-            # removed from the unloaded_packages list
-            if min_package.package_group:
-                for pid in min_package.package_group:
-                    p1 = package_map.retrieve(pid)
-                    truck.packages.append(p1)
-                    package_map.update_attr(p1.id, 'on_truck', True)
-                    package_map.update_attr(p1.id, 'truck', truck.truck)
-                    unloaded_packages.remove(p1)
-
-            # Checks for truck capacity
-            if len(truck.packages) == truck.capacity:
-                return
-            if len(truck.packages) > truck.capacity:
-                print(f"Truck {truck.truck} has been loaded beyond capacity, something went wrong.")
-                return
-
-        # if truck has no packages loaded currently, uses similar logic, but uses distance from hub instead of from other packages
-        else:
-            min_package = None
-            min_distance = None
-            for p in unloaded_packages:
-                if p.on_truck:
-                    unproductive_loop_counter += 1
-                    print("You shouldn't see this message. package in unloaded_packages was already loaded")
-                    continue
-
-                # if p (current package) is part of a package group, the distance of all
-                # packages in the group are averaged. If there are too many packages to fit
-                # in the truck's capacity, the current loop iteration is skipped.
-                if p.package_group:
-                    # print(f" if package group {p} || {p.package_group}")
-                    if len(truck.packages) + (len(p.package_group) + 1) > truck.capacity:
-                        unproductive_loop_counter += 1
+                    second[i] = distances[i]
+        self.second = second
+        return [best, best_zone]
+
+    # Puts packages into a zone, taking up room on its truck
+    # Big-O: O(p) -> p being the packages
+    def add(self, z, packages):
+        self.zones[z] += packages
+        self.room[z] -= len(packages)
+
+    # Assigns stops, [distance_id, packages] as returned by unloaded_stops(), to the zones with the nearest center
+    # that have room. Stops with the most to lose by not getting their nearest zone, the largest gap between their
+    # nearest and second nearest center, are assigned first. Packages going to one address may be split across
+    # zones when a zone fills up, the rest of them are assigned again to the nearest zone still open, while a unit of
+    # several packages goes whole to the nearest zone with room for all of it. Returns the packages that did not fit
+    # Big-O: O(r*k*a + s log s) -> r being the rounds needed to place split stops, usually 1 or 2, s the stops
+    def assign(self, stops):
+        distance_map = self.scenario.distance_map
+        package_distance_id = self.scenario.package_distance_id
+        pending = [[package_distance_id(packages[0]), distance_id is None, packages] for distance_id, packages in stops]
+        left_over = []
+        while pending:
+            zones = [z for z in range(len(self.trucks)) if self.room[z] > 0]
+            if not zones:
+                left_over += [p for stop in pending for p in stop[2]]
+                break
+            addresses = list(dict.fromkeys(stop[0] for stop in pending))
+            position = {distance_id: i for i, distance_id in enumerate(addresses)}
+            best, best_zone = self.nearest(addresses, zones)
+            second = self.second
+            pending.sort(key=lambda stop: best[position[stop[0]]] - second[position[stop[0]]])
+            overflow = []
+            for stop in pending:
+                distance_id, whole, packages = stop
+                z = best_zone[position[distance_id]]
+                if len(packages) <= self.room[z]:
+                    self.add(z, packages)
+                elif whole:
+                    fits = [z for z in zones if self.room[z] >= len(packages)]
+                    if not fits:
+                        print(f"Packages {[p.id for p in packages]} must be on the same truck, but no truck has room for them.")
+                        left_over += packages
                         continue
-                    sum_distance = 0
-                    distance_list = [hub_distance(p)]
-                    for pid in p.package_group:
-                        p1 = package_map.retrieve(pid)
-                        distance_list.append(hub_distance(p1))
-                    for d in distance_list:
-                        # print(f"variable d is {type(d)}")
-                        sum_distance += d
-                    distance = sum_distance / len(distance_list)
+                    self.add(min(fits, key=lambda z: distance_map.distance(self.centers[z], distance_id)), packages)
                 else:
-                    distance = hub_distance(p)
-
-                # if min_package has not been set yet, it uses the first package it checks.
-                if min_package is None:
-                    min_package = p
-                    min_distance = distance
-                else:
-                    # print(f"distance is {type(distance)} and min distance is {type(min_distance)}")
-                    if distance < min_distance:
-                        min_package = p
-                        min_distance = distance
-
-            truck.packages.append(min_package)
-            package_map.update_attr(min_package.id, 'on_truck', True)
-            package_map.update_attr(min_package.id, 'truck', truck.truck)
-            unloaded_packages.remove(min_package)
-
-            # if min_package is part of a package group, this statement ensures all packages
-            # in it's group are added loaded onto the truck, updated in the package_map, and
-            # removed from the unloaded_packages list
-            if min_package.package_group:
-                for pid in min_package.package_group:
-                    p1 = package_map.retrieve(pid)
-                    truck.packages.append(p1)
-                    package_map.update_attr(p1.id, 'on_truck', True)
-                    package_map.update_attr(p1.id, 'truck', truck.truck)
-                    unloaded_packages.remove(p1)
-
-            if len(truck.packages) == truck.capacity:
-                return
-            if len(truck.packages) > truck.capacity:
-                print(f"Truck {truck.truck} has been loaded beyond capacity, something went wrong.")
-                return
-
-
-# Method to perform all the necessary tasks to load all trucks in the truck list.
-# Big-O: O(n^2*m) -> load_early_packages has the largest complexity, so we use that, however truck_sort()
-# will always have a larger input and more operations, dominating most of this function, so we can also
-# realistically use its complexity of O(n^2) as the 'average' for this function.
-def load_trucks():
+                    room = self.room[z]
+                    if room > 0:
+                        self.add(z, packages[:room])
+                    overflow.append([distance_id, False, packages[room:]])
+            pending = overflow
+        return left_over
+
+    # Moves each zone's center to the address in the zone, or already on its truck, with the smallest total distance
+    # to the zone's packages and the packages already on its truck
+    # Big-O: O(k*u^2) -> k being the zones and u the distinct addresses in a zone, at most the truck's capacity
+    def recenter(self):
+        distance_map = self.scenario.distance_map
+        package_distance_id = self.scenario.package_distance_id
+        for z, truck in enumerate(self.trucks):
+            counts = {}     # distance_id -> packages going there
+            for p in truck.packages + self.zones[z]:
+                distance_id = package_distance_id(p)
+                counts[distance_id] = counts.get(distance_id, 0) + 1
+            if counts:
+                self.centers[z] = min(counts, key=lambda a: sum(distance_map.distance(a, b) * count
+                                                                 for b, count in counts.items()))
+
+
+# Partitions the unloaded packages of the scenario into one zone per truck given, with no more packages than the room
+# left on each truck, so that a large fleet is loaded by area instead of each truck in turn taking the packages nearest
+# to it, which left the last trucks with scattered leftovers. This is a capacity constrained k-medoids clustering on
+# the distance matrix: trucks already carrying packages are centered on them, the centers of empty trucks are spread
+# out by picking each time the address farthest from the hub and the centers picked so far, then the stops of the
+# unloaded packages are assigned to the nearest center with room, and each center is moved to the middle of its zone
+# CLUSTER_ROUNDS times. Returns [zones, left_over], zones holding the list of packages for each truck, and left_over
+# the packages that did not fit on any truck
+# Big-O: O(r*k*a + n log n) -> r being CLUSTER_ROUNDS, k the trucks, a the addresses and n the unloaded packages
+def cluster_zones(scenario, trucks):
+    distance_map = scenario.distance_map
+    package_distance_id = scenario.package_distance_id
+    stops = unloaded_stops(scenario)
+    # units with packages already on one of the trucks go to that truck's zone, before any other stop is assigned
+    positions = {t.truck: z for z, t in enumerate(trucks)}
+    pinned = [[positions[truck_id], packages] for packages, truck_id, complete in package_units(scenario)
+              if truck_id in positions]
+    addresses = list(dict.fromkeys(package_distance_id(packages[0]) for distance_id, packages in stops))
+    assignment = ZoneAssignment(scenario, trucks, [None] * len(trucks))
+    assignment.recenter()
+
+    # farthest first centers for the empty trucks, measured from the hub and every center already placed
+    farthest = list(map(distance_map.row(0).__getitem__, addresses))
+    for center in assignment.centers:
+        if center is not None:
+            farthest = list(map(min, farthest, map(distance_map.row(center).__getitem__, addresses)))
+    for z in range(len(trucks)):
+        if assignment.centers[z] is None:
+            i = farthest.index(max(farthest)) if addresses else None
+            assignment.centers[z] = addresses[i] if addresses else 0
+            farthest = list(map(min, farthest, map(distance_map.row(assignment.centers[z]).__getitem__, addresses)))
+
+    for round_number in range(CLUSTER_ROUNDS + 1):
+        if round_number > 0:
+            assignment.recenter()
+            assignment = ZoneAssignment(scenario, trucks, assignment.centers)
+        for z, packages in pinned:
+            assignment.add(z, packages)
+        left_over = assignment.assign(stops)
+    return [assignment.zones, left_over]
+
+
+# Method to perform all the necessary tasks to load all trucks in the truck list of the scenario.
+# Big-O: O(n*s) -> truck_sort() dominates this function, load_early_packages() only takes O(n log n)
+def load_trucks(scenario):
+    # Snapshot of the packages still to be loaded, shared by the loading steps below
+    scenario.unloaded_packages = list_unloaded(scenario)
     # Method calls
-    load_assigned_packages()
-    load_early_packages()
+    load_assigned_packages(scenario)
+    load_early_packages(scenario)
+    fill_trucks(scenario)
+
+
+# Returns the fewest of the given trucks with room for every unloaded package of the scenario, for cluster_zones().
+# Trucks already carrying packages come first, as their zones are centered on what they carry, then the others in the
+# order given. Spreading the packages over every truck of a fleet larger than the manifest needs left the zones
+# centered on outlying addresses with only a few packages each
+# Big-O: O(k log k) -> k being the trucks
+def zone_trucks(scenario, trucks):
+    needed = len(scenario.unloaded_packages)
+    chosen = []
+    room = 0
+    for t in sorted(trucks, key=lambda t: not t.packages):
+        if room >= needed:
+            break
+        chosen.append(t)
+        room += t.capacity - len(t.packages)
+    return chosen
+
+
+# Runs truck_sort() on every truck of the scenario to load the remaining packages by distance, and prints
+# the packages loaded onto each truck. When more than CLUSTER_TRUCKS trucks have room left, the packages are first
+# partitioned with cluster_zones() into zones for the fewest trucks that can hold them (see zone_trucks()), and each
+# of those trucks loads the packages of its own zone. Packages that did not fit in any zone, or that a zone's truck
+# could not take, are then offered to every truck with room left. Packages no truck could take are printed
+# Big-O: O(n^2) -> the complexity of truck_sort(), or O(r*k*a + n*c) with zones, c being the capacity of a truck
+def fill_trucks(scenario):
     packages_loaded = 0     # variable to count loaded packages
-    for truck in truck_list:  # iterate over the truck list
+    # Large fleets are first partitioned into zones, one per truck needed, each of those trucks only loads its own zone
+    zoned = False
+    open_trucks = [t for t in scenario.truck_list if len(t.packages) < t.capacity]
+    if len(open_trucks) > CLUSTER_TRUCKS:
+        zoned = True
+        trucks = zone_trucks(scenario, open_trucks)
+        truck_zones, left_over = cluster_zones(scenario, trucks)
+        for truck, zone in zip(trucks, truck_zones):
+            truck_sort(scenario, truck, zone)
+        if left_over:
+            print(f"{len(left_over)} packages did not fit in any zone, offering them to every truck with room left.")
+        # packages without a zone, or refused by their zone's truck, go to the trucks with room left, nearest first
+        for truck in scenario.truck_list:
+            if not scenario.unloaded_packages:
+                break
+            if len(truck.packages) < truck.capacity:
+                truck_sort(scenario, truck)
+    for truck in scenario.truck_list:  # iterate over the truck list
         print(f"\nTruck {truck.truck} loaded with following packages: ")
-        truck_sort(truck)       # sort packages for each truck
+        if not zoned:
+            truck_sort(scenario, truck)     # sort packages for each truck
         for p in truck.packages:    # count packages on each truck
             print(f"{p}")
             packages_loaded += 1
         print(f"Packages loaded on truck {truck.truck}: {len(truck.packages)}")
     print(f"\nTotal packages loaded: {packages_loaded}")
     # If loaded packages is equal to the length/current storage of the package map, print a success statement.
-    if packages_loaded == package_map.length:
+    if packages_loaded == scenario.package_map.length:
         print("All packages loaded successfully.\n")
+    elif scenario.unloaded_packages:
+        print(f"Packages {list(scenario.unloaded_packages)} could not be loaded onto any truck.\n")
+
+
+# Loads trucks from a manifest that arrives in batches of package file rows (e.g. from follow_package_file() in
+# HashMap.py), instead of waiting for the whole file. Each batch is added to the scenario's package_map as it arrives,
+# packages assigned to a specific truck are loaded straight away, and packages with an early deadline are placed by
+# load_early_packages(), so that work overlaps with the rest of the manifest arriving. Once the stream ends, the
+# remaining packages are sorted onto trucks by distance the same way load_trucks() does
+# Big-O: O(n^2) -> the complexity of truck_sort(), each batch costs O(b*m) for b packages in the batch
+def stream_load_trucks(scenario, row_batches):
+    if scenario.unloaded_packages is None:
+        scenario.unloaded_packages = list_unloaded(scenario)
+    for rows in row_batches:
+        packages = scenario.ingest_rows(rows)
+        add_unloaded(scenario, packages)
+        load_assigned_packages(scenario, packages)
+        load_early_packages(scenario)
+    fill_trucks(scenario)
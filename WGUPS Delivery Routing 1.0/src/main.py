@@ -1,6 +1,7 @@
 # Program written by:
 #      Michael Fasnacht
 #       Student ID: 001321050
+import argparse
 import sys
 from datetime import datetime
 
@@ -10,27 +11,56 @@ from datetime import datetime
 #   Written in February of 2023
 
 # imports
-from DeliveryRouting import route_delivery
-from Distances import read_addresses_csv
+from PlanSearch import PlanSearch
+from RouteImprovement import EXACT_STOP_LIMIT, improve_routes
+from Scenario import Scenario
+from Simulation import FleetSimulation
+from StatusIndex import StatusIndex, status_message
 from TruckSort import load_trucks
-from HashMap import package_map
-from Truck import truck_1, truck_2, truck_3, truck_list
 
 # Program Start
 
-# function to populate the address list for use with the distance table csv, and comparison with the package file
-read_addresses_csv()
+# Optional stages run after the greedy plan, each of them replaces the routes of the greedy plan before they are
+# printed. Without any option the greedy plan is printed as is
+parser = argparse.ArgumentParser(description="WGUPS Routing Program")
+parser.add_argument("--improve", action="store_true",
+                    help="shorten each truck's route with 2-opt, Or-opt and exact routing once it has been planned")
+parser.add_argument("--plan-search", type=int, nargs="?", const=20000, default=0, metavar="ITERATIONS",
+                    help="search the loads and routes of all trucks together with simulated annealing, for the given "
+                         "number of iterations (20000 if not given)")
+arguments = parser.parse_args()
+
+# The scenario holds the package, address and distance files along with the trucks, and loads each of them
+# the first time they are needed. Class located in Scenario.py
+scenario = Scenario()
+package_map = scenario.package_map
+truck_list = scenario.truck_list
 
 # Function to call the loading algorithms to sort packages onto trucks, Function located in TruckSort.py
-load_trucks()
+load_trucks(scenario)
+
+# Routes every truck together through the day, storing each truck's mileage. Truck 3 has no preset departure, so it
+# leaves once a driver returns with another truck, as there are only 2 drivers. None of its packages have a deadline
+# before EOD and package #9 cannot be delivered before its address is corrected at 10:20, so this works in our favor.
+# Class located in Simulation.py
+FleetSimulation(scenario).run()
 
-# variable to call the route_delivery function for every truck (passing a departure time if needed) and store the
-# total accumulated distance between all trucks. Function located in DeliveryRouting.py
-truck_1.mileage = route_delivery(truck_1, None)
-truck_2.mileage = route_delivery(truck_2, None)
-# Truck 3 cannot leave until truck 1 has returned, due to only having 3 drivers, none of its packages have
-# a deadline before EOD and package #9 cannot be delivered before 10:20 so this works in our favor.
-truck_3.mileage = route_delivery(truck_3, truck_1.return_time)
+# Shortens each truck's route with 2-opt and Or-opt moves, keeping every deadline and each truck's return time, and
+# prints the miles saved on each truck. Routes of up to EXACT_STOP_LIMIT stops, which is every route in the project
+# scenario, are then replaced by the shortest route possible. Only run with --improve. Function located in
+# RouteImprovement.py
+if arguments.improve:
+    improve_routes(scenario, time_budget=0.5, exact_limit=EXACT_STOP_LIMIT)
+
+# Searches the loads and routes of all trucks together for a shorter plan, starting from the plan above, and stores it
+# on the trucks if one was found. The search always tries the same moves for the same seed and number of iterations,
+# so the plan is the same on every run. Only run with --plan-search. Class located in PlanSearch.py
+plan_search_iterations = arguments.plan_search
+if plan_search_iterations:
+    plan_search = PlanSearch(scenario, seed=0)
+    plan_search.run(time_limit=None, max_iterations=plan_search_iterations)
+    if plan_search.apply():
+        print(f"Plan search found a plan of {round(plan_search.best_cost, 2)} miles in {plan_search.iterations} iterations.")
 
 # variable to track total mileage of all trucks, and a for loop to add the mileage from every truck
 total_distance = 0
@@ -47,6 +77,10 @@ for t in truck_list:
 # Prints the total accumulated distance between all 3 trucks. Must be below 140 according to project constraints.
 print(f"\n\nTotal Distance traveled by all trucks was {round(total_distance, 2)}")
 
+# Indexes the departure and delivery times of every package, so that the time lookups below are answered without
+# comparing the times of every package. Class located in StatusIndex.py
+status_index = StatusIndex(scenario)
+
 # While loop for user input to request specific data on trucks or packages.
 # Loop only ends when user selects to exit the program.
 # Big-O: O(n*(m+k)) -> depended on the number of loops performed by user, and the data structure of packages and trucks
@@ -78,10 +112,7 @@ while True:
 
         # Print all packages
         if choice2 == 1:
-            print_packages = []
-            for bucket in package_map.buckets:
-                for p in bucket:
-                    print_packages.append(p)
+            print_packages = list(package_map)
             print_packages.sort(key=lambda ps: ps.id)
             print("\nAll Packages:")
             for p in print_packages:
@@ -107,42 +138,22 @@ while True:
             except ValueError:
                 print("Invalid entry, returning to menu.")
                 continue
-            if time < package.departure:
-                print(
-                    f"Package {package.id} is at the HUB, as of {time}. Deadline: {package.deadline}; Package group: {package.package_group}; Special Notes: {[package.special_notes]}")
-            elif package.departure <= time < package.delivered:
-                print(
-                    f"Package {package.id} is on truck {package.truck} and en route as of {time}. Deadline: {package.deadline}; Package group: {package.package_group}; Special Notes: {[package.special_notes]}")
-            elif package.delivered <= time:
-                print(
-                    f"Package {package.id} is delivered as of {time}. Deadline: {package.deadline}; Package group: {package.package_group}; Special Notes: {[package.special_notes]}")
+            print(status_message(package, status_index.status(package.id, time), time))
             continue
 
         # Time-Status lookup, lookup the status of all packages at a specified time
         elif choice2 == 4:
-            print_packages = []
-            for bucket in package_map.buckets:
-                for p in bucket:
-                    print_packages.append(p)
-            print_packages.sort(key=lambda ps: ps.id)
             try:
                 time_lookup = input("Please enter a time. (in 24 hour, \"HH:MM\" format): ")
                 time = datetime.strptime(time_lookup, "%H:%M").time()
             except ValueError:
                 print("Invalid entry, returning to menu.")
                 continue
-            for package in print_packages:
-                if time < package.departure:
-                    print(
-                        f"Package {package.id} is at the HUB, as of {time}. Deadline: {package.deadline}; Package group: {package.package_group}; Special Notes: {[package.special_notes]}")
-                elif package.departure <= time < package.delivered:
-                    print(
-                        f"Package {package.id} is on truck {package.truck} and en route as of {time}. Deadline: {package.deadline}; Package group: {package.package_group}; Special Notes: {[package.special_notes]}")
-                elif package.delivered <= time:
-                    print(
-                        f"Package {package.id} is delivered as of {time}. Deadline: {package.deadline}; Package group: {package.package_group}; Special Notes: {[package.special_notes]}")
-
-                continue
+            for package, status in zip(status_index.packages, status_index.statuses(time)):
+                print(status_message(package, status, time))
+            at_hub, en_route, delivered = status_index.counts(time)
+            print(f"\nAs of {time}: {at_hub} packages at the HUB, {en_route} en route, {delivered} delivered.")
+            continue
 
         # Return to first menu
         elif choice2 == 5: